@@ -0,0 +1,179 @@
+import os
+import pandas as pd
+
+# Optional dependency, only required when the parquet storage backend is selected
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+class ColumnarPriceStore:
+    """
+    Columnar price storage: parquet files partitioned by exchange and year.
+    Layout: {path}/{table}/exchange=NASDAQ/year=2024/data.parquet
+    Rows are sorted by stock and date within a file, so row group statistics allow skipping on the stock filter
+    in addition to the partition pruning on exchange and year.
+    """
+
+    def __init__(self, path, table, value_columns, compression="zstd", row_group_size=65536):
+        if pa is None:
+            print("Error: the parquet storage backend requires pyarrow (pip install pyarrow)")
+            exit(0)
+
+        self.path = os.path.join(path, table)
+        self.value_columns = value_columns
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.schema = pa.schema(
+            [("stock", pa.string()), ("date", pa.timestamp("us"))]
+            + [(column, pa.float64()) for column in value_columns]
+        )
+
+    def partition_file(self, exchange, year):
+        return os.path.join(self.path, f"exchange={exchange}", f"year={year}", "data.parquet")
+
+    def partition_files(self):
+        if not os.path.isdir(self.path):
+            return []
+        files = []
+        for root, _, filenames in os.walk(self.path):
+            files.extend(os.path.join(root, name) for name in filenames if name == "data.parquet")
+        return files
+
+    def empty_frame(self):
+        return pd.DataFrame({name: pd.Series(dtype=field.type.to_pandas_dtype())
+                             for name, field in zip(self.schema.names, self.schema)})
+
+    def read_file(self, file):
+        return pq.read_table(file, schema=self.schema).to_pandas()
+
+    def write_file(self, file, df):
+        # Write to a temporary file first so that an interrupted write does not corrupt the partition
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        df = df.sort_values(["stock", "date"])
+        table = pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+        pq.write_table(table, f"{file}.tmp", compression=self.compression, row_group_size=self.row_group_size)
+        os.replace(f"{file}.tmp", file)
+
+    def write(self, prices, replaced_stocks=None):
+        """
+        Upsert price rows: rows for an existing stock and date replace the stored ones.
+        With replaced_stocks, the stored rows of these stocks are replaced by the new ones. The partitions with
+        new rows are written first, each file in one step, so an interrupted write never leaves a replaced stock
+        without prices (although it may leave its old rows in the partitions which were not rewritten yet).
+
+        Args:
+        prices (list or pd.DataFrame): Price rows with stock, date, value columns and optionally exchange
+        replaced_stocks (list): Stocks whose stored rows are all replaced by the new rows
+
+        Returns:
+        int: Number of rows written
+        """
+        df = pd.DataFrame(prices)
+        if df.empty:
+            if replaced_stocks:
+                self.delete(replaced_stocks)
+            return 0
+
+        if "exchange" not in df.columns:
+            df["exchange"] = "OTHER"
+        df["date"] = pd.to_datetime(df["date"])
+        df["year"] = df["date"].dt.year
+
+        written_files = set()
+        for (exchange, year), new_rows in df.groupby(["exchange", "year"]):
+            file = self.partition_file(exchange, year)
+            if os.path.exists(file):
+                stored_rows = self.read_file(file)
+                if replaced_stocks:
+                    stored_rows = stored_rows[~stored_rows["stock"].isin(list(replaced_stocks))]
+                new_rows = pd.concat([stored_rows, new_rows[self.schema.names]])
+                new_rows = new_rows.drop_duplicates(["stock", "date"], keep="last")
+            self.write_file(file, new_rows)
+            written_files.add(file)
+
+        if replaced_stocks:
+            self.delete(replaced_stocks, skipped_files=written_files)
+
+        return len(df)
+
+    def read(self, stocks=None, start_date=None, end_date=None, columns=None):
+        """
+        Read price rows with the stock and date predicates pushed down to the parquet scan.
+
+        Args:
+        stocks (list): Stock codes to read, None for all
+        start_date (datetime or str): Earliest date (inclusive)
+        end_date (datetime or str): Latest date (inclusive)
+        columns (list): Columns to read, all by default
+
+        Returns:
+        pd.DataFrame: Price rows ordered by stock and date
+        """
+        columns = self.schema.names if columns is None else columns
+        if not self.partition_files():
+            return self.empty_frame()[columns]
+
+        dataset = ds.dataset(self.path, format="parquet", partitioning="hive", schema=self.schema.append(
+            pa.field("exchange", pa.string())).append(pa.field("year", pa.int32())))
+
+        conditions = []
+        if stocks is not None:
+            conditions.append(ds.field("stock").isin(list(stocks)))
+        if start_date is not None:
+            start_date = pd.Timestamp(start_date)
+            conditions.append(ds.field("year") >= start_date.year)
+            conditions.append(ds.field("date") >= pa.scalar(start_date.to_pydatetime(), pa.timestamp("us")))
+        if end_date is not None:
+            end_date = pd.Timestamp(end_date)
+            conditions.append(ds.field("year") <= end_date.year)
+            conditions.append(ds.field("date") <= pa.scalar(end_date.to_pydatetime(), pa.timestamp("us")))
+
+        scan_filter = None
+        for condition in conditions:
+            scan_filter = condition if scan_filter is None else scan_filter & condition
+
+        table = dataset.to_table(columns=columns, filter=scan_filter)
+        df = table.to_pandas()
+        if "stock" in columns and "date" in columns:
+            df = df.sort_values(["stock", "date"], kind="stable").reset_index(drop=True)
+        return df
+
+    def delete(self, stocks=None, skipped_files=()):
+        """
+        Delete stored rows for the stocks, or everything if stocks is None, except in the skipped partition files
+        """
+        for file in self.partition_files():
+            if file in skipped_files:
+                continue
+            if stocks is None:
+                os.remove(file)
+                continue
+            df = self.read_file(file)
+            remaining = df[~df["stock"].isin(list(stocks))]
+            if len(remaining) == 0:
+                os.remove(file)
+            elif len(remaining) < len(df):
+                self.write_file(file, remaining)
+
+    def date_ranges(self):
+        """
+        Returns:
+        dict: {stock: (first_date, last_date, last_close)}
+        """
+        df = self.read(columns=["stock", "date", "close"])
+        date_ranges = dict()
+        if df.empty:
+            return date_ranges
+        firsts = df.groupby("stock").head(1).set_index("stock")
+        lasts = df.groupby("stock").tail(1).set_index("stock")
+        for stock, last in lasts.iterrows():
+            date_ranges[stock] = (
+                firsts.loc[stock, "date"].to_pydatetime(),
+                last["date"].to_pydatetime(),
+                float(last["close"])
+            )
+        return date_ranges
@@ -6,12 +6,30 @@ from peewee import DoesNotExist
 from datetime import timedelta
 import pandas as pd
 import sys
-from playhouse.shortcuts import chunked
 
 from libs.read_settings import read_config
+from libs.columnar import ColumnarPriceStore
+from libs.panel import PricePanel
+from libs.dtypes import apply_frame_dtypes
 config = read_config()
 
-db = SqliteDatabase("stocks.db")
+# WAL journaling with relaxed syncing and a larger page cache for the bulk price writes
+db = SqliteDatabase("stocks.db", pragmas={
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64000,  # in KiB, 64MB
+    "temp_store": "memory",
+})
+
+# Columnar store used instead of the SQLite price table when the parquet backend is configured
+price_store = None
+
+# Preloaded prices answering the point lookups of the simulator without queries, see preload_prices
+price_cache = None
+price_cache_stocks = set()
+
+# Stock codes per query of load_price_panel, below the SQLite limit of 999 parameters
+price_panel_chunk_size = 900
 
 
 class BaseModel(Model):
@@ -29,21 +47,77 @@ class Stock(BaseModel):
     market_cap = FloatField(null=True)
     date = DateTimeField(default=datetime.datetime.now)
 
-class Price(BaseModel):
+class StockPrice(BaseModel):
+    """
+    Daily OHLCV of the stocks, the single price store shared by the scanner and the simulator
+    """
     stock = CharField()
     date = DateTimeField()
     open = FloatField()
     high = FloatField()
     low = FloatField()
     close = FloatField()
+    volume = FloatField()
 
     class Meta:
         indexes = (
             (('stock', 'date'), True),  # Unique index
         )
 
-def create_price_table():
-    Price.create_table()
+
+def get_columnar_store():
+    """
+    Get the columnar price store if the parquet storage backend is configured.
+
+    Returns:
+    ColumnarPriceStore: The store, None when prices are kept in SQLite
+    """
+    global price_store
+
+    storage = config["storage"]
+    if storage["backend"] != "parquet":
+        return None
+
+    if price_store is None:
+        price_store = ColumnarPriceStore(
+            storage["parquet_path"], StockPrice._meta.table_name, ["open", "high", "low", "close", "volume"],
+            compression=storage["parquet_compression"]
+        )
+    return price_store
+
+
+def bulk_write_prices(prices, model=StockPrice):
+    """
+    Upsert price rows in one transaction, going from a dataframe to SQLite without per-row python objects.
+    Rows for an existing stock and date are replaced, so re-writing the same bars is idempotent.
+
+    Args:
+    prices (pd.DataFrame or list): Price rows with stock, date and OHLCV columns.
+                                   Exchange is optional and only used for partitioning in the columnar store.
+    model: Price model to write to
+
+    Returns:
+    int: Number of rows written
+    """
+    df = prices if isinstance(prices, pd.DataFrame) else pd.DataFrame(prices)
+    if len(df) == 0:
+        return 0
+
+    store = get_columnar_store()
+    if store is not None:
+        return store.write(df)
+
+    columns = [field.column_name for field in model._meta.sorted_fields if field.column_name != "id"]
+    df = df[columns].copy()
+    # Same text format as peewee uses for DateTimeField
+    df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d %H:%M:%S")
+    records = list(zip(*(df[column].tolist() for column in columns)))
+
+    sql = (f"INSERT OR REPLACE INTO {model._meta.table_name} ({', '.join(columns)}) "
+           f"VALUES ({', '.join(['?'] * len(columns))})")
+    with db.atomic():
+        db.cursor().executemany(sql, records)
+    return len(records)
 
 
 def create_stock_table():
@@ -51,16 +125,21 @@ def create_stock_table():
 
 
 def check_earliest_price_date():
+    store = get_columnar_store()
+    if store is not None:
+        dates = store.read(columns=["date"])["date"]
+        return dates.min().date() if len(dates) > 0 else None
+
     try:
-        earliest_price = Price.select(fn.MIN(Price.date)).scalar()
+        earliest_price = StockPrice.select(fn.MIN(StockPrice.date)).scalar()
         if earliest_price:
-            return earliest_price.date()  # Return just the date part
+            return StockPrice.date.python_value(earliest_price).date()  # Return just the date part
         return None
-    except Price.DoesNotExist:
+    except StockPrice.DoesNotExist:
         return None
     except peewee.OperationalError:
         print("Price table does not exist. Creating it now.")
-        create_price_table()
+        create_stock_price_table()
         return None
 
 def get_price_from_db(stock, date, look_backwards=True):
@@ -82,14 +161,35 @@ def get_price_from_db(stock, date, look_backwards=True):
     SystemExit: If look_backwards is False and no future price data is found.
     """
     try:
-        if look_backwards:
-            price_data = Price.select().where(
-                (Price.stock == stock) & (Price.date <= date)
-            ).order_by(Price.date.desc()).first()
+        store = get_columnar_store()
+        if stock in price_cache_stocks:
+            price_data = None
+            if stock in price_cache:
+                index = price_cache.locate(stock, date, look_backwards)
+                if index is not None:
+                    price_data = StockPrice(
+                        stock=stock, date=pd.Timestamp(price_cache.timestamps[index]).to_pydatetime(),
+                        **{field: float(price_cache.values[field][index]) for field in price_cache.fields}
+                    )
+        elif store is not None:
+            if look_backwards:
+                rows = store.read([stock], end_date=date).tail(1)
+            else:
+                rows = store.read([stock], start_date=date).head(1)
+            price_data = None
+            if len(rows) > 0:
+                row = rows.iloc[0]
+                price_data = StockPrice(stock=stock, date=row["date"].to_pydatetime(), open=float(row["open"]),
+                                        high=float(row["high"]), low=float(row["low"]), close=float(row["close"]),
+                                        volume=float(row["volume"]))
+        elif look_backwards:
+            price_data = StockPrice.select().where(
+                (StockPrice.stock == stock) & (StockPrice.date <= date)
+            ).order_by(StockPrice.date.desc()).first()
         else:
-            price_data = Price.select().where(
-                (Price.stock == stock) & (Price.date >= date)
-            ).order_by(Price.date.asc()).first()
+            price_data = StockPrice.select().where(
+                (StockPrice.stock == stock) & (StockPrice.date >= date)
+            ).order_by(StockPrice.date.asc()).first()
 
         if price_data:
             date_is_changed = False
@@ -116,29 +216,46 @@ def get_price_from_db(stock, date, look_backwards=True):
         print(f"(!) no price data found for {stock}")
         return None
 
-def delete_all_prices():
-    Price.delete().execute()
-
-def bulk_add_prices(prices_list):
-    with db.atomic():
-        for batch in chunked(prices_list, 100):
-            Price.insert_many(batch).execute()
-
 def delete_all_stocks(exchange):
     query = Stock.delete().where(Stock.exchange == exchange)
     query.execute()
 
 
 def bulk_add_stocks(stocks_list_of_dict):
+    """
+    Insert stock rows in chunks, consuming any iterable (e.g. a generator of parsed rows) without materializing it
+
+    Returns:
+    int: Number of rows inserted
+    """
     list_length = 100
     # Workaround, see https://github.com/coleifer/peewee/issues/948
-    chunks = [
-        stocks_list_of_dict[x : x + list_length]
-        for x in range(0, len(stocks_list_of_dict), list_length)
-    ]
-    for chunk in chunks:
+    added_number = 0
+    chunk = []
+    for stock in stocks_list_of_dict:
+        chunk.append(stock)
+        if len(chunk) == list_length:
+            with db.atomic():
+                Stock.insert_many(chunk).execute()
+            added_number += len(chunk)
+            chunk = []
+    if chunk:
         with db.atomic():
             Stock.insert_many(chunk).execute()
+        added_number += len(chunk)
+    return added_number
+
+
+def replace_stocks(exchange, stocks_list_of_dict):
+    """
+    Replace the stocks of an exchange in one transaction, so a failed update keeps the previous list
+
+    Returns:
+    int: Number of rows inserted
+    """
+    with db.atomic():
+        delete_all_stocks(exchange)
+        return bulk_add_stocks(stocks_list_of_dict)
 
 
 def get_stocks(exchange=None, price_min=None, price_max=None, min_volume=None, min_market_cap=None, codes=None):
@@ -206,11 +323,29 @@ def get_historical_prices(stock, end_date, days=60):
     df: A dataframe containing price data.
     """
     start_date = end_date - timedelta(days=days)
-    query = Price.select().where(
-        (Price.stock == stock) &
-        (Price.date >= start_date) &
-        (Price.date <= end_date)
-    ).order_by(Price.date)
+
+    if stock in price_cache_stocks:
+        df = pd.DataFrame(columns=['timestamp', 'open', 'high', 'low', 'close'])
+        if stock in price_cache:
+            first, last = price_cache.date_range(stock, start_date, end_date)
+            df = pd.DataFrame({'timestamp': price_cache.timestamps[first:last]})
+            for field in ['open', 'high', 'low', 'close']:
+                df[field] = price_cache.values[field][first:last]
+        df.set_index('timestamp', inplace=True)
+        return df
+
+    store = get_columnar_store()
+    if store is not None:
+        df = store.read([stock], start_date, end_date, columns=["date", "open", "high", "low", "close"])
+        df = df.rename(columns={"date": "timestamp"})
+        df.set_index('timestamp', inplace=True)
+        return df
+
+    query = StockPrice.select().where(
+        (StockPrice.stock == stock) &
+        (StockPrice.date >= start_date) &
+        (StockPrice.date <= end_date)
+    ).order_by(StockPrice.date)
 
     values = [
         {
@@ -231,33 +366,88 @@ def get_historical_prices(stock, end_date, days=60):
     return df
 
 
-class StockPrice(BaseModel):
-    stock = CharField()
-    date = DateTimeField()
-    open = FloatField()
-    high = FloatField()
-    low = FloatField()
-    close = FloatField()
-    volume = FloatField()
-
-    class Meta:
-        indexes = (
-            (('stock', 'date'), True),  # Unique index
-        )
-
-
 def create_stock_price_table():
     StockPrice.create_table()
 
 
 def delete_all_stock_prices():
+    store = get_columnar_store()
+    if store is not None:
+        store.delete()
+        return
     StockPrice.delete().execute()
 
 
-def bulk_add_stock_prices(prices_list):
+def delete_stock_prices(stocks):
+    store = get_columnar_store()
+    if store is not None:
+        store.delete(stocks)
+        return
+    StockPrice.delete().where(StockPrice.stock.in_(list(stocks))).execute()
+
+
+def replace_stock_prices(stocks, prices):
+    """
+    Replace all the stored prices of the stocks with the new rows (e.g. the full history after a split).
+    In SQLite the delete and the insert are one transaction, so a failed insert keeps the stored prices.
+    The columnar store writes the new rows before dropping the old ones (see ColumnarPriceStore.write).
+
+    Args:
+    stocks (list): Stock codes whose stored prices are replaced
+    prices (pd.DataFrame or list): New price rows, also for other stocks which are only upserted
+
+    Returns:
+    int: Number of rows written
+    """
+    store = get_columnar_store()
+    if store is not None:
+        return store.write(prices, replaced_stocks=stocks)
+
+    # The transaction of bulk_write_prices becomes a savepoint of this one
     with db.atomic():
-        for batch in chunked(prices_list, 100):
-            StockPrice.insert_many(batch).execute()
+        StockPrice.delete().where(StockPrice.stock.in_(list(stocks))).execute()
+        return bulk_write_prices(prices)
+
+
+def bulk_add_stock_prices(prices_list):
+    # Replace on conflict so that re-fetched overlapping bars are upserted
+    bulk_write_prices(prices_list)
+
+
+def get_stock_price_date_ranges():
+    """
+    Get the stored price history bounds for every stock in the StockPrice table.
+
+    Returns:
+    dict: {stock: (first_date, last_date, last_close)} used to plan incremental price syncs
+    """
+    store = get_columnar_store()
+    if store is not None:
+        return store.date_ranges()
+
+    bounds = (
+        StockPrice.select(
+            StockPrice.stock,
+            fn.MIN(StockPrice.date).alias('first_date'),
+            fn.MAX(StockPrice.date).alias('last_date'),
+        )
+        .group_by(StockPrice.stock)
+        .alias('bounds')
+    )
+    query = (
+        StockPrice.select(bounds.c.stock, bounds.c.first_date, bounds.c.last_date, StockPrice.close)
+        .join(bounds, on=((StockPrice.stock == bounds.c.stock) & (StockPrice.date == bounds.c.last_date)))
+        .tuples()
+    )
+
+    date_ranges = dict()
+    for stock, first_date, last_date, last_close in query:
+        date_ranges[stock] = (
+            StockPrice.date.python_value(first_date),
+            StockPrice.date.python_value(last_date),
+            last_close
+        )
+    return date_ranges
 
 
 def get_stock_price_data(stock, start_date, end_date=None):
@@ -272,6 +462,14 @@ def get_stock_price_data(stock, start_date, end_date=None):
     Returns:
     tuple: (price_df, volume_df) containing price and volume data
     """
+    store = get_columnar_store()
+    if store is not None:
+        df = store.read([stock], start_date, end_date, columns=['date', 'open', 'high', 'low', 'close', 'volume'])
+        if len(df) == 0:
+            return None, None
+        df = apply_frame_dtypes(df.rename(columns={'date': 'timestamp'})[['timestamp', 'open', 'high', 'low', 'close', 'volume']])
+        return df[['timestamp', 'open', 'high', 'low', 'close']], df[['timestamp', 'volume']]
+
     query = StockPrice.select().where(
         (StockPrice.stock == stock) &
         (StockPrice.date >= start_date)
@@ -288,20 +486,90 @@ def get_stock_price_data(stock, start_date, end_date=None):
     df = pd.DataFrame([(p.date, p.open, p.high, p.low, p.close, p.volume)
                        for p in query],
                       columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df = apply_frame_dtypes(df)
 
     price_df = df[['timestamp', 'open', 'high', 'low', 'close']]
     volume_df = df[['timestamp', 'volume']]
 
     return price_df, volume_df
 
-def initialize_price_database():
+def load_price_panel(stocks=None, start_date=None, end_date=None, policy=None):
     """
-    Initialize the stock price database by creating the table if it doesn't exist
-    and clearing any existing data.
+    Load the prices of a universe of stocks with one ordered query (or one columnar read) into a panel.
+
+    Args:
+    stocks (list): Stock codes to load, None for all stored stocks
+    start_date (datetime or str): Start date
+    end_date (datetime or str, optional): End date
+    policy (str, optional): Dtype policy of the panel arrays (see libs.dtypes), the configured one by default
+
+    Returns:
+    PricePanel: Contiguous OHLCV arrays keyed by stock
     """
-    try:
-        create_stock_price_table()
-        delete_all_stock_prices()  # Clear once at the beginning
-    except peewee.OperationalError:
-        print("Table exists, clearing data...")
-        delete_all_stock_prices()
\ No newline at end of file
+    store = get_columnar_store()
+    if store is not None:
+        df = store.read(stocks, start_date, end_date)
+    else:
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(StockPrice.date.db_value(start_date))
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(StockPrice.date.db_value(end_date))
+
+        # The requested stocks are filtered in the query, in chunks of codes, and all the stocks are scanned otherwise
+        if stocks is None:
+            chunks = [None]
+        else:
+            codes = sorted(set(stocks))
+            chunks = [codes[i:i + price_panel_chunk_size] for i in range(0, len(codes), price_panel_chunk_size)]
+
+        frames = []
+        for chunk in chunks:
+            chunk_conditions, chunk_params = list(conditions), list(params)
+            if chunk is not None:
+                chunk_conditions.append(f"stock IN ({', '.join('?' * len(chunk))})")
+                chunk_params.extend(chunk)
+            where = f"WHERE {' AND '.join(chunk_conditions)}" if chunk_conditions else ""
+            sql = (f"SELECT stock, date, open, high, low, close, volume FROM {StockPrice._meta.table_name} "
+                   f"{where} ORDER BY stock, date")
+            frames.append(pd.read_sql_query(sql, db.connection(), params=chunk_params))
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=["stock", "date", "open", "high", "low", "close", "volume"])
+        df["date"] = pd.to_datetime(df["date"], format="ISO8601")
+
+    return PricePanel.from_frame(df, policy)
+
+
+def preload_prices(stocks, start_date=None):
+    """
+    Load the prices of the stocks into memory, so that get_price_from_db and get_historical_prices
+    are answered with binary searches over the sorted arrays instead of a query per call.
+    The cache is authoritative for the preloaded stocks, so reload it after the stored prices change.
+
+    Args:
+    stocks (list): Stock codes to preload
+    start_date (datetime or str, optional): Earliest date to keep in memory
+    """
+    global price_cache, price_cache_stocks
+
+    # Full precision, as the simulated trades are priced from the cache; only the rows of the stocks are read
+    price_cache = load_price_panel(stocks, start_date, policy="full")
+    price_cache_stocks = set(stocks)
+
+
+def initialize_price_database(full_rebuild=False):
+    """
+    Initialize the stock price database by creating the table if it doesn't exist.
+    Existing data is kept so that only the missing bars are fetched, unless a full rebuild is requested.
+
+    Args:
+    full_rebuild (bool): Clear all the stored prices so that the full history is fetched again
+    """
+    create_stock_price_table()
+    if full_rebuild:
+        print("Clearing the stored prices for a full rebuild...")
+        delete_all_stock_prices()
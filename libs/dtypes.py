@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+from libs.read_settings import read_config
+from libs.techanalysis import MA, RSI, ATR, fisher_distance, coppock_curve, lucid_sar, td_indicators
+
+config = read_config()
+
+# Dtypes of the prices held in memory (the panel and the price frames); stored prices always keep full precision.
+# compact: float32 OHLC has about 7 significant digits, so prices in cents stay distinct up to ~100k
+# and the comparisons of the bars (TD setups, streaks) do not change. Volumes are whole numbers of shares,
+# a volume above the uint32 range (~4.29 billion) or a fractional one keeps the whole array in float64.
+# Dates are days, pandas frames hold them with the second resolution (the coarsest one pandas supports).
+# Indicators are calculated in float64 from the compact prices.
+DTYPE_POLICIES = {
+    "full": {"price": np.float64, "volume": np.float64, "date": "datetime64[ns]"},
+    "compact": {"price": np.float32, "volume": np.uint32, "date": "datetime64[D]"},
+}
+
+# Largest difference of an indicator calculated from the compact prices to the full precision one.
+# Price level indicators are compared relative to the close of the bar (|compact - full| <= tolerance * close),
+# the oscillators in their own units. The float32 rounding of a price is up to 6e-8 of it.
+# The discrete values (TD setup, direction and countdowns, Lucid SAR trend) are expected to be equal:
+# the comparisons of the prices do not change, but a level computed from them can be tied with a price in one
+# precision and not in the other, so a trend flip can move by a bar. The parity check counts the stocks where it does.
+DTYPE_TOLERANCES = {
+    "ma": (1e-6, "close"),
+    "ema": (1e-6, "close"),
+    "atr": (1e-6, "close"),
+    "lucid_sar": (1e-6, "close"),
+    "td_levels": (1e-6, "close"),  # move extremes and TDST levels
+    "rsi": (1e-2, "points"),  # 0-100
+    "coppock": (1e-3, "points"),  # percent
+    "fisher_distance": (1e-3, "points"),
+}
+
+
+def dtype_policy(policy=None):
+    """
+    :param policy: policy name, the configured one by default
+    :return: dictionary of the price, volume and date dtypes
+    """
+    policy = config["dtypes"]["policy"] if policy is None else policy
+    if policy not in DTYPE_POLICIES:
+        print(f"Error: unknown dtype policy {policy}, supported: {', '.join(DTYPE_POLICIES)}")
+        exit(0)
+    return DTYPE_POLICIES[policy]
+
+
+def cast_values(field, values, policy=None):
+    """
+    Cast an OHLCV array to the dtype of the policy
+    :param field: open, high, low, close or volume
+    :param values: numpy array
+    :param policy: policy name, the configured one by default
+    :return: numpy array
+    """
+    dtypes = dtype_policy(policy)
+    if field != "volume":
+        return values.astype(dtypes["price"], copy=False)
+
+    dtype = np.dtype(dtypes["volume"])
+    if dtype.kind == "u":
+        limit = np.iinfo(dtype).max
+        fits = np.isfinite(values).all() and (values >= 0).all() and (values <= limit).all()
+        if not fits or not (values == np.round(values)).all():
+            return values.astype(np.float64, copy=False)
+    return values.astype(dtype, copy=False)
+
+
+def cast_dates(timestamps, policy=None):
+    """
+    Cast a datetime64 array to the date dtype of the policy
+    """
+    return np.asarray(timestamps).astype(dtype_policy(policy)["date"], copy=False)
+
+
+def apply_frame_dtypes(df, policy=None):
+    """
+    Apply the policy to a price or volume frame with a timestamp column
+
+    Returns:
+    pd.DataFrame: Frame with the cast columns
+    """
+    columns = {"timestamp": cast_dates(df["timestamp"].to_numpy(), policy)}
+    for field in ["open", "high", "low", "close", "volume"]:
+        if field in df.columns:
+            columns[field] = cast_values(field, df[field].to_numpy(dtype=float), policy)
+    return pd.DataFrame(columns, index=df.index)[list(df.columns)]
+
+
+def compare_values(name, compact, full, close):
+    # Largest difference and whether it is within the tolerance of the indicator
+    compact, full = np.asarray(compact, dtype=float), np.asarray(full, dtype=float)
+    tolerance, scale = DTYPE_TOLERANCES[name]
+    limit = tolerance * np.abs(close) if scale == "close" else np.full(len(full), tolerance)
+
+    both = ~np.isnan(compact) & ~np.isnan(full)
+    difference = np.abs(compact[both] - full[both])
+    within = bool((np.isnan(compact) == np.isnan(full)).all() and (difference <= limit[both]).all())
+    return (difference.max() if len(difference) else 0.0), within
+
+
+def indicator_values(ohlc):
+    # Indicators compared by the parity check, as {name: [arrays]}, td and sar_trend are the discrete values
+    ema = MA(ohlc, 50, ma_type="exponential")
+    sar = lucid_sar(ohlc)
+    td = td_indicators(ohlc)
+    return {
+        "ma": [MA(ohlc, length)[f"ma{length}"] for length in (10, 20, 50, 200)],
+        "ema": [ema["ma50"]],
+        "atr": [ATR(ohlc)["atr"]],
+        "lucid_sar": [sar["sar"], sar["ep"]],
+        "td_levels": [td["move_extreme"], td["tdst"]],
+        "rsi": [RSI(ohlc)["rsi14"]],
+        "coppock": [coppock_curve(ohlc)["Coppock_WMA"]],
+        "fisher_distance": [fisher_distance(ohlc)["distance"]],
+        "td": [td[column] for column in ["td_setup", "td_direction", "countdown_up", "countdown_down"]],
+        "sar_trend": [sar["uptrend"]],
+    }
+
+
+def dtype_parity(full_panel, policy="compact"):
+    """
+    Parity check of a dtype policy: the indicators of every stock in the panel are calculated from the full precision
+    prices and from the prices cast to the policy, and compared against DTYPE_TOLERANCES.
+
+    Args:
+    full_panel (PricePanel): Prices loaded with the full policy
+    policy (str): Policy to check
+
+    Returns:
+    dict: {indicator: (largest difference, number of stocks out of tolerance)}, for the discrete td and sar_trend
+          values the number of stocks with any different value. The Lucid SAR values are only compared
+          for the stocks with the same trends.
+    """
+    compact_panel = full_panel.astype(policy)
+    results = {name: [0.0, 0] for name in list(DTYPE_TOLERANCES) + ["td", "sar_trend"]}
+
+    for stock in full_panel.codes:
+        ohlc_full, _ = full_panel.get_stock_price_data(stock)
+        ohlc_compact, _ = compact_panel.get_stock_price_data(stock)
+        if len(ohlc_full) < 8:
+            continue
+
+        full_values, compact_values = indicator_values(ohlc_full), indicator_values(ohlc_compact)
+        close = ohlc_full["close"].to_numpy()
+        for name, full_series in full_values.items():
+            pairs = list(zip(compact_values[name], full_series))
+            if name in ("td", "sar_trend"):
+                results[name][1] += not all(compact.equals(full) for compact, full in pairs)
+                continue
+            if name == "lucid_sar" and not compact_values["sar_trend"][0].equals(full_values["sar_trend"][0]):
+                continue
+
+            stock_within = True
+            for compact, full in pairs:
+                difference, within = compare_values(name, compact, full, close)
+                results[name][0] = max(results[name][0], difference)
+                stock_within &= within
+            results[name][1] += not stock_within
+
+    return {name: tuple(result) for name, result in results.items()}
+
+
+def dtype_parity_report(full_panel, policy="compact"):
+    """
+    :return: printable report of dtype_parity
+    """
+    results = dtype_parity(full_panel, policy)
+    compact_bytes, full_bytes = full_panel.astype(policy).nbytes, full_panel.nbytes
+    lines = [f"Dtype policy {policy}: {compact_bytes / 2**20:.1f}MB of prices for {len(full_panel)} stocks "
+             f"instead of {full_bytes / 2**20:.1f}MB"]
+    for name, (difference, failures) in results.items():
+        if name in ("td", "sar_trend"):
+            lines.append(f"  {name}: {failures} stocks with different values")
+            continue
+        tolerance, scale = DTYPE_TOLERANCES[name]
+        tolerance_description = f"{tolerance:g} of the close" if scale == "close" else f"{tolerance:g}"
+        lines.append(f"  {name}: max difference {difference:.3g} (tolerance {tolerance_description}), "
+                     f"{failures} stocks out of tolerance")
+    return "\n".join(lines)
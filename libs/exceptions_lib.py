@@ -15,6 +15,24 @@ class RetryAttemptsFailed(Error):
     pass
 
 
+class OfflineCacheMiss(Error):
+    """Raised in the offline mode when a response is not in the http cache"""
+
+    pass
+
+
+class BulkRequestFailed(Error):
+    """Raised when an exchange bulk request fails so that the stocks can be fetched one by one"""
+
+    pass
+
+
+class StrategyRuleError(Error):
+    """Raised when a strategy of the strategy_rules config section cannot be compiled"""
+
+    pass
+
+
 def define_exception_handler_params(handler_type):
     """
     Defined parameters of retrying for known handler types
@@ -0,0 +1,97 @@
+import weakref
+from collections import Counter
+
+import pandas as pd
+
+
+class FeatureCache:
+    """
+    Per-run memo of the indicator values calculated for the scanned stocks,
+    so that each indicator is computed at most once per stock per scan (e.g. for both the bull and bear directions).
+    Entries are keyed by stock, timeframe, indicator, parameters and the date of the latest bar,
+    so a frame cut at another date (e.g. with -date) never gets the values of another one.
+
+    Frames are registered for the cache with tag_frame, by identity: indicators of untagged frames, including
+    the frames derived from a tagged one (shifted, adjusted, copied, df.tail(5), ...), are calculated as usual.
+    Cached values whose index is not the one of the frame any more are calculated again.
+
+    Usage:
+        ohlc_daily = feature_cache.tag_frame(ohlc_daily, "AAPL", "daily")
+        ma50 = feature_cache.get(ohlc_daily, "ma", (50, "close", "simple"), lambda: MA(ohlc_daily, 50))
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.frames = {}
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def clear(self):
+        self.values = {}
+        self.frames = {}
+        self.hits.clear()
+        self.misses.clear()
+
+    def tag_frame(self, df, stock, timeframe):
+        """
+        Register the frame for the cache with the stock, the timeframe and the date of its latest bar
+
+        Returns:
+        pd.DataFrame: The same frame
+        """
+        # By position, as the frames with the indicator columns carry the timestamp twice
+        latest_date = df.iat[-1, list(df.columns).index("timestamp")] if len(df) else None
+        # Weak reference, so that the registration goes away with the frame and its id is never mistaken for another
+        frame_id = id(df)
+        frame = weakref.ref(df, lambda _: self.frames.pop(frame_id, None))
+        self.frames[frame_id] = (frame, (stock, timeframe, latest_date))
+        return df
+
+    def frame_key(self, df):
+        # Key of a tagged frame, None for any other frame
+        entry = self.frames.get(id(df))
+        if entry is None or entry[0]() is not df:
+            return None
+        return entry[1]
+
+    def lookup(self, key, indicator, compute, index=None):
+        # Cached value of the key, calculated on a miss or when the cached values are not aligned with the index
+        if key in self.values:
+            value = self.values[key]
+            if index is None or not isinstance(value, (pd.Series, pd.DataFrame)) or value.index.equals(index):
+                self.hits[indicator] += 1
+                return value
+        self.misses[indicator] += 1
+        value = compute()
+        self.values[key] = value
+        return value
+
+    def get(self, df, indicator, params, compute):
+        """
+        Indicator values for a frame, calculated with compute() only if not cached for the same tagged frame
+
+        Args:
+        df (pd.DataFrame): Frame the indicator is calculated on
+        indicator (str): Indicator name
+        params (tuple): Indicator parameters
+        compute (callable): Calculates the indicator values
+
+        Returns:
+        Indicator values as returned by compute
+        """
+        frame_key = self.frame_key(df)
+        if frame_key is None:
+            return compute()
+        return self.lookup(frame_key + (indicator, params), indicator, compute, df.index)
+
+    def summary(self):
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        details = ", ".join(
+            f"{indicator} {self.hits[indicator]}/{self.hits[indicator] + self.misses[indicator]}"
+            for indicator in sorted(set(self.hits) | set(self.misses))
+        )
+        return f"Feature cache: {hits} hits, {misses} misses ({details} served from cache)"
+
+
+# Cache shared by the scanner and the signal functions, cleared at the start of each scan
+feature_cache = FeatureCache()
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+from libs.http_cache import response_cache
+from libs.stocktools import eod_key, parse_stock_data
+
+# Statuses which are worth retrying: rate limiting and server side issues
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Token buckets shared by all fetchers using the same API key
+token_buckets = dict()
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for asyncio.
+    Tokens are reserved in advance, so concurrent waiters are served in order without a lock.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity  # max burst
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+def get_token_bucket(api_key, rate, capacity):
+    if api_key not in token_buckets:
+        token_buckets[api_key] = TokenBucket(rate, capacity)
+    return token_buckets[api_key]
+
+
+class AsyncPriceFetcher:
+    """
+    Fetches split adjusted prices for many stocks concurrently.
+    Concurrency is bounded by a semaphore, the request rate by a per API key token bucket.
+    Retries back off with jitter outside of the concurrency slot, so a slow ticker does not block the others.
+
+    Usage:
+        async with AsyncPriceFetcher.from_config(config["fetcher"]) as fetcher:
+            ohlc_daily, volume_daily = await fetcher.get_stock_data("AAPL", "2024-01-01")
+    """
+
+    def __init__(
+        self,
+        api_key=eod_key,
+        base_url="https://eodhd.com/api",
+        max_concurrency=20,
+        requests_per_second=15,
+        burst=20,
+        max_retries=5,
+        backoff_base=1,
+        backoff_max=30,
+        timeout=30,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.token_bucket = get_token_bucket(api_key, requests_per_second, burst)
+        self.semaphore = None
+        self.session = None
+
+    @classmethod
+    def from_config(cls, fetcher_config, **kwargs):
+        params = dict(fetcher_config)
+        params.update(kwargs)
+        return cls(**params)
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    def backoff_delay(self, attempt, retry_after=None):
+        # Full jitter exponential backoff, respecting Retry-After when provided
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def get_json(self, url, params, endpoint=None):
+        """
+        Get a json response with retries, served from the response cache when possible
+
+        Args:
+            url (str): Full url
+            params (dict): Query parameters without the API token
+            endpoint (str): Endpoint name for the cache TTL settings
+
+        Returns:
+            list or dict: Parsed json, None if not found or retries failed
+        """
+        cache_key, cached = response_cache.lookup(url, params, endpoint)
+        if cached is not None:
+            return cached.json() if cached.status_code == 200 else None
+
+        if self.api_key is not None:
+            params = dict(params, api_token=self.api_key)
+
+        failure = "no attempts"
+        for attempt in range(self.max_retries):
+            retry_after = None
+            # Waiting for a token before taking a slot, so that the rate limit does not hold the concurrency slots
+            await self.token_bucket.acquire()
+            async with self.semaphore:
+                try:
+                    async with self.session.get(url, params=params) as r:
+                        if r.status in (200, 404):
+                            content = await r.read()
+                            if cache_key is not None:
+                                response_cache.put(cache_key, endpoint, r.status, content)
+                            return json.loads(content) if r.status == 200 else None
+                        if r.status not in RETRY_STATUSES:
+                            print(f"Status response is not Ok: {r.status} ({url})")
+                            return None
+                        if "Retry-After" in r.headers:
+                            try:
+                                retry_after = float(r.headers["Retry-After"])
+                            except ValueError:
+                                pass
+                        failure = f"status {r.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    failure = f"request failed: {e!r}"
+
+            # Sleeping outside of the semaphore to free the slot for other requests
+            if attempt < self.max_retries - 1:
+                await asyncio.sleep(self.backoff_delay(attempt, retry_after))
+
+        print(f"Max retries reached for {url} ({failure})")
+        return None
+
+    async def get_stock_data(self, code, reporting_date_start):
+        """
+        Async version of stocktools.get_stock_data
+
+        Returns:
+            tuple: (ohlc dataframe, volume dataframe) or (None, None)
+        """
+        #Note: cannot use the eod api endpoint because it is not split adjusted
+        data = await self.get_json(
+            f"{self.base_url}/technical/{code}",
+            dict(function="splitadjusted", order="a", fmt="json", **{"from": str(reporting_date_start)}),
+            endpoint="technical",
+        )
+        if data is None:
+            print(f"No data for {code}, skipping")
+            return None, None
+        return parse_stock_data(data)
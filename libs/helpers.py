@@ -104,7 +104,7 @@ def define_simulator_args():
         "--failsafe", action="store_true", help="Activate the failsafe approach"
     )
     parser.add_argument(
-        "--forced_price_update", action="store_true", help="Activate the failsafe approach"
+        "--forced_price_update", action="store_true", help="Sync the stored prices of the simulated stocks (only missing bars are fetched)"
     )
     #
     # parser.add_argument(
@@ -213,6 +213,39 @@ def define_scanner_args():
         action="store_true",
         help="Use existing price data without fetching new data"  # false by default
     )
+    parser.add_argument(
+        "--full_price_refresh",
+        action="store_true",
+        help="Clear the stored prices and fetch the full history instead of syncing the missing bars only"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Replay API responses from the http cache only, failing on responses which are not cached"
+    )
+    parser.add_argument(
+        "--check_dtypes",
+        action="store_true",
+        help="Compare the indicators from the compact and the full precision stored prices (dtype policy parity check)"
+    )
+    parser.add_argument(
+        "--screen",
+        action="store_true",
+        help="Screen the whole universe with the strategy rules of the method (strategy_rules in the config) first, "
+             "only the stocks passing them are evaluated one by one for the signals of their direction"
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Shortlist sizes and members of the strategy rules of the method for every combination of the values "
+             "in the threshold_sweep config section, on the stored prices"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Evaluate and print all the anx conditions of every stock "
+             "(otherwise the conditions of a stock are only evaluated up to the first one not met)"
+    )
 
     args = parser.parse_args()
     arguments = vars(args)
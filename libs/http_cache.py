@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from libs.exceptions_lib import OfflineCacheMiss
+from libs.read_settings import read_config
+config = read_config()
+
+# Statuses which are cached: data and 'not found' (so that replays behave the same as the original run)
+CACHED_STATUSES = {200, 404}
+
+
+class CachedResponse:
+    """
+    Minimal stand-in for requests.Response served from the cache
+    """
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    """
+    On-disk content addressed cache of http responses.
+    Entries are keyed by a hash of the url and params without the API token, expire per endpoint TTL,
+    and the least recently used entries are evicted when the cache grows over the size limit.
+    In the offline mode expired entries are still served and a miss raises OfflineCacheMiss.
+    """
+
+    def __init__(self, path, ttl_hours, max_size_mb, enabled=True, offline=False):
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self.max_size = max_size_mb * 1024 * 1024
+        self.enabled = enabled
+        self.offline = offline
+        self.total_size = None  # calculated on the first write
+
+    @staticmethod
+    def key(url, params=None):
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query, keep_blank_values=True) + list((params or {}).items())
+        query = sorted((k, str(v)) for k, v in query if k != "api_token" and v is not None)
+        canonical_url = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+        return hashlib.sha256(canonical_url.encode("utf-8")).hexdigest()
+
+    def entry_paths(self, key):
+        folder = os.path.join(self.path, key[:2])
+        return os.path.join(folder, f"{key}.meta"), os.path.join(folder, f"{key}.body")
+
+    def get_meta(self, key, endpoint):
+        """
+        Returns:
+        dict: Metadata of the cached response, None if missing or expired
+        """
+        meta_path, body_path = self.entry_paths(key)
+        try:
+            with open(meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(body_path):
+            return None
+
+        ttl = self.ttl_hours.get(endpoint, 0) * 3600
+        if not self.offline and time.time() - meta["fetched_at"] > ttl:
+            return None
+
+        os.utime(meta_path)  # access time for the LRU eviction
+        return meta
+
+    def get(self, key, endpoint):
+        """
+        Returns:
+        CachedResponse: Cached response, None if missing or expired
+        """
+        meta = self.get_meta(key, endpoint)
+        if meta is None:
+            return None
+        _, body_path = self.entry_paths(key)
+        with open(body_path, "rb") as body_file:
+            return CachedResponse(meta["status_code"], body_file.read())
+
+    def put(self, key, endpoint, status_code, content):
+        if status_code not in CACHED_STATUSES:
+            return
+
+        meta_path, body_path = self.entry_paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        with open(body_path, "wb") as body_file:
+            body_file.write(content)
+        with open(meta_path, "w") as meta_file:
+            json.dump(dict(endpoint=endpoint, status_code=status_code, fetched_at=time.time()), meta_file)
+
+        if self.total_size is None:
+            self.total_size = sum(size for _, _, size in self.entries())
+        else:
+            self.total_size += len(content)
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def read_chunks(self, key, chunk_size):
+        # Cached body in chunks, for the responses which are parsed as a stream
+        _, body_path = self.entry_paths(key)
+        with open(body_path, "rb") as body_file:
+            while True:
+                chunk = body_file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def put_stream(self, key, endpoint, status_code, chunks):
+        """
+        Pass the response chunks through while writing them to the cache.
+        The entry is only committed once the whole body has been received.
+        """
+        if status_code not in CACHED_STATUSES:
+            yield from chunks
+            return
+
+        meta_path, body_path = self.entry_paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        size = 0
+        with open(f"{body_path}.tmp", "wb") as body_file:
+            for chunk in chunks:
+                body_file.write(chunk)
+                size += len(chunk)
+                yield chunk
+        os.replace(f"{body_path}.tmp", body_path)
+        with open(meta_path, "w") as meta_file:
+            json.dump(dict(endpoint=endpoint, status_code=status_code, fetched_at=time.time()), meta_file)
+
+        if self.total_size is None:
+            self.total_size = sum(entry_size for _, _, entry_size in self.entries())
+        else:
+            self.total_size += size
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        # (last access time, key, size) for all the cache entries
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for root, _, filenames in os.walk(self.path):
+            for name in filenames:
+                if name.endswith(".meta"):
+                    key = name[:-len(".meta")]
+                    meta_path, body_path = self.entry_paths(key)
+                    try:
+                        entries.append((os.path.getmtime(meta_path), key, os.path.getsize(body_path)))
+                    except FileNotFoundError:
+                        continue
+        return entries
+
+    def evict(self):
+        # Remove the least recently used entries until the cache is within 90% of the limit
+        entries = sorted(self.entries())
+        self.total_size = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if self.total_size <= 0.9 * self.max_size:
+                break
+            for entry_path in self.entry_paths(key):
+                try:
+                    os.remove(entry_path)
+                except FileNotFoundError:
+                    pass
+            self.total_size -= size
+
+    def lookup(self, url, params, endpoint, stream=False):
+        """
+        Look up a response before making a request
+
+        Args:
+        stream (bool): Only check the metadata, without reading the body into memory
+
+        Returns:
+        tuple: (cache key, CachedResponse or None), with the response body left empty in the stream mode
+        Raises:
+        OfflineCacheMiss: In the offline mode when the response is not cached
+        """
+        if not self.enabled and not self.offline:
+            return None, None
+
+        key = self.key(url, params)
+        if stream:
+            meta = self.get_meta(key, endpoint)
+            response = None if meta is None else CachedResponse(meta["status_code"], b"")
+        else:
+            response = self.get(key, endpoint)
+        if response is None and self.offline:
+            raise OfflineCacheMiss(f"{endpoint} response is not cached for {url} (offline mode)")
+        return key, response
+
+
+# Cache shared by all the modules making requests
+response_cache = ResponseCache(
+    config["http_cache"]["path"],
+    config["http_cache"]["ttl_hours"],
+    config["http_cache"]["max_size_mb"],
+    enabled=config["http_cache"]["enabled"],
+)
+
+
+def set_offline_mode(offline=True):
+    # Replay all the requests from the cache, failing on anything which is not cached
+    response_cache.offline = offline
+
+
+def cached_get(session, url, endpoint, params=None, headers=None):
+    """
+    requests session.get going through the response cache
+
+    Args:
+        session: requests.Session
+        url (str): Request url
+        endpoint (str): Endpoint name for the TTL settings
+        params (dict): Query parameters
+        headers (dict): Request headers
+
+    Returns:
+        requests.Response or CachedResponse
+    """
+    key, response = response_cache.lookup(url, params, endpoint)
+    if response is not None:
+        return response
+
+    response = session.get(url, params=params, headers=headers)
+    if key is not None:
+        response_cache.put(key, endpoint, response.status_code, response.content)
+    return response
+
+
+def cached_stream(session, url, endpoint, params=None, headers=None, chunk_size=65536):
+    """
+    Streaming version of cached_get for large responses: the body is never held in memory as a whole
+
+    Returns:
+        tuple: (status code, iterator over the body chunks)
+    """
+    key, response = response_cache.lookup(url, params, endpoint, stream=True)
+    if response is not None:
+        return response.status_code, response_cache.read_chunks(key, chunk_size)
+
+    response = session.get(url, params=params, headers=headers, stream=True)
+    chunks = response.iter_content(chunk_size=chunk_size)
+    if key is not None:
+        chunks = response_cache.put_stream(key, endpoint, response.status_code, chunks)
+    return response.status_code, chunks
@@ -0,0 +1,336 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from libs.kernels import (
+    kernel_input,
+    kernel_output,
+    ema_kernel,
+    fisher_distance_kernel,
+    lucid_sar_kernel,
+    td_initial_state,
+    TD_DIRECTION_UP,
+    TD_DIRECTION_DOWN,
+)
+from libs.techanalysis import td_sequential_values, td_columns, td_direction_categorical
+from libs.read_settings import read_config
+config = read_config()
+
+# Saved states of another format version are discarded, i.e. recomputed from the full history
+STATE_VERSION = 1
+
+# Indicators kept per timeframe, as used by the signals: EMAs of the close and the Lucid SAR on the weekly bars.
+# TD and Fisher distance are kept on both, the Fisher distance uses the EMA50.
+TIMEFRAMES = {
+    "daily": dict(ema_lengths=(3, 12, 50, 200), sar=False),
+    "weekly": dict(ema_lengths=(50,), sar=True),
+}
+FISHER_LENGTH = 9
+FISHER_EMA_LENGTH = 50
+SAR_SETTINGS = dict(af_initial=0.02, af_increment=0.02, af_maximum=0.2)  # lucid_sar defaults
+CONTEXT_BARS = 5  # previous bars needed for the TD bar comparisons (and the last two for the SAR)
+
+
+def new_series_state(timeframe):
+    # State of a series before its first bar
+    settings = TIMEFRAMES[timeframe]
+    state = dict(
+        bars=0,  # number of bars the state has been advanced by
+        checkpoint=None,  # timestamp and OHLC of the last bar, to check that the history has not been rewritten
+        context={field: np.empty(0) for field in ["open", "high", "low", "close"]},
+        ema={length: np.array([np.nan, 1.0]) for length in settings["ema_lengths"]},
+        fisher=dict(dists=np.empty(0), state=np.zeros(2)),
+        td=dict(state=td_initial_state(), up_bases=np.zeros(0, dtype=np.int64), down_bases=np.zeros(0, dtype=np.int64)),
+        outputs=None,  # indicator values of the last bars
+    )
+    if settings["sar"]:
+        state["sar"] = dict(sar=np.nan, ep=np.nan, uptrend=False, new_trend=False, af=SAR_SETTINGS["af_initial"])
+    return state
+
+
+def advance_ema(ema_state, close, length):
+    output = kernel_output(len(close), np.float64, np.nan)
+    state = kernel_input(ema_state.copy())
+    ema_kernel(kernel_input(close), 2 / (length + 1), state, output)
+    return np.asarray(output, dtype=float), np.asarray(state, dtype=float)
+
+
+def advance_fisher(fisher_state, dist_from_ema, bars_before):
+    # The rolling extremes of the distance only need the previous FISHER_LENGTH - 1 values
+    dists = np.concatenate([fisher_state["dists"], dist_from_ema])
+    high, low = np.full(len(dists), np.nan), np.full(len(dists), np.nan)
+    if len(dists) >= FISHER_LENGTH:
+        # Same as the pandas rolling extremes: NaN if the window is not full or has a NaN
+        windows = np.lib.stride_tricks.sliding_window_view(dists, FISHER_LENGTH)
+        high[FISHER_LENGTH - 1:], low[FISHER_LENGTH - 1:] = windows.max(axis=1), windows.min(axis=1)
+
+    first = len(fisher_state["dists"])
+    distance = kernel_output((1, len(dists)), np.float64, 0.0)
+    state = kernel_output((1, 2))
+    state[0][0], state[0][1] = fisher_state["state"]
+    fisher_distance_kernel(
+        kernel_input(dists[None, :]), kernel_input(high[None, :]), kernel_input(low[None, :]),
+        kernel_input([first - bars_before], np.int64), kernel_input([first], np.int64), state, distance
+    )
+    new_state = dict(dists=dists[-(FISHER_LENGTH - 1):], state=np.array(state[0], dtype=float))
+    return np.asarray(distance, dtype=float)[0, first:], new_state
+
+
+def advance_sar(sar_state, context, high, low, bars_before):
+    # Continued from the last two bars, the outputs of the last one are filled in for the kernel
+    prefix = min(2, bars_before)
+    highs = np.concatenate([context["high"][len(context["high"]) - prefix:], high])
+    lows = np.concatenate([context["low"][len(context["low"]) - prefix:], low])
+    size = len(highs)
+
+    sar = kernel_output((1, size), np.float64, np.nan)
+    ep = kernel_output((1, size), np.float64, np.nan)
+    uptrend = kernel_output((1, size), np.bool_, False)
+    new_trend = kernel_output((1, size), np.bool_, False)
+    if prefix:
+        sar[0][prefix - 1], ep[0][prefix - 1] = sar_state["sar"], sar_state["ep"]
+        uptrend[0][prefix - 1], new_trend[0][prefix - 1] = sar_state["uptrend"], sar_state["new_trend"]
+    af = kernel_output(1, np.float64, sar_state["af"])
+
+    lucid_sar_kernel(
+        kernel_input(highs[None, :]), kernel_input(lows[None, :]),
+        kernel_input([prefix - bars_before], np.int64), kernel_input([prefix], np.int64), af,
+        SAR_SETTINGS["af_initial"], SAR_SETTINGS["af_increment"], SAR_SETTINGS["af_maximum"],
+        sar, uptrend, ep, new_trend
+    )
+    outputs = dict(
+        sar=np.asarray(sar, dtype=float)[0, prefix:],
+        uptrend=np.asarray(uptrend, dtype=bool)[0, prefix:],
+        ep=np.asarray(ep, dtype=float)[0, prefix:],
+        new_trend=np.asarray(new_trend, dtype=bool)[0, prefix:],
+    )
+    new_state = {name: values[-1] for name, values in outputs.items()}
+    new_state["af"] = af[0]
+    return outputs, new_state
+
+
+def advance_td(td_state, context, bars, bars_before):
+    # The bar comparisons look up to 5 bars back, so the context bars are prepended to the new ones
+    prefix = len(context["close"])
+    values = {field: np.concatenate([context[field], bars[field]]) for field in context}
+
+    state = td_state["state"].copy()
+    # The direction is defined by the closes of the bars 4 and 5, the sequential count starts on the bar 6
+    if bars_before <= 5 < bars_before + len(bars["close"]):
+        close_4, close_5 = values["close"][4 - bars_before + prefix], values["close"][5 - bars_before + prefix]
+        if close_5 > close_4:
+            state[TD_DIRECTION_UP] = 1
+        elif close_5 < close_4:
+            state[TD_DIRECTION_DOWN] = 1
+    first = max(prefix, 6 - bars_before + prefix)
+
+    outputs, state, up_bases, down_bases = td_sequential_values(
+        values["open"], values["high"], values["low"], values["close"],
+        first, state, td_state["up_bases"], td_state["down_bases"]
+    )
+    outputs = tuple(output[prefix:] for output in outputs)
+    return outputs, dict(state=state, up_bases=up_bases, down_bases=down_bases)
+
+
+def advance(state, timeframe, bars):
+    """
+    Advance the state of a series by its new bars.
+    The arrays of the state are replaced rather than modified, so a shallow copy of the state
+    (with its ema dictionary) can be advanced without changing the original.
+
+    Args:
+    state (dict): Series state (see new_series_state), updated in place
+    timeframe (str): daily or weekly
+    bars (dict): timestamp, open, high, low and close numpy arrays of the new bars
+
+    Returns:
+    dict: Indicator values of the new bars: timestamp, the td_indicators columns, emaN, fisher_distance
+        and the lucid_sar columns (weekly)
+    """
+    bars_before = state["bars"]
+    context = state["context"]
+
+    td_outputs, state["td"] = advance_td(state["td"], context, bars, bars_before)
+    outputs = dict(timestamp=bars["timestamp"], **td_columns(td_outputs))
+
+    for length in state["ema"]:
+        outputs[f"ema{length}"], state["ema"][length] = advance_ema(state["ema"][length], bars["close"], length)
+
+    dist_from_ema = bars["close"] - outputs[f"ema{FISHER_EMA_LENGTH}"]
+    outputs["fisher_distance"], state["fisher"] = advance_fisher(state["fisher"], dist_from_ema, bars_before)
+
+    if "sar" in state:
+        sar_outputs, state["sar"] = advance_sar(state["sar"], context, bars["high"], bars["low"], bars_before)
+        outputs.update(sar_outputs)
+
+    state["context"] = {
+        field: np.concatenate([context[field], bars[field]])[-CONTEXT_BARS:] for field in context
+    }
+    state["bars"] = bars_before + len(bars["close"])
+    state["checkpoint"] = (bars["timestamp"][-1], np.array([bars[field][-1] for field in ["open", "high", "low", "close"]]))
+    return outputs
+
+
+def pad_front(values, size):
+    # Pad the values of the last bars to the size with missing values
+    if len(values) == size:
+        return values
+    if values.dtype.kind in "bO":
+        padded = np.full(size, None, dtype=object)
+    elif values.dtype.kind == "M":
+        padded = np.full(size, np.datetime64("NaT"), dtype=values.dtype)
+    else:
+        padded = np.full(size, np.nan)
+    padded[size - len(values):] = values
+    return padded
+
+
+class IndicatorStateStore:
+    """
+    Recurrence state of the scanner indicators per stock and timeframe (EMA values, SAR/EP/AF, Fisher value, TD counters),
+    saved after each run so that the next run only advances it by the new bars.
+    The state is checked against the last bar it was advanced by (date and OHLC): if the bar is missing or changed,
+    e.g. after a split adjustment or a price rebuild, the indicators are recomputed from the full history.
+    Values equal a full computation from the first bar the state was started on, only the last output_bars
+    values are kept.
+
+    Usage:
+        store = load_indicator_state()
+        values = store.indicators("AAPL", "daily", ohlc_daily)
+        store.save()
+    """
+
+    def __init__(self, path, output_bars):
+        self.path = path
+        self.output_bars = output_bars
+        self.states = {}
+        self.advanced, self.new_bars, self.recomputed = 0, 0, 0
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as state_file:
+                saved = pickle.load(state_file)
+        except FileNotFoundError:
+            return
+        except (pickle.UnpicklingError, EOFError, AttributeError):
+            print("Indicator state file is unreadable, recomputing indicators from the full history")
+            return
+        if saved.get("version") == STATE_VERSION and saved.get("output_bars") == self.output_bars:
+            self.states = saved["states"]
+
+    def save(self):
+        # Written to a temporary file first so that an interrupted save does not lose the previous state
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(f"{self.path}.tmp", "wb") as state_file:
+            pickle.dump(
+                dict(version=STATE_VERSION, output_bars=self.output_bars, states=self.states),
+                state_file, protocol=pickle.HIGHEST_PROTOCOL
+            )
+        os.replace(f"{self.path}.tmp", self.path)
+
+    @staticmethod
+    def checkpoint_position(state, timestamps, ohlc):
+        """
+        Returns:
+        int: Position of the last bar the state was advanced by,
+            None if the bar is not in the bars or has changed, or bars were added or removed before it
+        """
+        if state is None or state["checkpoint"] is None:
+            return None
+        timestamp, bar = state["checkpoint"]
+        position = np.searchsorted(timestamps, timestamp)
+        if position >= len(timestamps) or timestamps[position] != timestamp:
+            return None
+        if not np.array_equal(ohlc[position], bar):
+            return None
+
+        # The kept values must line up with the bars before the checkpoint
+        kept = min(len(state["outputs"]["timestamp"]), position + 1)
+        kept_timestamps = state["outputs"]["timestamp"][-kept:]
+        if not np.array_equal(timestamps[position + 1 - kept:position + 1], kept_timestamps):
+            return None
+        return position
+
+    def indicators(self, stock, timeframe, bars, last_bar_final=True):
+        """
+        Indicator values for the bars of a stock, advancing the saved state by the bars after its last one
+
+        Args:
+        stock (str): Stock code
+        timeframe (str): daily or weekly
+        bars (pd.DataFrame): OHLC with timestamps, sorted
+        last_bar_final (bool): False if the last bar can still change (e.g. the current week),
+            its values are calculated without saving it in the state
+
+        Returns:
+        pd.DataFrame: Indicator values with the index of bars (see advance for the columns),
+            missing for the bars before the last output_bars
+        """
+        timestamps = bars["timestamp"].to_numpy(dtype="datetime64[ns]")
+        ohlc = np.column_stack([bars[field].to_numpy(dtype=float) for field in ["open", "high", "low", "close"]])
+        final_bars = len(bars) if last_bar_final else len(bars) - 1
+
+        state = self.states.get((stock, timeframe))
+        position = self.checkpoint_position(state, timestamps, ohlc)
+        if position is None or position >= final_bars:
+            state = new_series_state(timeframe)
+            first_new = 0
+            self.recomputed += 1
+        else:
+            first_new = position + 1
+            if final_bars > first_new:
+                self.advanced += 1
+                self.new_bars += final_bars - first_new
+
+        def bars_slice(start, end):
+            new_bars = dict(timestamp=timestamps[start:end])
+            new_bars.update({field: ohlc[start:end, i] for i, field in enumerate(["open", "high", "low", "close"])})
+            return new_bars
+
+        if final_bars > first_new:
+            new_outputs = advance(state, timeframe, bars_slice(first_new, final_bars))
+            if state["outputs"] is not None:
+                new_outputs = {name: np.concatenate([state["outputs"][name], values])
+                               for name, values in new_outputs.items()}
+            state["outputs"] = {name: values[-self.output_bars:] for name, values in new_outputs.items()}
+        self.states[(stock, timeframe)] = state
+
+        outputs = state["outputs"]
+        if final_bars < len(bars):
+            # The last bar is advanced on a copy of the state
+            partial_state = dict(state, ema=dict(state["ema"]))
+            partial_outputs = advance(partial_state, timeframe, bars_slice(final_bars, len(bars)))
+            if outputs is not None:
+                partial_outputs = {name: np.concatenate([outputs[name], values])
+                                   for name, values in partial_outputs.items()}
+            outputs = partial_outputs
+
+        # Values are kept for the last bars only, the ones before are missing
+        size = len(bars)
+        outputs = {name: pad_front(values[-size:], size) for name, values in outputs.items()}
+        outputs["timestamp"] = bars["timestamp"].to_numpy()
+        outputs["td_direction"] = td_direction_categorical(outputs["td_direction"])
+        return pd.DataFrame(outputs, index=bars.index)
+
+    def summary(self):
+        return (
+            f"Indicator state: {self.advanced} series advanced by {self.new_bars} new bars, "
+            f"{self.recomputed} recomputed from the full history"
+        )
+
+
+def load_indicator_state():
+    """
+    Returns:
+    IndicatorStateStore: Store loaded from the configured file, None if disabled in the config
+    """
+    settings = config["indicator_state"]
+    if not settings["enabled"]:
+        return None
+    store = IndicatorStateStore(settings["path"], settings["output_bars"])
+    store.load()
+    return store
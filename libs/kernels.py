@@ -0,0 +1,463 @@
+import math
+import numpy as np
+
+# Optional dependency: the kernels are compiled when numba is installed, otherwise they run as plain python loops
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None
+
+
+def kernel(function):
+    """
+    Compile a loop kernel with numba if available.
+    Kernels are written in the subset of python which numba supports, so the same code runs in both modes.
+    """
+    if NUMBA_AVAILABLE:
+        return njit(cache=True, nogil=True)(function)
+    return function
+
+
+def kernel_input(values, dtype=np.float64):
+    """
+    Prepare an array for a kernel: numpy arrays for the compiled version,
+    python lists for the fallback as indexing them is several times faster than indexing numpy arrays
+    """
+    values = np.ascontiguousarray(values, dtype=dtype)
+    return values if NUMBA_AVAILABLE else values.tolist()
+
+
+def kernel_output(shape, dtype=np.float64, fill=0):
+    """
+    Allocate a kernel output of the size or (rows, columns) shape filled with the value
+    """
+    if NUMBA_AVAILABLE:
+        return np.full(shape, fill, dtype=dtype)
+    if isinstance(shape, tuple):
+        return [[fill] * shape[1] for _ in range(shape[0])]
+    return [fill] * shape
+
+
+# Slots of the TD state array, which carries the sequential state from one call of the kernel to the next
+TD_DIRECTION_UP, TD_DIRECTION_DOWN, TD_SETUP_UP, TD_SETUP_DOWN = 0, 1, 2, 3
+TD_MOVE_EXTREME, TD_MOVE_EXTREME_PRE, TD_MOVE_DIRECTION_PRE, TD_TDST_PRE, TD_TDST_LEVEL = 4, 5, 6, 7, 8
+TD_COUNTDOWN_UP_FLAG, TD_COUNTDOWN_DOWN_FLAG = 9, 10
+TD_UP_COUNT, TD_UP_INCREMENTS, TD_DOWN_COUNT, TD_DOWN_INCREMENTS = 11, 12, 13, 14
+TD_STATE_SIZE = 15
+
+
+def td_initial_state():
+    # State before the first bar of the sequential count, the direction is set from the bars 4 and 5
+    state = np.zeros(TD_STATE_SIZE)
+    state[[TD_MOVE_EXTREME, TD_MOVE_EXTREME_PRE, TD_TDST_PRE, TD_TDST_LEVEL]] = np.nan
+    return state
+
+
+@kernel
+def td_sequential_kernel(open_, high, close, bear_flip, bull_flip, if_countdown_up, if_countdown_down, first, state,
+                         setup, direction, move_extremes, countdown_up, countdown_down, tdst,
+                         up_bases, down_bases):
+    """
+    TD setup, countdown and TDST state machine over the bars from the first one (see techanalysis.td_indicators).
+    Outputs are written in place: direction is 1 for green, -1 for red and 0 if not defined.
+    Active countdowns are kept as queues of the increment counter value at their start,
+    so incrementing all of them is a single counter increment.
+    The machine starts from the state array and leaves its final state there, with the active countdowns
+    moved to the front of the queues, so a series can be continued later with its new bars only.
+    """
+    size = len(close)
+
+    direction_up, direction_down = state[TD_DIRECTION_UP] > 0, state[TD_DIRECTION_DOWN] > 0
+    setup_up, setup_down = int(state[TD_SETUP_UP]), int(state[TD_SETUP_DOWN])
+    move_extreme, move_extreme_pre = state[TD_MOVE_EXTREME], state[TD_MOVE_EXTREME_PRE]
+    move_direction_pre = int(state[TD_MOVE_DIRECTION_PRE])
+    tdst_pre, tdst_level = state[TD_TDST_PRE], state[TD_TDST_LEVEL]
+    countdown_up_flag, countdown_down_flag = state[TD_COUNTDOWN_UP_FLAG] > 0, state[TD_COUNTDOWN_DOWN_FLAG] > 0
+    up_head, up_tail, up_increments = 0, int(state[TD_UP_COUNT]), int(state[TD_UP_INCREMENTS])
+    down_head, down_tail, down_increments = 0, int(state[TD_DOWN_COUNT]), int(state[TD_DOWN_INCREMENTS])
+
+    for i in range(first, size):
+        if setup_up == 9:
+            setup_up = 0
+        if setup_down == 9:
+            setup_down = 0
+
+        bearish_flip, bullish_flip = False, False
+        if bear_flip[i]:
+            bearish_flip = True
+            direction_down = True
+            tdst_pre = high[i]
+        if bull_flip[i]:
+            bullish_flip = True
+            direction_up = True
+            bearish_flip = False
+            tdst_pre = high[i]
+
+        if bearish_flip and direction_up:
+            direction_up = False
+            setup_down = 1
+        if bullish_flip and direction_down:
+            direction_down = False
+            setup_up = 1
+
+        if direction_down and not bearish_flip:
+            setup_down += 1
+        if direction_up and not bullish_flip:
+            setup_up += 1
+
+        if direction_up and setup_up == 1:
+            move_extreme_pre = min(open_[i], close[i])
+            move_direction_pre = 1
+        if direction_down and setup_down == 1:
+            move_extreme_pre = max(open_[i], close[i])
+            move_direction_pre = -1
+
+        if move_direction_pre == 1 and direction_up and setup_up == 2:
+            move_extreme = move_extreme_pre
+        if move_direction_pre == -1 and direction_down and setup_down == 2:
+            move_extreme = move_extreme_pre
+
+        if direction_down:
+            setup[i] = setup_down
+            direction[i] = -1
+        if direction_up:
+            setup[i] = setup_up
+            direction[i] = 1
+        move_extremes[i] = move_extreme
+
+        if direction_up and setup_up == 9:
+            countdown_up_flag = True
+            countdown_down_flag = False
+            down_head, down_tail = 0, 0
+            up_bases[up_tail] = up_increments
+            up_tail += 1
+            tdst_level = tdst_pre
+        if direction_down and setup_down == 9:
+            countdown_down_flag = True
+            countdown_up_flag = False
+            up_head, up_tail = 0, 0
+            down_bases[down_tail] = down_increments
+            down_tail += 1
+            tdst_level = tdst_pre
+
+        tdst[i] = tdst_level
+
+        # Countdowns are removed on 13, the oldest one is the largest
+        if direction_up and countdown_up_flag and if_countdown_up[i]:
+            up_increments += 1
+            while up_head < up_tail and up_increments - up_bases[up_head] == 13:
+                up_head += 1
+        if up_head < up_tail:
+            countdown_up[i] = up_increments - up_bases[up_head]
+        if direction_down and countdown_down_flag and if_countdown_down[i]:
+            down_increments += 1
+            while down_head < down_tail and down_increments - down_bases[down_head] == 13:
+                down_head += 1
+        if down_head < down_tail:
+            countdown_down[i] = down_increments - down_bases[down_head]
+
+    for k in range(up_tail - up_head):
+        up_bases[k] = up_bases[up_head + k]
+    for k in range(down_tail - down_head):
+        down_bases[k] = down_bases[down_head + k]
+    state[TD_DIRECTION_UP] = 1.0 if direction_up else 0.0
+    state[TD_DIRECTION_DOWN] = 1.0 if direction_down else 0.0
+    state[TD_SETUP_UP], state[TD_SETUP_DOWN] = setup_up, setup_down
+    state[TD_MOVE_EXTREME], state[TD_MOVE_EXTREME_PRE] = move_extreme, move_extreme_pre
+    state[TD_MOVE_DIRECTION_PRE] = move_direction_pre
+    state[TD_TDST_PRE], state[TD_TDST_LEVEL] = tdst_pre, tdst_level
+    state[TD_COUNTDOWN_UP_FLAG] = 1.0 if countdown_up_flag else 0.0
+    state[TD_COUNTDOWN_DOWN_FLAG] = 1.0 if countdown_down_flag else 0.0
+    state[TD_UP_COUNT], state[TD_UP_INCREMENTS] = up_tail - up_head, up_increments
+    state[TD_DOWN_COUNT], state[TD_DOWN_INCREMENTS] = down_tail - down_head, down_increments
+
+
+@kernel
+def td_direction_rows_kernel(open_, high, close, bear_flip, bull_flip, if_countdown_up, if_countdown_down, starts,
+                             direction):
+    # td_sequential_kernel on each row (series) from its start as in techanalysis.td_indicators,
+    # only the direction is kept, rows with fewer than 6 bars are skipped
+    for row in range(close.shape[0]):
+        start = starts[row]
+        size = close.shape[1] - start
+        if size < 6:
+            continue
+        state = np.zeros(TD_STATE_SIZE)
+        state[TD_MOVE_EXTREME], state[TD_MOVE_EXTREME_PRE] = np.nan, np.nan
+        state[TD_TDST_PRE], state[TD_TDST_LEVEL] = np.nan, np.nan
+        if close[row, start + 5] > close[row, start + 4]:
+            state[TD_DIRECTION_UP] = 1
+        elif close[row, start + 5] < close[row, start + 4]:
+            state[TD_DIRECTION_DOWN] = 1
+        td_sequential_kernel(
+            open_[row, start:], high[row, start:], close[row, start:], bear_flip[row, start:], bull_flip[row, start:],
+            if_countdown_up[row, start:], if_countdown_down[row, start:], 6, state,
+            np.zeros(size, np.int64), direction[row, start:], np.full(size, np.nan), np.zeros(size, np.int64),
+            np.zeros(size, np.int64), np.full(size, np.nan), np.zeros(size, np.int64), np.zeros(size, np.int64)
+        )
+
+
+@kernel
+def ema_kernel(values, alpha, state, output):
+    """
+    Exponential moving average with the recurrence of pandas ewm(adjust=False).mean(), so the values are identical.
+    The state array holds the average and the weight of the previous value (NaN and 1 before the first value),
+    it is updated in place so that a series can be continued with its new values only.
+    """
+    weighted, old_weight = state[0], state[1]
+    for i in range(len(values)):
+        current = values[i]
+        is_observation = current == current  # not NaN
+        if weighted == weighted:
+            old_weight *= 1 - alpha
+            if is_observation:
+                if weighted != current:
+                    weighted = (old_weight * weighted + alpha * current) / (old_weight + alpha)
+                old_weight = 1.0
+        elif is_observation:
+            weighted = current
+        output[i] = weighted
+    state[0], state[1] = weighted, old_weight
+
+
+@kernel
+def ema_rows_kernel(values, alpha, output):
+    # ema_kernel on each row (series) of the values from the initial state
+    state = np.empty(2)
+    for row in range(values.shape[0]):
+        state[0], state[1] = np.nan, 1.0
+        ema_kernel(values[row], alpha, state, output[row])
+
+
+@kernel
+def fisher_distance_kernel(dist_from_ema, high, low, starts, firsts, state, distance):
+    """
+    Fisher transform of the distance from the EMA for each row of the (series, bars) inputs (see techanalysis.fisher_distance).
+    The normalised value is a clipped recurrence and the transform an IIR smoothing, both computed in one pass.
+    Bars of a series before its first bar to compute are left as they are in the output.
+    A series is started at its first bar if it is also its start, otherwise it is continued from the
+    (value, distance) of the previous bar in the state row, which is left with the values of the last bar.
+    """
+    for j in range(len(dist_from_ema)):
+        dist_row, high_row, low_row, distance_row = dist_from_ema[j], high[j], low[j], distance[j]
+        first = firsts[j]
+        if first >= len(dist_row):
+            continue
+
+        value_previous, distance_previous = state[j][0], state[j][1]
+        if first == starts[j]:
+            value_previous, distance_previous = 0.0, 0.0
+            distance_row[first] = 0.0
+            first += 1
+        for i in range(first, len(dist_row)):
+            value = 0.0
+            if high_row[i] == high_row[i] and low_row[i] == low_row[i]:  # not NaN
+                max_diff = high_row[i] - low_row[i]
+                if max_diff < 0.001:
+                    max_diff = 0.001
+                norm_value = 0.66 * ((dist_row[i] - low_row[i]) / max_diff - 0.5) + 0.67 * value_previous
+                if norm_value > 0.99:
+                    value = 0.999
+                elif norm_value < -0.99:
+                    value = -0.999
+                else:
+                    value = norm_value
+
+            denominator = 1 - value
+            if denominator < 0.001:
+                denominator = 0.001
+            distance_previous = 0.5 * math.log((1 + value) / denominator) + 0.5 * distance_previous
+            distance_row[i] = distance_previous
+            value_previous = value
+        state[j][0], state[j][1] = value_previous, distance_previous
+
+
+@kernel
+def sar_advance(sar, af, extreme):
+    # Parabolic step of a SAR towards the extreme point of the trend
+    return sar + af * (extreme - sar)
+
+
+@kernel
+def sar_accelerate(af, af_increment, af_maximum):
+    # Acceleration factor after a new extreme point, capped at the maximum
+    return min(af_maximum, af + af_increment)
+
+
+@kernel
+def lucid_sar_kernel(high, low, starts, firsts, af, af_initial, af_increment, af_maximum, sar, uptrend, ep, new_trend):
+    """
+    Lucid SAR state machine for each row of the (series, bars) inputs (see techanalysis.lucid_sar).
+    A series starts in an uptrend at its start bar, bars before its first bar to compute are left as they are in the outputs.
+    If the first bar is not the start (which can be before the inputs, i.e. negative) the series is continued:
+    the outputs of the previous bar must be filled in, and the acceleration factor is taken from af.
+    The acceleration factor of the last bar of each series is left in af.
+    """
+    for j in range(len(high)):
+        high_row, low_row = high[j], low[j]
+        sar_row, uptrend_row, ep_row, new_trend_row = sar[j], uptrend[j], ep[j], new_trend[j]
+        start, first = starts[j], firsts[j]
+        if first >= len(high_row):
+            continue
+
+        af_value = af[j]
+        if first == start:
+            sar_row[start] = low_row[start]
+            ep_row[start] = high_row[start]
+            uptrend_row[start] = True
+            af_value = af_initial
+            first += 1
+
+        for i in range(first, len(high_row)):
+            # Update extreme point and acceleration factor
+            if uptrend_row[i - 1]:
+                ep_row[i] = max(high_row[i], ep_row[i - 1])
+            else:
+                ep_row[i] = min(low_row[i], ep_row[i - 1])
+            if new_trend_row[i - 1]:
+                af_value = af_initial
+            elif ep_row[i] != ep_row[i - 1]:
+                af_value = sar_accelerate(af_value, af_increment, af_maximum)
+
+            # Calculate base SAR
+            sar_value = sar_advance(sar_row[i - 1], af_value, ep_row[i])
+
+            if uptrend_row[i - 1]:
+                low_2 = low_row[i - 2] if i - 2 >= start else low_row[i - 1]
+                sar_value = min(sar_value, low_row[i - 1], low_2)
+                if sar_value > low_row[i]:
+                    new_trend_row[i] = True
+                    sar_value = max(high_row[i], ep_row[i - 1])
+                    ep_row[i] = min(low_row[i], low_row[i - 1])
+                else:
+                    uptrend_row[i] = True
+            else:
+                high_2 = high_row[i - 2] if i - 2 >= start else high_row[i - 1]
+                sar_value = max(sar_value, high_row[i - 1], high_2)
+                if sar_value < high_row[i]:
+                    uptrend_row[i] = True
+                    new_trend_row[i] = True
+                    sar_value = min(low_row[i], ep_row[i - 1])
+                    ep_row[i] = max(high_row[i], high_row[i - 1])
+            sar_row[i] = sar_value
+        af[j] = af_value
+
+
+@kernel
+def psar_kernel(high, low, close, starts, af_initial, af_maximum, direction, psar, af):
+    """
+    Classic parabolic SAR for each row of the (series, bars) inputs (see techanalysis.SAR).
+    A series starts in an uptrend from the close of its second bar, the outputs are written from its third bar,
+    bars before are left as they are.
+    """
+    for j in range(len(high)):
+        high_row, low_row = high[j], low[j]
+        direction_row, psar_row, af_row = direction[j], psar[j], af[j]
+        start = starts[j]
+        if start + 2 >= len(high_row):
+            continue
+
+        bull = True
+        af_value = af_initial
+        hp, lp = high_row[start], low_row[start]
+        psar_value = close[j][start + 1]
+
+        for i in range(start + 2, len(high_row)):
+            psar_value = sar_advance(psar_value, af_value, hp if bull else lp)
+
+            reverse = False
+            if bull:
+                if low_row[i] < psar_value:
+                    bull = False
+                    reverse = True
+                    psar_value = hp
+                    lp = low_row[i]
+                    af_value = af_initial
+            else:
+                if high_row[i] > psar_value:
+                    bull = True
+                    reverse = True
+                    psar_value = lp
+                    hp = high_row[i]
+                    af_value = af_initial
+
+            # The SAR does not go past the extremes of the two previous bars
+            if not reverse:
+                if bull:
+                    if high_row[i] > hp:
+                        hp = high_row[i]
+                        af_value = sar_accelerate(af_value, af_initial, af_maximum)
+                    if low_row[i - 1] < psar_value:
+                        psar_value = low_row[i - 1]
+                    if low_row[i - 2] < psar_value:
+                        psar_value = low_row[i - 2]
+                else:
+                    if low_row[i] < lp:
+                        lp = low_row[i]
+                        af_value = sar_accelerate(af_value, af_initial, af_maximum)
+                    if high_row[i - 1] > psar_value:
+                        psar_value = high_row[i - 1]
+                    if high_row[i - 2] > psar_value:
+                        psar_value = high_row[i - 2]
+
+            direction_row[i] = 1.0 if bull else -1.0
+            psar_row[i] = psar_value
+            af_row[i] = af_value
+
+
+def lucid_sar_steps(high, low, starts, af_initial, af_increment, af_maximum):
+    """
+    Numpy version of lucid_sar_kernel for many series without numba: the loop is over the bars,
+    each step updates all the series at once.
+
+    :param high: (bars, series) array
+    :param low: (bars, series) array
+    :param starts: first bar of each series
+    :return: sar, uptrend, ep, new_trend arrays of the (bars, series) shape
+    """
+    size, columns = high.shape
+    sar = np.full((size, columns), np.nan)
+    ep = np.full((size, columns), np.nan)
+    uptrend = np.zeros((size, columns), dtype=bool)
+    new_trend = np.zeros((size, columns), dtype=bool)
+    af = np.full(columns, af_initial)
+
+    for i in range(size):
+        first = starts == i
+        sar[i, first] = low[i, first]
+        ep[i, first] = high[i, first]
+        uptrend[i, first] = True
+
+        active = starts < i
+        if not active.any():
+            continue
+
+        was_up = uptrend[i - 1]
+        ep_value = np.where(was_up, np.maximum(high[i], ep[i - 1]), np.minimum(low[i], ep[i - 1]))
+        af_value = np.where(new_trend[i - 1], af_initial,
+                            np.where(ep_value != ep[i - 1], np.minimum(af_maximum, af + af_increment), af))
+        sar_value = sar[i - 1] + af_value * (ep_value - sar[i - 1])
+
+        has_two_bars = i - 2 >= starts
+        low_2 = np.where(has_two_bars, low[i - 2], low[i - 1])
+        high_2 = np.where(has_two_bars, high[i - 2], high[i - 1])
+        up_sar = np.minimum(np.minimum(sar_value, low[i - 1]), low_2)
+        down_sar = np.maximum(np.maximum(sar_value, high[i - 1]), high_2)
+        reversal = np.where(was_up, up_sar > low[i], down_sar < high[i])
+
+        sar_value = np.where(was_up,
+                             np.where(reversal, np.maximum(high[i], ep[i - 1]), up_sar),
+                             np.where(reversal, np.minimum(low[i], ep[i - 1]), down_sar))
+        ep_value = np.where(reversal,
+                            np.where(was_up, np.minimum(low[i], low[i - 1]), np.maximum(high[i], high[i - 1])),
+                            ep_value)
+
+        sar[i, active] = sar_value[active]
+        ep[i, active] = ep_value[active]
+        uptrend[i, active] = (was_up != reversal)[active]
+        new_trend[i, active] = reversal[active]
+        af[active] = af_value[active]
+
+    return sar, uptrend, ep, new_trend
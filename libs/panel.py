@@ -0,0 +1,144 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+from libs.dtypes import cast_values, cast_dates
+
+
+class PricePanel:
+    """
+    OHLCV for a universe of stocks held in contiguous numpy arrays, one per field.
+    Rows are ordered by stock and date, each stock is a [start, end) slice of the arrays.
+
+    Usage:
+        panel = PricePanel.from_frame(prices_df)
+        ohlc_daily, volume_daily = panel.get_stock_price_data("AAPL")
+    """
+
+    fields = ["open", "high", "low", "close", "volume"]
+
+    def __init__(self, stocks, timestamps, values):
+        """
+        :param stocks: array of stock codes, sorted
+        :param timestamps: datetime64 array of bar dates, sorted within a stock
+        :param values: dictionary of field name to a numpy array of the same length
+        """
+        self.timestamps = timestamps
+        self.values = values
+
+        codes, starts = np.unique(stocks, return_index=True)
+        ends = np.append(starts[1:], len(stocks))
+        self.slices = {code: (start, end) for code, start, end in zip(codes, starts, ends)}
+
+    @classmethod
+    def from_frame(cls, df, policy=None):
+        """
+        Build a panel from a long dataframe with stock, date and OHLCV columns
+        :param policy: dtype policy of the arrays (see libs.dtypes), the configured one by default
+        """
+        df = df.sort_values(["stock", "date"], kind="stable")
+        values = {field: cast_values(field, df[field].to_numpy(dtype=float), policy)
+                  for field in cls.fields if field in df.columns}
+        timestamps = cast_dates(df["date"].to_numpy(dtype="datetime64[ns]"), policy)
+        return cls(df["stock"].to_numpy(dtype=str), timestamps, values)
+
+    def astype(self, policy):
+        """
+        :return: panel with the same prices in the dtypes of another policy
+        """
+        panel = copy.copy(self)
+        panel.timestamps = cast_dates(self.timestamps, policy)
+        panel.values = {field: cast_values(field, values, policy) for field, values in self.values.items()}
+        return panel
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + sum(values.nbytes for values in self.values.values())
+
+    def __contains__(self, stock):
+        return stock in self.slices
+
+    def __len__(self):
+        return len(self.slices)
+
+    @property
+    def codes(self):
+        return list(self.slices.keys())
+
+    def field(self, stock, field):
+        """
+        :return: numpy view of a field for the stock
+        """
+        start, end = self.slices[stock]
+        return self.values[field][start:end]
+
+    def dates(self, stock):
+        start, end = self.slices[stock]
+        return self.timestamps[start:end]
+
+    def locate(self, stock, date, look_backwards=True):
+        """
+        Binary search for the bar on or before (or on or after) the date
+
+        Returns:
+        int: Index of the bar in the panel arrays, None if there is no such bar
+        """
+        start, end = self.slices[stock]
+        date = pd.Timestamp(date).to_datetime64()
+        if look_backwards:
+            position = np.searchsorted(self.timestamps[start:end], date, side="right") - 1
+            return start + position if position >= 0 else None
+        position = np.searchsorted(self.timestamps[start:end], date, side="left")
+        return start + position if position < end - start else None
+
+    def date_range(self, stock, start_date, end_date):
+        """
+        :return: [start, end) indexes of the bars of the stock between the dates (inclusive)
+        """
+        start, end = self.slices[stock]
+        timestamps = self.timestamps[start:end]
+        first = np.searchsorted(timestamps, pd.Timestamp(start_date).to_datetime64(), side="left")
+        last = np.searchsorted(timestamps, pd.Timestamp(end_date).to_datetime64(), side="right")
+        return start + first, start + last
+
+    def matrix(self, field, stocks=None):
+        """
+        Field of many stocks aligned on their dates, the input of the *_batch indicators in libs.techanalysis
+        :param field: field name, e.g. "close"
+        :param stocks: stock codes for the columns, all the stocks of the panel by default
+        :return: dataframe with the dates in rows and the stocks in columns, NaN where a stock has no bar
+        (e.g. before it was listed)
+        """
+        codes = self.codes if stocks is None else [stock for stock in stocks if stock in self.slices]
+        dates, rows = np.unique(self.timestamps, return_inverse=True)
+
+        values = np.full((len(dates), len(codes)), np.nan)
+        for column, code in enumerate(codes):
+            start, end = self.slices[code]
+            values[rows[start:end], column] = self.values[field][start:end]
+        return pd.DataFrame(values, index=pd.DatetimeIndex(dates, name="timestamp"), columns=codes)
+
+    def get_stock_price_data(self, stock):
+        """
+        Same output as db.get_stock_price_data, served from the panel arrays
+
+        Returns:
+        tuple: (price_df, volume_df) containing price and volume data, (None, None) if the stock is not in the panel
+        """
+        if stock not in self.slices:
+            return None, None
+
+        start, end = self.slices[stock]
+        price_df = pd.DataFrame({
+            "timestamp": self.timestamps[start:end],
+            "open": self.values["open"][start:end],
+            "high": self.values["high"][start:end],
+            "low": self.values["low"][start:end],
+            "close": self.values["close"][start:end],
+        })
+        volume_df = pd.DataFrame({
+            "timestamp": self.timestamps[start:end],
+            "volume": self.values["volume"][start:end],
+        })
+        return price_df, volume_df
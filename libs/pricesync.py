@@ -0,0 +1,247 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pandas as pd
+from tqdm import tqdm
+
+from libs.db import (
+    create_stock_price_table,
+    delete_all_stock_prices,
+    bulk_add_stock_prices,
+    replace_stock_prices,
+    get_stock_price_date_ranges
+)
+from libs.exceptions_lib import OfflineCacheMiss, BulkRequestFailed
+from libs.fetcher import AsyncPriceFetcher
+from libs.helpers import get_previous_workday_from_date
+from libs.stocktools import get_exchange_bulk_prices, Market
+
+from libs.read_settings import read_config
+config = read_config()
+
+
+def plan_price_fetch(stored_range, start_date, latest_bar_date):
+    """
+    Decide which bars need to be fetched for a stock given the prices already stored.
+
+    Args:
+        stored_range: (first_date, last_date, last_close) of the stored prices or None
+        start_date: Start date for price data (YYYY-MM-DD)
+        latest_bar_date: Date of the most recent bar expected to be available (YYYY-MM-DD)
+
+    Returns:
+        tuple: (fetch_start, overlap) where fetch_start is None when the stored prices are up to date,
+               and overlap is the stored (last_date, last_close) to validate the delta against,
+               or None when the full history has to be fetched
+    """
+    if stored_range is None:
+        return start_date, None
+
+    first_date, last_date, last_close = stored_range
+    data_start = datetime.strptime(start_date, "%Y-%m-%d")
+    gap_tolerance = timedelta(days=config["price_sync"]["history_gap_tolerance_days"])
+
+    # Stored history does not cover the requested period or is too old to be continued
+    if first_date > data_start + gap_tolerance or last_date < data_start:
+        return start_date, None
+
+    if last_date.strftime("%Y-%m-%d") >= latest_bar_date:
+        return None, None
+
+    # Fetch starting from the last stored bar so that the overlap can be checked for splits
+    return last_date.strftime("%Y-%m-%d"), (last_date, last_close)
+
+
+def delta_matches_stored(price_df, overlap):
+    """
+    Check that the fetched delta continues the stored history.
+    Split adjusted prices change retroactively, so the overlapping bar would differ after a split.
+
+    Args:
+        price_df: Fetched OHLC dataframe starting from the last stored date
+        overlap: Stored (last_date, last_close)
+
+    Returns:
+        bool: True if the first fetched bar is the stored last bar with the same close
+    """
+    last_date, last_close = overlap
+    first_bar = price_df.iloc[0]
+    if first_bar["timestamp"].to_pydatetime() != last_date:
+        return False
+    return abs(float(first_bar["close"]) - last_close) <= config["price_sync"]["split_tolerance"] * abs(last_close)
+
+
+def sync_prices_from_bulk(stocks, market_lookup, stored_ranges, latest_bar_date):
+    """
+    Append the last day bar of every up-to-date stock from a single bulk request per market.
+    Only stocks whose stored prices end on the workday before the bulk bar and which had no split are updated,
+    the others are left for the per-stock fetch (new listings, gaps, splits, markets whose bulk request failed).
+
+    Args:
+        stocks: List of stock objects
+        market_lookup: Dictionary of exchange to Market object
+        stored_ranges: Stored (first_date, last_date, last_close) per stock, updated in place for synced stocks
+        latest_bar_date: Date of the most recent bar expected to be available (YYYY-MM-DD)
+
+    Returns:
+        int: Number of stocks synced from the bulk data
+    """
+    prices_to_add = []
+
+    for exchange, market in market_lookup.items():
+        codes = [stock.code for stock in stocks if stock.exchange == exchange and stock.code in stored_ranges]
+        if not codes:
+            continue
+
+        print(f"Getting bulk last day prices for {exchange} as of {latest_bar_date}")
+        try:
+            bars, split_codes = get_exchange_bulk_prices(market, latest_bar_date)
+        except BulkRequestFailed as error:
+            print(f"Bulk request for {exchange} failed ({error}), its stocks are fetched one by one")
+            continue
+
+        for code in codes:
+            bar = bars.get(code)
+            if bar is None or code in split_codes:
+                continue
+
+            first_date, last_date, last_close = stored_ranges[code]
+            bar_date = bar["date"]
+            previous_workday = get_previous_workday_from_date(bar_date)
+            if last_date.strftime("%Y-%m-%d") != previous_workday:
+                continue  # more than one bar is missing, or the bar is already stored
+
+            prices_to_add.append(dict(stock=code, exchange=exchange, **bar))
+            stored_ranges[code] = (first_date, bar_date, bar["close"])
+
+    if prices_to_add:
+        bulk_add_stock_prices(prices_to_add)
+
+    return len(prices_to_add)
+
+
+async def fetch_prices_for_stock(fetcher, stock, market, start_date, stored_range=None, latest_bar_date=None):
+    """
+    Fetch price data for a single stock.
+    Only the bars missing in the database are fetched, the full history is fetched if there is no data,
+    the stored history has a gap, or a split is detected.
+
+    Args:
+        fetcher: AsyncPriceFetcher to make the requests with
+        stock: Stock object containing code and exchange info
+        market: Market object for the stock
+        start_date: Start date for price data
+        stored_range: (first_date, last_date, last_close) of the stored prices, None to fetch the full history
+        latest_bar_date: Date of the most recent bar expected to be available
+
+    Returns:
+        tuple: (stock_code, dataframe of price rows or None, whether the stored prices should be replaced)
+    """
+    stock_code = f"{stock.code}{market.stock_suffix}"
+    try:
+        fetch_start, overlap = start_date, None
+        if stored_range is not None:
+            fetch_start, overlap = plan_price_fetch(stored_range, start_date, latest_bar_date)
+            if fetch_start is None:
+                return stock.code, None, False
+
+        price_df, volume_df = await fetcher.get_stock_data(stock_code, fetch_start)
+
+        if overlap is not None and (price_df is None or not delta_matches_stored(price_df, overlap)):
+            print(f"(i) gap or split detected for {stock_code}, fetching the full history")
+            overlap = None
+            price_df, volume_df = await fetcher.get_stock_data(stock_code, start_date)
+
+        rebuild = stored_range is not None and overlap is None
+
+        if price_df is not None:
+            prices_to_add = price_df.rename(columns={'timestamp': 'date'}).astype(
+                {'open': float, 'high': float, 'low': float, 'close': float}
+            )
+            prices_to_add['volume'] = volume_df['volume'].to_numpy(dtype=float)
+            prices_to_add.insert(0, 'stock', stock.code)
+            prices_to_add['exchange'] = stock.exchange
+            return stock.code, prices_to_add, rebuild
+
+        return stock.code, None, False
+
+    except OfflineCacheMiss:
+        raise
+    except Exception as e:
+        print(f"Error fetching data for {stock_code}: {str(e)}")
+        return stock.code, None, False
+
+
+
+def sync_stock_prices(stocks, start_date, latest_bar_date, clear_existing=False):
+    """
+    Bring the stored prices of the stocks up to date, shared by the scanner and the simulator.
+    Prices already in the database are synced incrementally: only the missing bars are fetched and upserted,
+    using concurrent async requests with the concurrency and the request rate set in the fetcher section of the config.
+
+    Args:
+        stocks: List of objects with the stock code and exchange attributes
+        start_date: Start date for price data (YYYY-MM-DD)
+        latest_bar_date: Date of the most recent bar expected to be available (YYYY-MM-DD)
+        clear_existing: Whether to clear existing price data before storing
+    """
+    create_stock_price_table()
+    if clear_existing:
+        print("Clearing existing data...")
+        delete_all_stock_prices()
+
+    # Stored price bounds per stock to only fetch the missing bars
+    stored_ranges = get_stock_price_date_ranges()
+    print(f"Stored prices found for {len([s for s in stocks if s.code in stored_ranges])} of {len(stocks)} stocks, "
+          f"syncing the missing bars up to {latest_bar_date}")
+
+    # Create a market lookup dictionary to avoid creating Market objects repeatedly
+    market_lookup = {stock.exchange: Market(stock.exchange) for stock in stocks}
+
+    # Daily delta for the whole exchange in one request, per-stock calls are then only needed for backfills
+    if config["price_sync"]["mode"] == "bulk":
+        synced_number = sync_prices_from_bulk(stocks, market_lookup, stored_ranges, latest_bar_date)
+        print(f"Added the last day bar for {synced_number} stocks from the bulk data")
+
+    # Prices are written in large transactions as the results arrive
+    store_batch_size = 500
+    pending_prices, rebuilt_stocks = [], []
+
+    def store_pending():
+        if pending_prices:
+            try:
+                # The stored prices of the rebuilt stocks are only removed together with the insert of the new ones
+                replace_stock_prices(rebuilt_stocks, pd.concat(pending_prices, ignore_index=True))
+            except Exception as e:
+                print(f"Error storing prices: {str(e)}")
+        pending_prices.clear()
+        rebuilt_stocks.clear()
+
+    async def fetch_all():
+        async with AsyncPriceFetcher.from_config(config["fetcher"]) as fetcher:
+            tasks = [
+                fetch_prices_for_stock(
+                    fetcher,
+                    stock,
+                    market_lookup[stock.exchange],
+                    start_date,
+                    stored_ranges.get(stock.code),
+                    latest_bar_date
+                ) for stock in stocks
+            ]
+            with tqdm(total=len(stocks), desc='Fetching data') as pbar:
+                stored_number = 0
+                for result in asyncio.as_completed(tasks):
+                    stock_code, prices, rebuild = await result
+                    if prices is not None:
+                        pending_prices.append(prices)
+                        if rebuild:
+                            rebuilt_stocks.append(stock_code)
+                        stored_number += 1
+                    if stored_number >= store_batch_size:
+                        store_pending()
+                        stored_number = 0
+                    pbar.update(1)
+                store_pending()
+
+    asyncio.run(fetch_all())
@@ -0,0 +1,94 @@
+from time import perf_counter
+
+
+class Rule:
+    """
+    Condition of a signal with its estimated cost, and the stats of its evaluations
+    """
+
+    def __init__(self, name, check, cost):
+        """
+        :param name: name of the condition in the output and the stats
+        :param check: callable returning whether the condition is met, called with the arguments of RuleSet.evaluate
+        :param cost: estimated time of the check in milliseconds, orders the rules until their time is measured
+        """
+        self.name = name
+        self.check = check
+        self.cost = cost
+        self.evaluated = 0
+        self.passed = 0
+        self.seconds = 0.0
+
+    def record(self, passed, seconds):
+        self.evaluated += 1
+        self.passed += passed
+        self.seconds += seconds
+
+    def rank(self, min_samples):
+        """
+        Expected time spent per stock rejected by the rule (cost / failure rate), the rules run from the lowest rank.
+        The declared cost and an even pass rate are used until the rule has been evaluated min_samples times.
+        """
+        if self.evaluated < min_samples:
+            return self.cost / 0.5
+        pass_rate = self.passed / self.evaluated
+        if pass_rate == 1:
+            return float("inf")
+        return self.seconds / self.evaluated * 1000 / (1 - pass_rate)
+
+
+class RuleSet:
+    """
+    Conditions of a signal which all have to be met, evaluated cheapest first and up to the first failure.
+    The order adapts to the measured time and pass rate of the rules: every adapt_every evaluations
+    the rules are sorted by their expected time per rejected stock.
+    With verbose, all the rules are evaluated (e.g. to print the diagnostics of every condition).
+
+    Usage:
+        rules = RuleSet("bullish anx", [Rule("trigger", lambda daily, weekly: ..., cost=4), ...])
+        result, results = rules.evaluate(ohlc_daily, ohlc_weekly)
+    """
+
+    def __init__(self, name, rules, adapt_every=100, min_samples=20):
+        self.name = name
+        self.rules = list(rules)
+        self.adapt_every = adapt_every
+        self.min_samples = min_samples
+        self.evaluations = 0
+        self.order = sorted(self.rules, key=lambda rule: rule.rank(min_samples))
+
+    def reset(self):
+        for rule in self.rules:
+            rule.evaluated, rule.passed, rule.seconds = 0, 0, 0.0
+        self.evaluations = 0
+        self.order = sorted(self.rules, key=lambda rule: rule.rank(self.min_samples))
+
+    def evaluate(self, *args, verbose=False):
+        """
+        Evaluate the rules with the arguments
+
+        Returns:
+        tuple: (result, {rule name: bool}) - whether all the rules are met, and the results of the evaluated rules
+               (all of them with verbose, otherwise up to the first failure)
+        """
+        results = {}
+        for rule in self.order:
+            start = perf_counter()
+            passed = bool(rule.check(*args))
+            rule.record(passed, perf_counter() - start)
+            results[rule.name] = passed
+            if not passed and not verbose:
+                break
+
+        self.evaluations += 1
+        if self.evaluations % self.adapt_every == 0:
+            self.order = sorted(self.rules, key=lambda rule: rule.rank(self.min_samples))
+        return all(results.values()), results
+
+    def summary(self):
+        details = ", ".join(
+            f"{rule.name} {rule.passed}/{rule.evaluated} passed "
+            f"{rule.seconds / rule.evaluated * 1000 if rule.evaluated else 0:.2f}ms"
+            for rule in self.order
+        )
+        return f"Rules of {self.name} for {self.evaluations} stocks, in the current order: {details}"
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+
+def right_aligned(values, ids, ends, depth):
+    # Matrix with the bars of each stock in its column, the latest bar in the last row and NaN before the first bar
+    # (filled row by row in the order of the panel arrays and transposed)
+    matrix = np.full((len(ends), depth), np.nan, dtype=values.dtype if values.dtype.kind == "f" else float)
+    matrix[ids, depth - ends[ids] + np.arange(len(ids))] = values
+    return matrix.T
+
+
+class UniverseBars:
+    """
+    Daily and weekly bars of a universe of stocks as matrices for the vectorised screening,
+    bars in rows and stocks in columns. Columns are aligned on the latest bar of each stock (not on dates),
+    so that the last rows are the iloc[-1], iloc[-2], ... of the per-stock frames, and a recursive indicator
+    calculated on a column gives the same values as on the frame of the stock.
+    Prices keep the dtype of the panel (see libs.dtypes), as the per-stock frames do.
+
+    Usage:
+        bars = UniverseBars(panel, date="2025-03-01")
+        closes = bars.daily["close"]  # closes[-1] are the latest closes of all the stocks
+    """
+
+    def __init__(self, panel, stocks=None, date=None):
+        """
+        :param panel: PricePanel with the prices of the stocks
+        :param stocks: stock codes for the columns, all the stocks of the panel by default
+        :param date: only the bars before the date are used (as in scanner.process_data_at_date)
+        """
+        self.codes = panel.codes if stocks is None else [stock for stock in stocks if stock in panel]
+        self.index = pd.Index(self.codes, name="stock")
+        slices = [panel.slices[code] for code in self.codes]
+        rows = np.concatenate([np.arange(start, end) for start, end in slices] + [np.zeros(0, dtype=np.int64)])
+        ids = np.repeat(np.arange(len(slices)), [end - start for start, end in slices])
+
+        timestamps = panel.timestamps[rows]
+        if date is not None:
+            before = timestamps < pd.Timestamp(date).to_datetime64()
+            rows, ids, timestamps = rows[before], ids[before], timestamps[before]
+
+        # Weeks start on Monday as in stocktools.ohlc_daily_to_weekly, day 0 of datetime64 is a Thursday
+        days = timestamps.astype("datetime64[D]").astype(np.int64)
+        weeks = days - (days + 3) % 7
+        new_week = np.ones(len(rows), dtype=bool)
+        new_week[1:] = (ids[1:] != ids[:-1]) | (weeks[1:] != weeks[:-1])
+        week_starts = np.flatnonzero(new_week)
+        week_ends = np.append(week_starts[1:], len(rows))
+        week_ids = ids[week_starts]
+
+        self.daily_bars = np.bincount(ids, minlength=len(self.codes))
+        self.weekly_bars = np.bincount(week_ids, minlength=len(self.codes))
+        daily_ends, weekly_ends = np.cumsum(self.daily_bars), np.cumsum(self.weekly_bars)
+        # At least 8 rows, so that the latest bars can be indexed for any stock
+        daily_depth, weekly_depth = max(self.daily_bars.max(initial=0), 8), max(self.weekly_bars.max(initial=0), 8)
+
+        values = {field: panel.values[field][rows] for field in panel.values}
+        self.daily = {field: right_aligned(values[field], ids, daily_ends, daily_depth) for field in values}
+
+        weekly_values = {"open": values["open"][week_starts], "close": values["close"][week_ends - 1]}
+        if len(rows):
+            weekly_values["high"] = np.fmax.reduceat(values["high"], week_starts)
+            weekly_values["low"] = np.fmin.reduceat(values["low"], week_starts)
+        else:
+            weekly_values["high"], weekly_values["low"] = values["high"], values["low"]
+        self.weekly = {field: right_aligned(weekly_values[field], week_ids, weekly_ends, weekly_depth)
+                       for field in weekly_values}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def series(self, mask):
+        return pd.Series(mask, index=self.index)
+
+
+def screening_summary(masks):
+    """
+    :return: printable numbers of stocks meeting each condition
+    """
+    counts = ", ".join(f"{name} {int(mask.sum())}" for name, mask in masks.items())
+    return f"Screened {len(masks['signal'])} stocks: {counts}"
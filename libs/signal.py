@@ -1,5 +1,7 @@
 from libs.techanalysis import MA, StochRSI, coppock_curve, lucid_sar
+from libs.feature_cache import feature_cache
 from libs.helpers import format_bool
+from libs.rules import Rule, RuleSet
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
@@ -80,7 +82,7 @@ def weekly_close_above_ma(ma_weekly_values, weekly_closes):
 
 
 def volume_spike(volume_daily):
-    volume_ma_20 = MA(volume_daily, 20, colname="volume")
+    volume_ma_20 = moving_average(volume_daily, 20, colname="volume")
     mergedDf = volume_daily.merge(volume_ma_20, left_index=True, right_index=True)
     mergedDf.dropna(inplace=True, how="any")
     mergedDf["volume_above_average"] = mergedDf["volume"].ge(
@@ -151,7 +153,9 @@ def recent_close_above_last(ohlc_with_indicators_daily):
 
 
 def stoch_rsi_in_range(ohlc_with_indicators_daily):
-    stoch_rsi_k,  stoch_rsi_d = StochRSI(ohlc_with_indicators_daily)
+    stoch_rsi_k,  stoch_rsi_d = feature_cache.get(
+        ohlc_with_indicators_daily, "stoch_rsi", (), lambda: StochRSI(ohlc_with_indicators_daily)
+    )
 
     stock_rsi_max = max(stoch_rsi_k.iloc[-1], stoch_rsi_d.iloc[-1])
     stoch_rsi_in_range_condition = stock_rsi_max < 0.9  # less than 90% per tests
@@ -181,8 +185,12 @@ def price_above_ma(ohlc_with_indicators_daily, ma_values, ma_length):
     return condition
 
 def coppock_is_positive(ohlc_with_indicators_daily, ohlc_with_indicators_weekly):
-    coppock_daily = coppock_curve(ohlc_with_indicators_daily).iloc[-1].values[0]
-    coppock_weekly = coppock_curve(ohlc_with_indicators_weekly).iloc[-1].values[0]
+    coppock_daily = feature_cache.get(
+        ohlc_with_indicators_daily, "coppock", (), lambda: coppock_curve(ohlc_with_indicators_daily)
+    ).iloc[-1].values[0]
+    coppock_weekly = feature_cache.get(
+        ohlc_with_indicators_weekly, "coppock", (), lambda: coppock_curve(ohlc_with_indicators_weekly)
+    ).iloc[-1].values[0]
     condition = (coppock_daily > 0) and (coppock_weekly > 0)
     return condition
 
@@ -363,15 +371,15 @@ def bullish_mri_based(
     )
 
     # MA daily
-    ma10 = MA(ohlc_with_indicators_daily, 10)
-    ma20 = MA(ohlc_with_indicators_daily, 20)
-    ma30 = MA(ohlc_with_indicators_daily, 30)
+    ma10 = moving_average(ohlc_with_indicators_daily, 10)
+    ma20 = moving_average(ohlc_with_indicators_daily, 20)
+    ma30 = moving_average(ohlc_with_indicators_daily, 30)
     ma_daily_values = dict(ma10=ma10, ma20=ma20, ma30=ma30,)
 
     # MA weekly
-    ma10_weekly = MA(ohlc_with_indicators_weekly, 10)
-    ma20_weekly = MA(ohlc_with_indicators_weekly, 20)
-    ma30_weekly = MA(ohlc_with_indicators_weekly, 30)
+    ma10_weekly = moving_average(ohlc_with_indicators_weekly, 10)
+    ma20_weekly = moving_average(ohlc_with_indicators_weekly, 20)
+    ma30_weekly = moving_average(ohlc_with_indicators_weekly, 30)
     ma_weekly_values = dict(ma10=ma10_weekly, ma20=ma20_weekly, ma30=ma30_weekly,)
 
     # MA30 may be None for too new stocks
@@ -472,6 +480,33 @@ def is_ma_rising(ma_values, ma_length, lookback_period=5, spread=2):
     return rising_percentage >= 0.8
 
 
+def moving_average(df, length, colname="close", ma_type="simple"):
+    # MA values shared by all the signal functions through the feature cache
+    return feature_cache.get(
+        df, "ma", (length, colname, ma_type), lambda: MA(df, length, colname=colname, ma_type=ma_type)
+    )
+
+
+def exponential_ma(ohlc, length):
+    # EMA values precomputed by the indicator state store if available (see scanner.generate_indicators_daily_weekly)
+    def compute():
+        if f"ema{length}" in ohlc.columns:
+            return ohlc[[f"ema{length}"]].rename(columns={f"ema{length}": f"ma{length}"})
+        return MA(ohlc, length=length, ma_type='exponential')
+
+    return feature_cache.get(ohlc, "ma", (length, "close", "exponential"), compute)
+
+
+def weekly_lucid_sar(ohlc_weekly):
+    # Lucid SAR values precomputed by the indicator state store if available
+    def compute():
+        if "sar" in ohlc_weekly.columns:
+            return ohlc_weekly[["sar", "uptrend", "ep", "new_trend"]]
+        return lucid_sar(ohlc_weekly)
+
+    return feature_cache.get(ohlc_weekly, "lucid_sar", (), compute)
+
+
 def is_bullish_sar(sar_values):
     # Check whether SAR indicates uptrend
     return (sar_values["uptrend"].iloc[-1])
@@ -547,6 +582,45 @@ def check_wick_conditions(ohlc_daily, lookback=5, max_wick_bodies=2):
     return True
 
 
+def bullish_anx_crosses(ohlc_daily):
+    # MA3/MA12 bullish cross and the price cross above the MA12, each only if enabled by the trigger type
+    trigger_type = config["strategy"]["anx"]["trigger_type"]
+    ma3 = exponential_ma(ohlc_daily, 3)
+    ma12 = exponential_ma(ohlc_daily, 12)
+    ma_cross = trigger_type in ["ma_cross", "both"] and recent_bullish_cross(ma3, ma12, 3, 12)
+    price_cross = trigger_type in ["price_cross", "both"] and price_crossed_ma(ohlc_daily, ma3, 3, ma12, 12)
+    return ma_cross, price_cross
+
+
+def price_trigger_check(check):
+    # Conditions added when looking at price cross rather than MA cross, met otherwise
+    def rule_check(ohlc_daily, ohlc_weekly):
+        if config["strategy"]["anx"]["trigger_type"] not in ["price_cross", "both"]:
+            return True
+        return check(ohlc_daily)
+    return rule_check
+
+
+# Rules of the anx signals with their estimated costs in ms (per stock, without the indicator state store),
+# evaluated cheapest first and up to the first failed one unless the output is requested
+bullish_anx_rules = RuleSet("bullish anx", [
+    Rule("trigger", lambda ohlc_daily, ohlc_weekly: any(bullish_anx_crosses(ohlc_daily)), cost=4),
+    Rule("bullish_sar", lambda ohlc_daily, ohlc_weekly: is_bullish_sar(weekly_lucid_sar(ohlc_weekly)), cost=3),
+    Rule("ma50_rising", lambda ohlc_daily, ohlc_weekly: is_ma_rising(
+        exponential_ma(ohlc_daily, 50), 50, lookback_period=5, spread=2), cost=2),
+    Rule("not_overextended", lambda ohlc_daily, ohlc_weekly: weekly_not_overextended(ohlc_weekly), cost=0.5),
+    Rule("recent_green", price_trigger_check(check_recent_green_candle), cost=1.2),
+    Rule("drawdown", price_trigger_check(check_max_drawdown), cost=1.1),
+    Rule("wick", price_trigger_check(check_wick_conditions), cost=1.4),
+])
+
+bearish_anx_rules = RuleSet("bearish anx", [
+    Rule("trigger", lambda ohlc_daily, ohlc_weekly: recent_bearish_cross(
+        exponential_ma(ohlc_daily, 3), exponential_ma(ohlc_daily, 12), 3, 12), cost=4),
+    Rule("bearish_sar", lambda ohlc_daily, ohlc_weekly: is_bearish_sar(weekly_lucid_sar(ohlc_weekly)), cost=3),
+])
+
+
 def bullish_anx_based(
         ohlc_with_indicators_daily,
         volume_daily,
@@ -554,63 +628,24 @@ def bullish_anx_based(
         output=True,
         stock_name="",
 ):
-    # Read config for strategy settings
-    config = read_config()
+    # Conditions are evaluated by bullish_anx_rules, all of them only with the output
     trigger_type = config["strategy"]["anx"]["trigger_type"]
-
-    # Lucid SAR calculations
-    sar_values = lucid_sar(ohlc_with_indicators_weekly)   # the lucid sar itself works well
-
-    # Check for the uptrend Lucid SAR conditions
-    bullish_sar_condition = is_bullish_sar(sar_values)
-
-    # MA calculations
-    ma3 = MA(ohlc_with_indicators_daily, length=3, ma_type='exponential')
-    ma12 = MA(ohlc_with_indicators_daily, length=12, ma_type='exponential')
-    ma50 = MA(ohlc_with_indicators_daily, length=50, ma_type='exponential')
-    ma200 = MA(ohlc_with_indicators_daily, length=200, ma_type='exponential')
-
-    # Check trigger conditions based on config
-    ma_cross_condition = False
-    price_cross_condition = False
-
-    if trigger_type in ["ma_cross", "both"]:
-        ma_cross_condition = recent_bullish_cross(ma3, ma12, 3, 12)
-
-    if trigger_type in ["price_cross", "both"]:
-        price_cross_condition = price_crossed_ma(ohlc_with_indicators_daily, ma3, 3, ma12, 12)
-
-    # Combined trigger condition based on strategy setting
-    if trigger_type == "both":
-        trigger_condition = ma_cross_condition or price_cross_condition
-    else:
-        trigger_condition = ma_cross_condition if trigger_type == "ma_cross" else price_cross_condition
+    result, results = bullish_anx_rules.evaluate(
+        ohlc_with_indicators_daily, ohlc_with_indicators_weekly, verbose=output
+    )
 
     # Create note about which condition triggered
     trigger_note = ""
-    if ma_cross_condition and trigger_type != "price_cross":
-        trigger_note = "[MA3/MA12 bullish cross]"
-    elif price_cross_condition and trigger_type != "ma_cross":
-        trigger_note = "[Price crossed above MA12]"
-
-    # Other existing conditions
-    # price_above_ma_condition = price_above_ma(ohlc_with_indicators_daily, ma200, 200) # Removing this rule and tracking instead
-    not_overextended = weekly_not_overextended(ohlc_with_indicators_weekly)
-
-    # Add MA50 rising condition with spread comparison
-    ma50_rising = is_ma_rising(ma50, 50, lookback_period=5, spread=2)
-
-    # Add new conditions when looking at price cross rather than MA cross
-    if trigger_type in ["price_cross", "both"]:
-        recent_green_condition = check_recent_green_candle(ohlc_with_indicators_daily)
-        drawdown_condition = check_max_drawdown(ohlc_with_indicators_daily)
-        wick_condition = check_wick_conditions(ohlc_with_indicators_daily)
-    else:
-        recent_green_condition = drawdown_condition = wick_condition = True
+    if results.get("trigger"):
+        ma_cross_condition, price_cross_condition = bullish_anx_crosses(ohlc_with_indicators_daily)
+        if ma_cross_condition and trigger_type != "price_cross":
+            trigger_note = "[MA3/MA12 bullish cross]"
+        elif price_cross_condition and trigger_type != "ma_cross":
+            trigger_note = "[Price crossed above MA12]"
 
     if output:
         # Get actual MA50 values for detailed output
-        ma50_values = ma50['ma50'].tail(5)
+        ma50_values = exponential_ma(ohlc_with_indicators_daily, 50)['ma50'].tail(5)
         ma50_current = ma50_values.iloc[-1]
         ma50_prev = ma50_values.iloc[-3]  # Looking 2 periods back
         ma50_change = (ma50_current - ma50_prev) / ma50_prev * 100
@@ -618,28 +653,15 @@ def bullish_anx_based(
         print(
             f"- {stock_name} | "
             f"Strategy type: {trigger_type} | "
-            #f"Price above MA200: [{format_bool(price_above_ma_condition)}] | "
-            f"Price trigger: [{format_bool(trigger_condition)}] {trigger_note} | "
-            f"Bullish weekly SAR: [{format_bool(bullish_sar_condition)}] | "
-            f"MA50 rising: [{format_bool(ma50_rising)}] ({ma50_change:+.2f}%) | "
-            f"not overextended: [{format_bool(not_overextended)}] | "
-            f"Recent green OK: [{format_bool(recent_green_condition)}] | "
-            f"Drawdown OK: [{format_bool(drawdown_condition)}] | "
-            f"Wick OK: [{format_bool(wick_condition)}]"
+            f"Price trigger: [{format_bool(results['trigger'])}] {trigger_note} | "
+            f"Bullish weekly SAR: [{format_bool(results['bullish_sar'])}] | "
+            f"MA50 rising: [{format_bool(results['ma50_rising'])}] ({ma50_change:+.2f}%) | "
+            f"not overextended: [{format_bool(results['not_overextended'])}] | "
+            f"Recent green OK: [{format_bool(results['recent_green'])}] | "
+            f"Drawdown OK: [{format_bool(results['drawdown'])}] | "
+            f"Wick OK: [{format_bool(results['wick'])}]"
         )
 
-    confirmation = [
-        #price_above_ma_condition,
-        trigger_condition,
-        bullish_sar_condition,
-        ma50_rising,
-        not_overextended,
-        recent_green_condition,
-        drawdown_condition,
-        wick_condition
-    ]
-
-    result = False not in confirmation
     numerical_score = 5  # not used but keep for the output structure
 
     return result, numerical_score, trigger_note
@@ -651,54 +673,25 @@ def bearish_anx_based(
         output=True,
         stock_name="",
 ):
-    # Read config for strategy settings
-    config = read_config()
+    # Conditions are evaluated by bearish_anx_rules, all of them only with the output
     trigger_type = config["strategy"]["anx"]["trigger_type"]
-
-    # Lucid SAR calculations
-    sar_values = lucid_sar(ohlc_with_indicators_weekly)   # the lucid sar itself works well
-
-    # Check for the uptrend Lucid SAR conditions
-    # TODO (?): add check of bearish cross happening on the wave change, not just inside the wave (maybe)
-    bearish_sar_condition = is_bearish_sar(sar_values)
-
-    # MA calculations
-    ma3 = MA(ohlc_with_indicators_daily, length=3, ma_type='exponential')
-    ma12 = MA(ohlc_with_indicators_daily, length=12, ma_type='exponential')
-    ma50 = MA(ohlc_with_indicators_daily, length=50, ma_type='exponential')
-    ma200 = MA(ohlc_with_indicators_daily, length=200, ma_type='exponential')
-
-    # Check trigger conditions based on config
-    ma_cross_condition = False
-    price_cross_condition = False
-
     if trigger_type in ["price_cross", "both"]:
         raise NotImplementedError("Price cross triger not supported for the bearish direction")
 
-    ma_cross_condition = recent_bearish_cross(ma3, ma12, 3, 12)
-    trigger_condition = ma_cross_condition
+    # TODO (?): add check of bearish cross happening on the wave change, not just inside the wave (maybe)
+    result, results = bearish_anx_rules.evaluate(
+        ohlc_with_indicators_daily, ohlc_with_indicators_weekly, verbose=output
+    )
     trigger_note = "[MA3/MA12 bearish cross]"
 
     if output:
-        # Get actual MA50 values for detailed output
-        # ma50_values = ma50['ma50'].tail(5)
-        # ma50_current = ma50_values.iloc[-1]
-        # ma50_prev = ma50_values.iloc[-3]  # Looking 2 periods back
-        # ma50_change = (ma50_current - ma50_prev) / ma50_prev * 100
-
         print(
             f"- {stock_name} | "
             f"Strategy type: {trigger_type} | " 
-            f"Price trigger: [{format_bool(trigger_condition)}] {trigger_note} | "
-            f"Bearish weekly SAR: [{format_bool(bearish_sar_condition)}] | "
+            f"Price trigger: [{format_bool(results['trigger'])}] {trigger_note} | "
+            f"Bearish weekly SAR: [{format_bool(results['bearish_sar'])}] | "
         )
 
-    confirmation = [
-        trigger_condition,
-        bearish_sar_condition
-    ]
-
-    result = False not in confirmation
     numerical_score = 5  # not used but keep for the output structure
 
     return result, numerical_score, trigger_note
@@ -723,7 +716,7 @@ def red_day_on_volume(
         < ohlc_with_indicators_daily["open"].iloc[-1]
     )
 
-    volume_ma_20 = MA(volume_daily, 20, colname="volume")
+    volume_ma_20 = moving_average(volume_daily, 20, colname="volume")
 
     mergedDf = volume_daily.merge(volume_ma_20, left_index=True, right_index=True)
     mergedDf.dropna(inplace=True, how="any")
@@ -768,8 +761,8 @@ def market_bearish(
     :param stock_name: name of a stock
     :return:
     """
-    ma200 = MA(ohlc_with_indicators_daily, 200)
-    ma10 = MA(ohlc_with_indicators_daily, 10)
+    ma200 = moving_average(ohlc_with_indicators_daily, 200)
+    ma10 = moving_average(ohlc_with_indicators_daily, 10)
 
     # Condition: market is below MA200
     market_below_ma_200 = (
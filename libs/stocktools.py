@@ -1,10 +1,14 @@
 # from libs.exceptions_lib import exception_handler
+import codecs
 import json
+import numpy as np
 import pandas as pd
 import requests
 import os
 import time
 from requests.exceptions import RequestException
+from libs.http_cache import cached_get, cached_stream
+from libs.exceptions_lib import OfflineCacheMiss, BulkRequestFailed
 
 session = None  # to use in requests
 eod_key = os.environ.get("API_KEY")
@@ -42,49 +46,145 @@ def get_industry_mapping(exchange):
         return industry_mapping_asx
 
 
-# Using proper api
-def get_exchange_symbols(market_object, checked_workday, min_market_cap):
-    global session
+def iter_json_array(chunks):
+    """
+    Incrementally parse a JSON array from byte chunks, yielding the elements as they are complete.
+    Only the current chunk and the unparsed tail are held in memory.
 
-    stocks = []
-    excluded_count = 0
+    Args:
+        chunks: Iterable of bytes
+
+    Yields:
+        Parsed array elements
+    """
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    array_started = False
+    finished = False
+    chunks = iter(chunks)
+
+    while True:
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            buffer += utf8_decoder.decode(b"", final=True)
+        else:
+            buffer += utf8_decoder.decode(chunk)
+
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if not array_started:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array in the response")
+                array_started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                # Consume the rest of the body so that the stream is completed (and cached)
+                for _ in chunks:
+                    pass
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if finished:
+                    raise
+                break  # element is not complete yet
+            # A value which ends with the buffer could be cut (e.g. a number), wait for the next chunk
+            if end == len(buffer) and not finished:
+                break
+            yield element
+            position = end
+
+        buffer = buffer[position:]
+        if finished:
+            if array_started:
+                raise ValueError("Unexpected end of the JSON array in the response")
+            return
+
+
+def get_bulk_last_day(market_object, checked_workday, data_type=None):
+    """
+    Fetch the eod-bulk-last-day response for a whole exchange.
+    The response is parsed as a stream, so the records of a large exchange are never held in memory at once.
+
+    Args:
+        market_object: Market object with market parameters
+        checked_workday (str): Date to get the data for in YYYY-MM-DD format
+        data_type (str): None for the extended OHLCV data, or 'splits' / 'dividends'
+
+    Returns:
+        iterator: Response records as they are parsed, None if the exchange is not found
+
+    Raises:
+        BulkRequestFailed: if the response is not Ok or the attempts fail
+    """
+    global session
 
     if session is None:
         session = requests.Session()
 
-    url = f"https://eodhistoricaldata.com/api/eod-bulk-last-day/{market_object.exchange_url_part}?api_token={eod_key}&fmt=json&filter=extended&date={checked_workday}"
+    url = f"https://eodhistoricaldata.com/api/eod-bulk-last-day/{market_object.exchange_url_part}?api_token={eod_key}&fmt=json&date={checked_workday}"
+    if data_type is None:
+        url = f"{url}&filter=extended"
+    else:
+        url = f"{url}&type={data_type}"
     params = {"api_token": eod_key}
     max_attempts = 5
     attempt = 0
 
     while attempt < max_attempts:
-        r = session.get(url, params=params)
+        status_code, chunks = cached_stream(session, url, "eod-bulk-last-day", params=params)
 
-        if r.status_code == 404:
+        if status_code == 404:
             print(f"Ticker not found, skipping")
-            return None, None
+            return None
 
-        if r.status_code == 502:
+        if status_code == 502:
             print("Received status code 502, retrying...")
             time.sleep(1)
             attempt += 1
             continue
 
-        if r.status_code != requests.codes.ok and r.status_code != 502:
-            print(f"Status response is not Ok: {r.status_code}")
-            exit(0)
+        if status_code != requests.codes.ok and status_code != 502:
+            raise BulkRequestFailed(f"status response is not Ok: {status_code}")
 
         break
     else:
-        print("Maximum attempts reached, exiting...")
+        raise BulkRequestFailed("maximum attempts reached")
+
+    return iter_json_array(chunks)
+
+
+# Using proper api
+def get_exchange_symbols(market_object, checked_workday, min_market_cap):
+    """
+    Stocks of an exchange with the market cap of at least min_market_cap.
+    Records are filtered as they are parsed from the bulk response, so only the compact rows are kept.
+
+    Yields:
+        dict: Stock row for the Stock table
+    """
+    excluded_count = 0
+
+    try:
+        data = get_bulk_last_day(market_object, checked_workday)
+    except BulkRequestFailed as error:
+        print(f"Error getting the stocks of {market_object.market_code}: {error}, exiting...")
         exit(0)
+    if data is None:
+        return
 
-    data = json.loads(r.text)
     for elem in data:
-        market_cap = elem.get("MarketCapitalization", 0)
+        market_cap = elem.get("MarketCapitalization") or 0
 
         if market_cap >= min_market_cap:
-            stock = dict(
+            yield dict(
                 code=elem["code"],
                 name=elem["name"],
                 price=elem["close"],
@@ -93,12 +193,48 @@ def get_exchange_symbols(market_object, checked_workday, min_market_cap):
                 exchange=market_object.market_code,
                 market_cap=market_cap
             )
-            stocks.append(stock)
         else:
             excluded_count += 1
 
     print(f"Excluded {excluded_count} stocks due to market cap below {min_market_cap}")
-    return stocks
+
+
+def get_exchange_bulk_prices(market_object, checked_workday):
+    """
+    Get the last day OHLCV bar for every ticker of an exchange in one request
+
+    Args:
+        market_object: Market object with market parameters
+        checked_workday (str): Date to get the bars for in YYYY-MM-DD format
+
+    Returns:
+        tuple: (dict {code: bar dictionary}, set of codes with a split on the date)
+
+    Raises:
+        BulkRequestFailed: if the bars or the splits cannot be fetched
+    """
+    data = get_bulk_last_day(market_object, checked_workday)
+    if data is None:
+        return dict(), set()
+
+    bars = dict()
+    for elem in data:
+        if None in (elem.get("open"), elem.get("high"), elem.get("low"), elem.get("close"), elem.get("volume")):
+            continue
+        bars[elem["code"]] = dict(
+            date=pd.to_datetime(elem["date"]).to_pydatetime(),
+            open=float(elem["open"]),
+            high=float(elem["high"]),
+            low=float(elem["low"]),
+            close=float(elem["close"]),
+            volume=float(elem["volume"])
+        )
+
+    # Bulk bars are not split adjusted, so the stocks with splits need a full history fetch
+    splits = get_bulk_last_day(market_object, checked_workday, data_type="splits") or []
+    split_codes = {elem["code"] for elem in splits}
+
+    return bars, split_codes
 
 
 # Add to stocktools.py
@@ -126,7 +262,7 @@ def get_earnings_calendar(date_from, date_to):
     earnings_stocks = set()
 
     try:
-        response = session.get(url, headers=headers)
+        response = cached_get(session, url, "earnings_calendar", headers=headers)
         if response.status_code == 200:
             earnings_data = response.json()
 
@@ -144,10 +280,37 @@ def get_earnings_calendar(date_from, date_to):
             print(f"Failed to fetch earnings data: {response.status_code}")
             return set()
 
+    except OfflineCacheMiss:
+        raise
     except Exception as e:
         print(f"Error fetching earnings data: {e}")
         return set()
 
+def parse_stock_data(data):
+    """
+    Convert the split adjusted prices response to OHLC and volume dataframes
+
+    Args:
+        data (list): Parsed json response of the technical endpoint
+
+    Returns:
+        tuple: (ohlc dataframe, volume dataframe) or (None, None) if there is no data
+    """
+    df = pd.DataFrame.from_dict(data)
+
+    if df.empty:
+        return None, None
+
+    df = df[["date", "open", "high", "low", "close", "volume"]]
+    df["date"] = pd.to_datetime(df["date"])
+    df.columns = ["timestamp", "open", "high", "low", "close", "volume"]
+
+    return (
+        df[["timestamp", "open", "high", "low", "close"]],
+        df[["timestamp", "volume"]],
+    )
+
+
 def get_stock_data(code, reporting_date_start, max_retries=5, retry_delay=5):
     global session
     if session is None:
@@ -160,27 +323,14 @@ def get_stock_data(code, reporting_date_start, max_retries=5, retry_delay=5):
 
     for attempt in range(max_retries):
         try:
-            r = session.get(url, params=params)
+            r = cached_get(session, url, "technical", params=params)
 
             if r.status_code == 404:
                 print(f"Ticker {code} not found, skipping")
                 return None, None
 
             if r.status_code == requests.codes.ok:
-                data = json.loads(r.text)
-                df = pd.DataFrame.from_dict(data)
-
-                if df.empty:
-                    return None, None
-
-                df = df[["date", "open", "high", "low", "close", "volume"]]
-                df["date"] = pd.to_datetime(df["date"])
-                df.columns = ["timestamp", "open", "high", "low", "close", "volume"]
-
-                return (
-                    df[["timestamp", "open", "high", "low", "close"]],
-                    df[["timestamp", "volume"]],
-                )
+                return parse_stock_data(json.loads(r.text))
             else:
                 print(f"Attempt {attempt + 1}: Status response is not Ok: {r.status_code}")
                 if attempt < max_retries - 1:
@@ -202,7 +352,29 @@ def get_stock_data(code, reporting_date_start, max_retries=5, retry_delay=5):
     return None, None
 
 def ohlc_daily_to_weekly(df):
-    df["start_of_week"] = df["timestamp"] - pd.to_timedelta(df["timestamp"].dt.dayofweek, unit='D')
+    # Monday of the week of each bar (day 0 of datetime64 is a Thursday)
+    timestamps = df["timestamp"].to_numpy()
+    days = timestamps.astype("datetime64[D]").astype(np.int64)
+    start_of_week = timestamps - ((days + 3) % 7).astype("timedelta64[D]")
+    df["start_of_week"] = start_of_week
+
+    # Bars sorted by date (as from the database or the panel) are aggregated with numpy,
+    # the groupby is several times slower per stock and only needed for unsorted bars or missing prices
+    prices = {column: df[column].to_numpy() for column in ["open", "high", "low", "close"]}
+    if len(df) and (start_of_week[1:] >= start_of_week[:-1]).all() and \
+            not any(np.isnan(values).any() for values in prices.values()):
+        starts = np.flatnonzero(np.append(True, start_of_week[1:] != start_of_week[:-1]))
+        ends = np.append(starts[1:], len(df))
+        return pd.DataFrame({
+            "year": pd.DatetimeIndex(timestamps[ends - 1]).year.to_numpy(),
+            "timestamp": start_of_week[starts],
+            "open": prices["open"][starts],
+            "high": np.maximum.reduceat(prices["high"], starts),
+            "low": np.minimum.reduceat(prices["low"], starts),
+            "close": prices["close"][ends - 1],
+            "start_of_week": start_of_week[starts],
+        })
+
     df_weekly = df.groupby(["start_of_week"]).agg(
         {"open": "first", "high": "max", "low": "min", "close": "last", "timestamp": "last"}
     )
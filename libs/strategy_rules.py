@@ -0,0 +1,494 @@
+import ast
+import operator
+
+import numpy as np
+
+from libs.exceptions_lib import StrategyRuleError
+from libs.read_settings import read_config
+from libs.techanalysis import MA_batch, RSI_batch, StochRSI_batch, lucid_sar_batch, td_direction_batch
+
+config = read_config()
+
+# Strategies are specified in the strategy_rules section of config.yaml as named expressions over the bars:
+#
+#   anx_bull:
+#     method: anx  # scanner method and direction screened by the strategy
+#     direction: bull
+#     indicators:  # named expressions used by the conditions (and by the later indicators)
+#       ema3: ema(close, 3)
+#     conditions:  # all of them have to be met
+#       trigger: ema3[-1] > ema12[-1] and ema3[-2] < ema12[-2]
+#
+# Expressions are python syntax compiled once into vectorised operations over the matrices of UniverseBars
+# (bars in rows, stocks in columns), nothing is evaluated as python code. Values are of three kinds:
+# - series: a value per bar and stock, e.g. close, weekly.close, ema(close, 3), close > open
+# - vectors: a value per stock, e.g. close[-1] (the latest close), bars, highest(high, 14)
+# - constants: numbers, strings, tuples and the config values, e.g. config.filters.range_percentage
+# Daily and weekly series cannot be combined, a condition on a series is its value on the latest bar.
+# Comparisons with NaN (e.g. a lookback before the first bar of a stock) are False.
+#
+# Names:
+#   open, high, low, close, volume, td_direction (1 green, -1 red, 0 none), bars (number of bars of the stock)
+#   weekly.open, weekly.high, weekly.low, weekly.close, weekly.td_direction, weekly.bars
+#   config.<section>.<key>: value of the config (resolved when compiling)
+# Operators: + - * / % **, comparisons (also chained), and, or, not, in / not in a constant tuple
+# Lookbacks: x[-1] latest value, x[-2] the one before, ...; shift(x, k) the series k bars back
+# Functions:
+#   sma(x, n), ema(x, n), rsi(x, n), stoch_rsi_k(x), stoch_rsi_d(x), sar_uptrend(high, low): indicator series
+#   any(x, n), all(x, n), sum(x, n), mean(x, n), highest(x, n), lowest(x, n): over the last n bars of each stock
+#   maximum(a, b), minimum(a, b), abs(x), isnan(x), float64(x): element-wise
+# Prices keep the dtype of the panel (float32 with the compact policy) as in the per-stock frames,
+# float64(x) gives the python float arithmetic of the per-stock checks where it matters.
+
+PRICE_FIELDS = ["open", "high", "low", "close"]
+DAILY_FIELDS = PRICE_FIELDS + ["volume", "td_direction"]
+WEEKLY_FIELDS = PRICE_FIELDS + ["td_direction"]
+
+BINARY_OPERATORS = {
+    ast.Add: ("+", operator.add),
+    ast.Sub: ("-", operator.sub),
+    ast.Mult: ("*", operator.mul),
+    ast.Div: ("/", operator.truediv),
+    ast.Mod: ("%", operator.mod),
+    ast.Pow: ("**", operator.pow),
+}
+
+COMPARISONS = {
+    ast.Lt: ("<", operator.lt),
+    ast.LtE: ("<=", operator.le),
+    ast.Gt: (">", operator.gt),
+    ast.GtE: (">=", operator.ge),
+    ast.Eq: ("==", operator.eq),
+    ast.NotEq: ("!=", operator.ne),
+}
+
+# name: (number of series arguments, number of integer parameters, function of the matrices and the parameters,
+# output of the function for the indicators with several outputs, which are calculated once for all of them)
+SERIES_FUNCTIONS = {
+    "sma": (1, 1, lambda values, length: MA_batch(values, length), None),
+    "ema": (1, 1, lambda values, length: MA_batch(values, length, ma_type="exponential"), None),
+    "rsi": (1, 1, RSI_batch, None),
+    "stoch_rsi_k": (1, 0, StochRSI_batch, 0),
+    "stoch_rsi_d": (1, 0, StochRSI_batch, 1),
+    "sar_uptrend": (2, 0, lucid_sar_batch, "uptrend"),
+    "shift": (1, 1, lambda values, periods: shift(values, periods), None),
+}
+
+ELEMENTWISE_FUNCTIONS = {
+    "maximum": (2, np.maximum),
+    "minimum": (2, np.minimum),
+    "abs": (1, np.abs),
+    "isnan": (1, np.isnan),
+    "float64": (1, lambda values: np.asarray(values, dtype=np.float64)),
+}
+
+
+def shift(values, periods):
+    shifted = np.full(values.shape, np.nan)
+    shifted[periods:] = values[:len(values) - periods]
+    return shifted
+
+
+def truth(values):
+    # Boolean values of a condition, numbers are true when not zero (and not NaN)
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return ~np.isnan(values) & (values != 0)
+    return values.astype(bool)
+
+
+def window(values, bars_count, length):
+    # The last length rows and whether each of them is a bar of the stock
+    rows = values[-length:]
+    positions = np.arange(len(values) - len(rows), len(values))[:, None]
+    return rows, positions >= len(values) - bars_count
+
+
+def window_any(rows, inside):
+    return (truth(rows) & inside).any(axis=0)
+
+
+def window_all(rows, inside):
+    return (truth(rows) | ~inside).all(axis=0)
+
+
+def window_sum(rows, inside):
+    return np.where(inside, rows, 0).sum(axis=0)
+
+
+def window_mean(rows, inside):
+    return window_sum(rows, inside) / inside.sum(axis=0)
+
+
+def window_highest(rows, inside):
+    return np.fmax.reduce(np.where(inside, rows, np.nan), axis=0)
+
+
+def window_lowest(rows, inside):
+    return np.fmin.reduce(np.where(inside, rows, np.nan), axis=0)
+
+
+WINDOW_FUNCTIONS = {
+    "any": window_any,
+    "all": window_all,
+    "sum": window_sum,
+    "mean": window_mean,
+    "highest": window_highest,
+    "lowest": window_lowest,
+}
+
+
+class Node:
+    """
+    Compiled expression: a constant (value), a series of a timeframe or a vector (compute(bars, cache)).
+    key is the canonical text of the expression, the values are cached by it, so an indicator used
+    by several conditions or strategies is calculated once.
+    """
+
+    def __init__(self, kind, key, compute=None, timeframe=None, value=None):
+        self.kind = kind
+        self.key = key
+        self.compute = compute
+        self.timeframe = timeframe
+        self.value = value
+
+    def evaluate(self, bars, cache):
+        if self.kind == "constant":
+            return self.value
+        if self.key not in cache:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cache[self.key] = self.compute(bars, cache)
+        return cache[self.key]
+
+
+def constant(value):
+    # Numpy scalars are turned to python ones, so that they keep the dtype of the prices in the operations
+    if isinstance(value, np.generic):
+        value = value.item()
+    return Node("constant", repr(value), value=value)
+
+
+def result_kind(arguments):
+    # Kind and timeframe of an element-wise operation of the arguments
+    timeframes = {argument.timeframe for argument in arguments if argument.kind == "series"}
+    if len(timeframes) > 1:
+        raise StrategyRuleError("daily and weekly series cannot be combined")
+    if timeframes:
+        return "series", timeframes.pop()
+    if any(argument.kind == "vector" for argument in arguments):
+        return "vector", None
+    return "constant", None
+
+
+def elementwise(function, arguments, key):
+    kind, timeframe = result_kind(arguments)
+    if kind == "constant":
+        try:
+            return constant(function(*(argument.value for argument in arguments)))
+        except (ArithmeticError, TypeError) as error:
+            raise StrategyRuleError(f"{key}: {error}")
+
+    def compute(bars, cache):
+        return function(*(argument.evaluate(bars, cache) for argument in arguments))
+
+    return Node(kind, key, compute, timeframe)
+
+
+def logical(function, arguments):
+    # and / or: constants are resolved when compiling, e.g. the parts of a condition disabled by the config
+    absorbing = function is np.logical_or
+    variables = []
+    for argument in arguments:
+        if argument.kind != "constant":
+            variables.append(argument)
+        elif bool(argument.value) == absorbing:
+            return constant(absorbing)
+    if not variables:
+        return constant(not absorbing)
+    if len(variables) == 1:
+        return variables[0]
+    kind, timeframe = result_kind(variables)
+    key = "(" + f" {'or' if absorbing else 'and'} ".join(variable.key for variable in variables) + ")"
+
+    def compute(bars, cache):
+        return function.reduce([truth(argument.evaluate(bars, cache)) for argument in variables])
+
+    return Node(kind, key, compute, timeframe)
+
+
+def field(name, timeframe):
+    key = name if timeframe == "daily" else f"weekly.{name}"
+    if name == "bars":
+        return Node("vector", key, lambda bars, cache: getattr(bars, f"{timeframe}_bars"))
+    if name == "td_direction":
+        return Node("series", key, lambda bars, cache: td_direction_batch(
+            *(getattr(bars, timeframe)[price] for price in PRICE_FIELDS)
+        ), timeframe)
+    return Node("series", key, lambda bars, cache: getattr(bars, timeframe)[name], timeframe)
+
+
+def integer_parameter(argument, function_name):
+    if argument.kind != "constant" or isinstance(argument.value, bool) or not isinstance(argument.value, int) \
+            or argument.value < 0:
+        raise StrategyRuleError(f"{function_name} needs a non-negative integer as the number of bars")
+    return argument.value
+
+
+class ExpressionCompiler:
+    """
+    Compiles the expressions of a strategy, see the description of the syntax at the top of the module
+    """
+
+    def __init__(self, settings, names):
+        """
+        :param settings: config dictionary for the config.<section>.<key> values
+        :param names: dictionary of the compiled indicators (and conditions) available to the expressions
+        """
+        self.settings = settings
+        self.names = names
+
+    def compile(self, text):
+        try:
+            tree = ast.parse(str(text).strip(), mode="eval")
+        except SyntaxError as error:
+            raise StrategyRuleError(f"invalid expression {text}: {error.msg}")
+        return self.build(tree.body)
+
+    def build(self, node):
+        builder = getattr(self, f"build_{type(node).__name__.lower()}", None)
+        if builder is None:
+            raise StrategyRuleError(f"unsupported syntax: {ast.unparse(node)}")
+        return builder(node)
+
+    def build_constant(self, node):
+        return constant(node.value)
+
+    def build_tuple(self, node):
+        items = [self.build(item) for item in node.elts]
+        if any(item.kind != "constant" for item in items):
+            raise StrategyRuleError(f"only constants can be listed: {ast.unparse(node)}")
+        return constant(tuple(item.value for item in items))
+
+    build_list = build_tuple
+
+    def build_name(self, node):
+        if node.id in self.names:
+            return self.names[node.id]
+        if node.id in DAILY_FIELDS or node.id == "bars":
+            return field(node.id, "daily")
+        raise StrategyRuleError(f"unknown name {node.id}")
+
+    def build_attribute(self, node):
+        path = []
+        while isinstance(node, ast.Attribute):
+            path.insert(0, node.attr)
+            node = node.value
+        root = node.id if isinstance(node, ast.Name) else None
+
+        if root == "weekly" and len(path) == 1 and (path[0] in WEEKLY_FIELDS or path[0] == "bars"):
+            return field(path[0], "weekly")
+        if root == "config":
+            value = self.settings
+            for key in path:
+                if not isinstance(value, dict) or key not in value:
+                    raise StrategyRuleError(f"config value {'.'.join(['config'] + path)} is not set")
+                value = value[key]
+            return constant(tuple(value) if isinstance(value, list) else value)
+        raise StrategyRuleError(f"unknown name {'.'.join([str(root)] + path)}")
+
+    def build_subscript(self, node):
+        # x[-k]: the value k - 1 bars before the latest one
+        series = self.build(node.value)
+        lookback = self.build(node.slice)
+        if series.kind != "series":
+            raise StrategyRuleError(f"only series can be indexed: {ast.unparse(node)}")
+        if lookback.kind != "constant" or not isinstance(lookback.value, int) or lookback.value >= 0:
+            raise StrategyRuleError(f"series are indexed from the latest bar with -1, -2, ...: {ast.unparse(node)}")
+        index = lookback.value
+
+        def compute(bars, cache):
+            values = series.evaluate(bars, cache)
+            return values[index] if -index <= len(values) else np.full(values.shape[1:], np.nan)
+
+        return Node("vector", f"{series.key}[{index}]", compute)
+
+    def build_binop(self, node):
+        if type(node.op) not in BINARY_OPERATORS:
+            raise StrategyRuleError(f"unsupported operator in {ast.unparse(node)}")
+        symbol, function = BINARY_OPERATORS[type(node.op)]
+        left, right = self.build(node.left), self.build(node.right)
+        return elementwise(function, [left, right], f"({left.key} {symbol} {right.key})")
+
+    def build_unaryop(self, node):
+        operand = self.build(node.operand)
+        if isinstance(node.op, ast.Not):
+            if operand.kind == "constant":
+                return constant(not operand.value)
+            return elementwise(lambda values: ~truth(values), [operand], f"(not {operand.key})")
+        if isinstance(node.op, ast.USub):
+            return elementwise(operator.neg, [operand], f"(-{operand.key})")
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        raise StrategyRuleError(f"unsupported operator in {ast.unparse(node)}")
+
+    def build_boolop(self, node):
+        values = [self.build(value) for value in node.values]
+        return logical(np.logical_and if isinstance(node.op, ast.And) else np.logical_or, values)
+
+    def build_compare(self, node):
+        # Chained comparisons are the conjunction of the pairs, as in python
+        operands = [self.build(operand) for operand in [node.left] + node.comparators]
+        pairs = []
+        for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                pairs.append(self.membership(left, right, isinstance(op, ast.NotIn)))
+            elif type(op) in COMPARISONS:
+                symbol, function = COMPARISONS[type(op)]
+                pairs.append(elementwise(function, [left, right], f"({left.key} {symbol} {right.key})"))
+            else:
+                raise StrategyRuleError(f"unsupported comparison in {ast.unparse(node)}")
+        return logical(np.logical_and, pairs)
+
+    @staticmethod
+    def membership(left, right, negated):
+        if right.kind != "constant" or not isinstance(right.value, tuple):
+            raise StrategyRuleError("in needs a constant tuple, e.g. x in (1, 2)")
+        key = f"({left.key} {'not in' if negated else 'in'} {right.key})"
+        if left.kind == "constant":
+            return constant((left.value in right.value) != negated)
+        return elementwise(lambda values: np.isin(values, right.value) != negated, [left], key)
+
+    def build_call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if node.keywords:
+            raise StrategyRuleError(f"function arguments are positional: {ast.unparse(node)}")
+        arguments = [self.build(argument) for argument in node.args]
+        key = f"{name}({', '.join(argument.key for argument in arguments)})"
+
+        if name in ELEMENTWISE_FUNCTIONS:
+            count, function = ELEMENTWISE_FUNCTIONS[name]
+            self.check_count(name, arguments, count)
+            return elementwise(function, arguments, key)
+
+        if name in WINDOW_FUNCTIONS:
+            self.check_count(name, arguments, 2)
+            series, length = arguments[0], integer_parameter(arguments[1], name)
+            if series.kind != "series" or length == 0:
+                raise StrategyRuleError(f"{name} needs a series and a number of bars: {ast.unparse(node)}")
+            function = WINDOW_FUNCTIONS[name]
+
+            def compute_window(bars, cache):
+                bars_count = getattr(bars, f"{series.timeframe}_bars")
+                return function(*window(series.evaluate(bars, cache), bars_count, length))
+
+            return Node("vector", key, compute_window)
+
+        if name in SERIES_FUNCTIONS:
+            series_count, parameters_count, function, output = SERIES_FUNCTIONS[name]
+            self.check_count(name, arguments, series_count + parameters_count)
+            series, parameters = arguments[:series_count], arguments[series_count:]
+            if any(argument.kind != "series" for argument in series):
+                raise StrategyRuleError(f"{name} needs series as the first arguments: {ast.unparse(node)}")
+            kind, timeframe = result_kind(series)
+            parameters = [integer_parameter(parameter, name) for parameter in parameters]
+
+            def compute_series(bars, cache):
+                return function(*(argument.evaluate(bars, cache) for argument in series), *parameters)
+
+            if output is None:
+                return Node("series", key, compute_series, timeframe)
+            outputs = Node("outputs", f"{function.__name__}{key[len(name):]}", compute_series, timeframe)
+            return Node("series", key, lambda bars, cache: outputs.evaluate(bars, cache)[output], timeframe)
+
+        raise StrategyRuleError(f"unknown function {ast.unparse(node.func)}")
+
+    @staticmethod
+    def check_count(name, arguments, count):
+        if len(arguments) != count:
+            raise StrategyRuleError(f"{name} takes {count} arguments, {len(arguments)} given")
+
+
+class Strategy:
+    """
+    Strategy compiled from its spec: the conditions are evaluated for the whole universe at once.
+
+    Usage:
+        strategy = compile_strategy("anx_bull")
+        masks = strategy.evaluate(UniverseBars(panel))
+        shortlist = masks["signal"][masks["signal"]].index
+    """
+
+    def __init__(self, name, method, direction, conditions):
+        """
+        :param name: name of the strategy in the config
+        :param method: scanner method (anx, earnings, mri)
+        :param direction: bull or bear
+        :param conditions: dictionary of the compiled conditions (Node)
+        """
+        self.name = name
+        self.method = method
+        self.direction = direction
+        self.conditions = conditions
+
+    def evaluate(self, bars, cache=None):
+        """
+        :param bars: UniverseBars of the screened stocks
+        :param cache: dictionary of the values calculated for the same bars, shared between the evaluations
+        (e.g. of several strategies) so that each indicator is calculated once
+        :return: dictionary of boolean series indexed by stock code: the conditions and "signal" (all of them)
+        """
+        cache = {} if cache is None else cache
+        masks = {}
+        for name, condition in self.conditions.items():
+            values = condition.evaluate(bars, cache)
+            if condition.kind == "series":
+                values = values[-1]
+            masks[name] = np.broadcast_to(truth(values), (len(bars),))
+        masks["signal"] = np.logical_and.reduce([np.ones(len(bars), dtype=bool)] + list(masks.values()))
+        return {name: bars.series(mask) for name, mask in masks.items()}
+
+
+def compile_strategy(name, spec=None, settings=None):
+    """
+    :param name: name of the strategy in the strategy_rules section of the config
+    :param spec: dictionary of the strategy (method, direction, indicators, conditions), the configured one by default
+    :param settings: config dictionary for the config values used by the expressions, the config by default
+    :return: Strategy
+    """
+    settings = config if settings is None else settings
+    if spec is None:
+        spec = settings.get("strategy_rules", {}).get(name)
+        if spec is None:
+            raise StrategyRuleError(f"strategy {name} is not specified in the strategy_rules config section")
+    if not spec.get("conditions"):
+        raise StrategyRuleError(f"strategy {name} has no conditions")
+
+    names = {}
+    conditions = {}
+    compiler = ExpressionCompiler(settings, names)
+    for section in ["indicators", "conditions"]:
+        for expression_name, text in (spec.get(section) or {}).items():
+            if expression_name in names or expression_name in DAILY_FIELDS + ["bars", "weekly", "config"]:
+                raise StrategyRuleError(f"strategy {name}: {expression_name} is already defined")
+            try:
+                names[expression_name] = compiler.compile(text)
+            except StrategyRuleError as error:
+                raise StrategyRuleError(f"strategy {name}, {expression_name}: {error}")
+            if section == "conditions":
+                conditions[expression_name] = names[expression_name]
+
+    return Strategy(name, spec.get("method"), spec.get("direction"), conditions)
+
+
+def method_strategies(method, settings=None):
+    """
+    :param method: scanner method
+    :param settings: config dictionary, the config by default
+    :return: compiled strategies of the method in the strategy_rules section of the config
+    """
+    settings = config if settings is None else settings
+    return [
+        compile_strategy(name, spec, settings)
+        for name, spec in (settings.get("strategy_rules") or {}).items()
+        if spec.get("method") == method
+    ]
@@ -0,0 +1,86 @@
+import itertools
+from copy import deepcopy
+
+from libs.exceptions_lib import StrategyRuleError
+from libs.read_settings import read_config
+from libs.strategy_rules import compile_strategy, method_strategies
+
+config = read_config()
+
+# Volume requirement of the scanner shortlists (scanner.last_volume_5D_MA above the minimum level)
+SHORTLIST_VOLUME = "sma(volume, 20)[-1] > config.filters.minimum_volume_level"
+
+
+def sweep_combinations(grid):
+    """
+    :param grid: dictionary of config paths (section.key) to the lists of values to try
+    :return: list of dictionaries {path: value} with all the combinations of the values
+    """
+    paths = list(grid)
+    return [dict(zip(paths, values)) for values in itertools.product(*(grid[path] for path in paths))]
+
+
+def with_values(settings, combination):
+    """
+    :param settings: config dictionary
+    :param combination: dictionary {path: value} of the config values to set
+    :return: copy of the config with the values
+    """
+    settings = deepcopy(settings)
+    for path, value in combination.items():
+        *sections, key = path.split(".")
+        target = settings
+        for section in sections:
+            target = target.get(section) if isinstance(target, dict) else None
+        if not isinstance(target, dict) or key not in target:
+            raise StrategyRuleError(f"config value {path} of the sweep is not set")
+        target[key] = value
+    return settings
+
+
+def threshold_sweep(bars, method, grid, settings=None):
+    """
+    Shortlists of the strategy rules of a method (see libs.strategy_rules) for every combination of the config values
+    in the grid. The strategies are compiled with the values of each combination and evaluated with a cache
+    shared by all the combinations, so the values which do not depend on the swept thresholds (indicators,
+    close ratios, body-high comparisons, ...) are calculated once and each combination only redoes its comparisons.
+    :param bars: UniverseBars of the stocks
+    :param method: scanner method of the strategies
+    :param grid: dictionary of config paths (section.key) to the lists of values to try
+    :param settings: config dictionary, the config by default
+    :return: list of (combination, {direction: shortlisted stock codes}), shortlists include the volume requirement
+    """
+    settings = config if settings is None else settings
+    cache = {}
+    results = []
+    for combination in sweep_combinations(grid):
+        combination_settings = with_values(settings, combination)
+        strategies = method_strategies(method, combination_settings)
+        if not strategies:
+            raise StrategyRuleError(f"no strategy of the {method} method in the strategy_rules config section")
+
+        volume = compile_strategy("shortlist volume", {"conditions": {"minimum_volume": SHORTLIST_VOLUME}}, combination_settings)
+        shortlists = {}
+        for strategy in strategies:
+            signal = strategy.evaluate(bars, cache)["signal"]
+            shortlists[strategy.direction] = signal & shortlists.get(strategy.direction, True)
+        volume_mask = volume.evaluate(bars, cache)["signal"]
+        results.append((combination, {
+            direction: list(shortlist.index[shortlist & volume_mask]) for direction, shortlist in shortlists.items()
+        }))
+    return results
+
+
+def sweep_report(results):
+    """
+    :return: printable shortlist sizes and members of each combination
+    """
+    lines = []
+    for combination, shortlists in results:
+        values = ", ".join(f"{path} {value}" for path, value in combination.items())
+        counts = " | ".join(f"{direction.upper()} {len(codes)}" for direction, codes in shortlists.items())
+        lines.append(f"{values}: {counts}")
+        for direction, codes in shortlists.items():
+            if codes:
+                lines.append(f"  {direction.upper()}: {', '.join(codes)}")
+    return "\n".join(lines)
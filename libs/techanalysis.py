@@ -1,5 +1,25 @@
 import pandas as pd
 import numpy as np
+from pandas.api.indexers import BaseIndexer
+
+from libs.kernels import (
+    NUMBA_AVAILABLE,
+    kernel_input,
+    kernel_output,
+    td_sequential_kernel,
+    td_direction_rows_kernel,
+    td_initial_state,
+    TD_DIRECTION_UP,
+    TD_DIRECTION_DOWN,
+    TD_UP_COUNT,
+    TD_DOWN_COUNT,
+    ema_kernel,
+    ema_rows_kernel,
+    fisher_distance_kernel,
+    lucid_sar_kernel,
+    lucid_sar_steps,
+    psar_kernel,
+)
 
 
 def combined_indicators(df):
@@ -13,13 +33,14 @@ def combined_indicators(df):
     td_val = td_indicators(df)
     atr_val = ATR(df).drop("timestamp", axis=1)
     crsi_val = CRSI(df).drop("timestamp", axis=1)
-    ma10_val = MA(df, 10).drop("timestamp", axis=1)
-    ma100 = MA(df, 100).drop("timestamp", axis=1)
-    ma20 = MA(df, 20).drop("timestamp", axis=1)
-    ma30 = MA(df, 30).drop("timestamp", axis=1)
-    rsi14 = RSI(df, 14).drop("timestamp", axis=1)
-    rsi2 = RSI(df, 2).drop("timestamp", axis=1)
-    rsi3 = RSI(df, 3).drop("timestamp", axis=1)
+    # MA and RSI frames only have the value column
+    ma10_val = MA(df, 10)
+    ma100 = MA(df, 100)
+    ma20 = MA(df, 20)
+    ma30 = MA(df, 30)
+    rsi14 = RSI(df, 14)
+    rsi2 = RSI(df, 2)
+    rsi3 = RSI(df, 3)
 
     resulting_df = pd.concat(
         [td_val, atr_val, crsi_val, ma10_val, ma100, ma20, ma30, rsi14, rsi2, rsi3],
@@ -29,11 +50,11 @@ def combined_indicators(df):
     return resulting_df
 
 
-def df_from_series(data_series, timestamp_series, columns):
+def df_from_series(data_series, timestamp_series=None, columns=None):
     """
     Function to generate a pandas dataframe from pandas series
     :param data_series: pandas series with the data
-    :param timestamp_series: pandas series with the timestamp
+    :param timestamp_series: pandas series with the timestamp (not added to the dataframe)
     :param columns: list of columns (e.g. ['rsi'])
     :return: pandas dataframe
     """
@@ -62,13 +83,37 @@ def RSI(df, length=14, colname="close"):
 
     rsi_df = df_from_series(
         data_series=rsi,
-        timestamp_series=df.tail(len(rsi))["timestamp"],
         columns=[f"rsi{length}"],
     )
 
     return rsi_df
 
 
+def RSI_batch(closes, length=14):
+    """
+    Function to calculate RSI for many stocks at once, column by column in one vectorised call.
+    Each column has the same values as RSI on the closes of the stock from its first available close,
+    bars before it are NaN.
+    :param closes: close prices matrix (dates in rows, stocks in columns) as DataFrame or numpy array
+    :param length: rsi length (14 is the standard)
+    :return: rsi values of the same shape (and labels) as closes
+    """
+    values = np.asarray(closes, dtype=float)
+    delta = np.full(values.shape, np.nan)
+    delta[1:] = values[1:] - values[:-1]
+
+    # Only the averages go through pandas, the element-wise steps are cheaper on the arrays
+    up, down = np.where(delta < 0, 0.0, delta), np.where(delta > 0, 0.0, delta)
+    rUp = ewm_batch(up, length - 1)
+    rDown = np.abs(ewm_batch(down, length - 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + rUp / rDown)
+
+    if isinstance(closes, pd.DataFrame):
+        return pd.DataFrame(rsi, index=closes.index, columns=closes.columns)
+    return rsi
+
+
 def ADX(df, length=14):
     """
     Function to calculate ADX
@@ -80,7 +125,7 @@ def ADX(df, length=14):
     adx_val = adxind.adx()
 
     adx_df = df_from_series(
-        data_series=adx_val, timestamp_series=df["timestamp"], columns=["adx"]
+        data_series=adx_val, columns=["adx"]
     )
 
     return adx_df
@@ -98,36 +143,51 @@ def fisher_distance(df: pd.DataFrame, fisher_length: int = 9, ema_length: int =
     Returns:
     pd.DataFrame: A DataFrame containing the calculated Fisher values.
     """
-    df = df.copy()
-    df['ema'] = df['close'].ewm(span=ema_length, adjust=False).mean()
-    df['distFromEMA'] = df['close'] - df['ema']
+    distance = fisher_distance_values(df[['close']], fisher_length, ema_length, from_first_close=False)
+    return pd.DataFrame({'distance': distance[:, 0]}, index=df.index)
 
-    high = df['distFromEMA'].rolling(window=fisher_length).max()
-    low = df['distFromEMA'].rolling(window=fisher_length).min()
 
-    def round_(val):
-        if val > 0.99:
-            return 0.999
-        elif val < -0.99:
-            return -0.999
-        else:
-            return val
-
-    value = np.zeros(len(df))
-    for i in range(1, len(df)):
-        if pd.notna(high[i]) and pd.notna(low[i]):
-            max_diff = max(high[i] - low[i], 0.001)
-            norm_value = 0.66 * ((df['distFromEMA'][i] - low[i]) / max_diff - 0.5) + 0.67 * value[i-1]
-            value[i] = round_(norm_value)
+def fisher_distance_batch(closes, fisher_length: int = 9, ema_length: int = 50):
+    """
+    Calculate the Fisher distance for many stocks at once.
+    Each column gives the same values as fisher_distance on the closes of the stock from its first available close,
+    bars before it are NaN (e.g. for stocks listed later than the others in the matrix).
 
-    fisher_dist = np.zeros(len(df))
-    for i in range(1, len(df)):
-        fisher_dist[i] = 0.5 * np.log((1 + value[i]) / max(1 - value[i], 0.001)) + 0.5 * fisher_dist[i-1]
+    Parameters:
+    closes (pd.DataFrame or np.ndarray): Close prices matrix, dates in rows and stocks in columns.
+    fisher_length (int, optional): The lookback period for the Fisher Transform. Defaults to 9.
+    ema_length (int, optional): The period for the EMA calculation. Defaults to 50.
 
-    df['distance'] = fisher_dist
-    #df['trigger'] = df['distance'].shift(1)  # this is unnecessary
+    Returns:
+    pd.DataFrame or np.ndarray: Fisher distance values of the same shape (and labels) as closes.
+    """
+    distance = fisher_distance_values(pd.DataFrame(closes), fisher_length, ema_length, from_first_close=True)
+    if isinstance(closes, pd.DataFrame):
+        return pd.DataFrame(distance, index=closes.index, columns=closes.columns)
+    return distance
+
+
+def fisher_distance_values(closes, fisher_length, ema_length, from_first_close):
+    # EMA and the rolling extremes are vectorised over all the columns, the recurrences run in the kernel
+    dist_from_ema = closes - closes.ewm(span=ema_length, adjust=False).mean()
+    high = dist_from_ema.rolling(window=fisher_length).max()
+    low = dist_from_ema.rolling(window=fisher_length).min()
+
+    rows, columns = closes.shape
+    if from_first_close:
+        valid = closes.notna().to_numpy()
+        starts = np.where(valid.any(axis=0), valid.argmax(axis=0), rows)
+        distance = kernel_output((columns, rows), np.float64, np.nan)
+    else:
+        starts = np.zeros(columns, dtype=np.int64)
+        distance = kernel_output((columns, rows), np.float64, 0.0)
 
-    return df[['distance']]
+    # Kernel rows are the series, so each one is contiguous
+    fisher_distance_kernel(
+        kernel_input(dist_from_ema.to_numpy().T), kernel_input(high.to_numpy().T), kernel_input(low.to_numpy().T),
+        kernel_input(starts, np.int64), kernel_input(starts, np.int64), kernel_output((columns, 2)), distance
+    )
+    return np.asarray(distance, dtype=float).T
 
 
 def coppock_curve(df: pd.DataFrame, wma_length: int = 10, long_roc_length: int = 14, short_roc_length: int = 11) -> pd.DataFrame:
@@ -143,23 +203,63 @@ def coppock_curve(df: pd.DataFrame, wma_length: int = 10, long_roc_length: int =
     Returns:
     pd.DataFrame: A DataFrame containing the calculated Coppock Curve values.
     """
-    df = df.copy()
+    coppock = coppock_values(df[['close']], wma_length, long_roc_length, short_roc_length, from_first_close=False)
+    return pd.DataFrame({'Coppock_WMA': coppock[:, 0]}, index=df.index)
+
+
+def coppock_curve_batch(closes, wma_length: int = 10, long_roc_length: int = 14, short_roc_length: int = 11):
+    """
+    Calculate the Coppock Curve for many stocks at once.
+    Each column gives the same values as coppock_curve on the closes of the stock from its first available close,
+    bars before it are NaN.
+
+    Parameters:
+    closes (pd.DataFrame or np.ndarray): Close prices matrix, dates in rows and stocks in columns.
+    wma_length (int, optional): The smoothing length for the WMA. Defaults to 10.
+    long_roc_length (int, optional): The lookback period for the long ROC. Defaults to 14.
+    short_roc_length (int, optional): The lookback period for the short ROC. Defaults to 11.
+
+    Returns:
+    pd.DataFrame or np.ndarray: Coppock Curve values of the same shape (and labels) as closes.
+    """
+    coppock = coppock_values(pd.DataFrame(closes), wma_length, long_roc_length, short_roc_length, from_first_close=True)
+    if isinstance(closes, pd.DataFrame):
+        return pd.DataFrame(coppock, index=closes.index, columns=closes.columns)
+    return coppock
+
+
+def coppock_values(closes, wma_length, long_roc_length, short_roc_length, from_first_close):
+    closes = closes.astype(float)  # float64 also from the compact (float32) prices
 
     # Calculate the Rate of Change (ROC) and handle potential anomalies
-    df['ROC_long'] = df['close'].pct_change(periods=long_roc_length).replace([np.inf, -np.inf], np.nan).fillna(0) * 100
-    df['ROC_short'] = df['close'].pct_change(periods=short_roc_length).replace([np.inf, -np.inf], np.nan).fillna(0) * 100
+    roc_long = closes.pct_change(periods=long_roc_length).replace([np.inf, -np.inf], np.nan).fillna(0) * 100
+    roc_short = closes.pct_change(periods=short_roc_length).replace([np.inf, -np.inf], np.nan).fillna(0) * 100
 
     # Calculate the Coppock Curve (sum of the two ROCs)
-    df['Coppock'] = df['ROC_long'] + df['ROC_short']
+    coppock = (roc_long + roc_short).to_numpy(dtype=float, copy=True)
+    if from_first_close:
+        coppock[closes.ffill().isna().to_numpy()] = np.nan  # bars before the first close of a stock
+
+    return WMA(coppock, wma_length)
 
-    # Calculate the Weighted Moving Average (WMA)
-    def weighted_moving_average(series, window):
-        weights = np.arange(1, window + 1)
-        return series.rolling(window).apply(lambda prices: np.dot(prices, weights) / weights.sum(), raw=True)
 
-    df['Coppock_WMA'] = weighted_moving_average(df['Coppock'], wma_length)
+def WMA(values, length):
+    """
+    Linearly weighted moving average over the rows, as a dot product of every window with the weights.
+    Values are NaN until the window is full or when the window has a NaN.
+    :param values: 1D series or 2D (dates, stocks) matrix as numpy array, Series or DataFrame
+    :param length: window length
+    :return: numpy array of the same shape
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.arange(1, length + 1, dtype=float)
 
-    return df[['Coppock_WMA']]  # df[['Close', 'ROC_long', 'ROC_short', 'Coppock', 'Coppock_WMA']]
+    result = np.full(values.shape, np.nan)
+    if len(values) >= length:
+        # (windows, [stocks,] length) view of the values, no copies are made
+        windows = np.lib.stride_tricks.sliding_window_view(values, length, axis=0)
+        result[length - 1:] = windows @ weights / weights.sum()
+    return result
 
 
 def lucid_sar(df: pd.DataFrame,
@@ -187,61 +287,74 @@ def lucid_sar(df: pd.DataFrame,
 
     Note: Be cautious of stock splits as they can affect calculations.
     """
-    high, low = df['high'].values, df['low'].values
-    size = len(high)
-
-    # Initialize arrays
-    sar = np.zeros(size)
-    uptrend = np.zeros(size, dtype=bool)
-    ep = np.zeros(size)
-    new_trend = np.zeros(size, dtype=bool)
-    af = np.zeros(size)
-
-    # Set initial values
-    sar[0] = low[0]
-    ep[0] = high[0]
-    uptrend[0] = True
-    af[0] = af_initial
-
-    for i in range(1, size):
-        # Update extreme point and acceleration factor
-        ep[i] = max(high[i], ep[i - 1]) if uptrend[i - 1] else min(low[i], ep[i - 1])
-        af[i] = (af_initial if new_trend[i - 1] else
-                 min(af_maximum, af[i - 1] + af_increment) if ep[i] != ep[i - 1] else af[i - 1])
-
-        # Calculate base SAR
-        sar[i] = sar[i - 1] + af[i] * (ep[i] - sar[i - 1])
-
-        # Handle uptrend
-        if uptrend[i - 1]:
-            sar[i] = min(sar[i], low[i - 1], low[i - 2] if i >= 2 else low[i - 1])
-            if sar[i] > low[i]:
-                uptrend[i] = False
-                new_trend[i] = True
-                sar[i] = max(high[i], ep[i - 1])
-                ep[i] = min(low[i], low[i - 1])
-            else:
-                uptrend[i] = True
-
-        # Handle downtrend
-        else:
-            sar[i] = max(sar[i], high[i - 1], high[i - 2] if i >= 2 else high[i - 1])
-            if sar[i] < high[i]:
-                uptrend[i] = True
-                new_trend[i] = True
-                sar[i] = min(low[i], ep[i - 1])
-                ep[i] = max(high[i], high[i - 1])
-            else:
-                uptrend[i] = False
-
+    sar, uptrend, ep, new_trend = lucid_sar_values(
+        df[['high']].to_numpy(dtype=float), df[['low']].to_numpy(dtype=float), np.zeros(1, dtype=np.int64),
+        af_initial, af_increment, af_maximum
+    )
     return pd.DataFrame({
-        'sar': sar,
-        'uptrend': uptrend,
-        'ep': ep,
-        'new_trend': new_trend
+        'sar': sar[:, 0],
+        'uptrend': uptrend[:, 0],
+        'ep': ep[:, 0],
+        'new_trend': new_trend[:, 0]
     }, index=df.index)
 
 
+def lucid_sar_batch(highs, lows,
+                    af_initial: float = 0.02,
+                    af_increment: float = 0.02,
+                    af_maximum: float = 0.2) -> dict:
+    """
+    Calculate the Lucid SAR for many stocks at once, e.g. on the weekly bars of the whole universe.
+    Each column gives the same values as lucid_sar on the bars of the stock from its first available bar,
+    bars before it have NaN sar and ep and False trend flags.
+
+    Parameters
+    ----------
+    highs, lows : pd.DataFrame or np.ndarray
+        High and low prices matrices, dates in rows and stocks in columns
+    af_initial, af_increment, af_maximum : float
+        Acceleration factor settings, as in lucid_sar
+
+    Returns
+    -------
+    dict
+        sar, uptrend, ep and new_trend matrices of the same shape (and labels) as highs
+    """
+    high, low = np.asarray(highs, dtype=float), np.asarray(lows, dtype=float)
+    valid = ~np.isnan(high) & ~np.isnan(low)
+    starts = np.where(valid.any(axis=0), valid.argmax(axis=0), len(high))
+
+    values = lucid_sar_values(high, low, starts, af_initial, af_increment, af_maximum)
+    results = dict(zip(['sar', 'uptrend', 'ep', 'new_trend'], values))
+    if isinstance(highs, pd.DataFrame):
+        results = {name: pd.DataFrame(matrix, index=highs.index, columns=highs.columns)
+                   for name, matrix in results.items()}
+    return results
+
+
+def lucid_sar_values(high, low, starts, af_initial, af_increment, af_maximum):
+    # Compiled kernel if available, otherwise a python loop for a single series and numpy steps for a batch
+    size, columns = high.shape
+    if not NUMBA_AVAILABLE and columns > 1:
+        return lucid_sar_steps(high, low, starts, af_initial, af_increment, af_maximum)
+
+    sar = kernel_output((columns, size), np.float64, np.nan)
+    ep = kernel_output((columns, size), np.float64, np.nan)
+    uptrend = kernel_output((columns, size), np.bool_, False)
+    new_trend = kernel_output((columns, size), np.bool_, False)
+    # Kernel rows are the series, so each one is contiguous
+    lucid_sar_kernel(
+        kernel_input(high.T), kernel_input(low.T), kernel_input(starts, np.int64), kernel_input(starts, np.int64),
+        kernel_output(columns, np.float64, af_initial), af_initial, af_increment, af_maximum, sar, uptrend, ep, new_trend
+    )
+    return (
+        np.asarray(sar, dtype=float).T,
+        np.asarray(uptrend, dtype=bool).T,
+        np.asarray(ep, dtype=float).T,
+        np.asarray(new_trend, dtype=bool).T,
+    )
+
+
 def MA(df, length, colname="close", ma_type="simple"):
     """
     Function to calculate MA (Moving Average)
@@ -263,13 +376,79 @@ def MA(df, length, colname="close", ma_type="simple"):
 
     ma_df = df_from_series(
         data_series=ma_rolling,
-        timestamp_series=df.tail(len(ma_rolling))["timestamp"],
         columns=[f"ma{length}"],
     )
 
     return ma_df
 
 
+def ewm_batch(values, com):
+    """
+    Exponential weighted mean of each column, with the values of pandas ewm(com=com, adjust=False).mean()
+    on the column.
+    :param values: values matrix (dates in rows, stocks in columns) as numpy array
+    :param com: center of mass ((span - 1) / 2 for a span), pandas smooths with alpha = 1 / (1 + com)
+    :return: numpy array of the same shape
+    """
+    valid = ~np.isnan(values)
+    # ema_kernel follows ewm on the series without gaps (NaN after the first value)
+    if NUMBA_AVAILABLE and (np.maximum.accumulate(valid, axis=0) == valid).all():
+        # All the columns in one compiled call, pandas runs a loop per column
+        output = np.full(values.shape[::-1], np.nan)
+        ema_rows_kernel(np.ascontiguousarray(values.T, dtype=float), 1 / (1 + com), output)
+        return output.T
+    return pd.DataFrame(values).ewm(com=com, adjust=False).mean().to_numpy()
+
+
+class ColumnWindows(BaseIndexer):
+    # Rolling windows over the columns of a matrix stacked into one series: the windows do not span two columns,
+    # and as a window starts after the end of the previous one, pandas starts the sums over at each column
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        positions = np.arange(num_values, dtype=np.int64)
+        column_starts = np.repeat(np.arange(0, num_values, self.rows, dtype=np.int64), self.rows)[:num_values]
+        return np.maximum(positions - self.window_size + 1, column_starts), positions + 1
+
+
+def rolling_batch(values, length, statistic):
+    """
+    Rolling mean, min or max over the length values of each column, with the values of pandas rolling(length)
+    on the column. The columns are stacked into a single series, so that pandas runs one loop instead of one per column.
+    :param values: values matrix (dates in rows, stocks in columns) as numpy array
+    :param length: window length
+    :param statistic: "mean", "min" or "max"
+    :return: numpy array of the same shape
+    """
+    rows, columns = values.shape
+    windows = pd.Series(values.T.ravel()).rolling(ColumnWindows(window_size=length, rows=rows), min_periods=length)
+    return getattr(windows, statistic)().to_numpy().reshape(columns, rows).T
+
+
+def MA_batch(values, length, ma_type="simple"):
+    """
+    Function to calculate MA for many stocks at once, column by column in one vectorised call.
+    Each column has the same values as MA on the values of the stock from its first available value,
+    bars before it are NaN.
+    :param values: values matrix (dates in rows, stocks in columns) as DataFrame or numpy array
+    :param length: MA length (10/20/30)
+    :param ma_type: type of moving average ("simple" or "exponential"), default is "simple"
+    :return: MA values of the same shape (and labels) as values
+    """
+    matrix = pd.DataFrame(values, dtype=float)
+
+    if ma_type.lower() == "simple":
+        ma_rolling = pd.DataFrame(rolling_batch(matrix.to_numpy(), length, "mean"),
+                                  index=matrix.index, columns=matrix.columns)
+    elif ma_type.lower() == "exponential":
+        ma_rolling = pd.DataFrame(ewm_batch(matrix.to_numpy(), (length - 1) / 2),
+                                  index=matrix.index, columns=matrix.columns)
+    else:
+        raise ValueError("Invalid ma_type. Choose 'simple' or 'exponential'.")
+
+    if isinstance(values, pd.DataFrame):
+        return ma_rolling
+    return ma_rolling.to_numpy()
+
+
 def wwma(values, length):
     """
     Functions to calculate WWMA from a dataframe. Used for ATR.
@@ -310,25 +489,62 @@ def ATR(df, length=14):
     return atr
 
 
+def ATR_batch(highs, lows, closes, length=14):
+    """
+    Function to calculate ATR for many stocks at once, column by column in one vectorised call.
+    Each column has the same values as ATR on the bars of the stock from its first available bar,
+    bars before it are NaN.
+    :param highs: high prices matrix (dates in rows, stocks in columns) as DataFrame or numpy array
+    :param lows: low prices matrix of the same shape
+    :param closes: close prices matrix of the same shape
+    :param length: ATR length
+    :return: dictionary with the atr and atr_to_close matrices of the same shape (and labels) as closes
+    """
+    high, low, close = (np.asarray(values, dtype=float) for values in (highs, lows, closes))
+    previous_close = np.full(close.shape, np.nan)
+    previous_close[1:] = close[:-1]
+
+    # Largest of the three ranges ignoring the missing ones, as the row max in ATR
+    tr = np.fmax(np.fmax(np.abs(high - low), np.abs(high - previous_close)), np.abs(low - previous_close))
+    atr = wwma(pd.DataFrame(tr), length).to_numpy()
+
+    results = {"atr": atr, "atr_to_close": atr / close}
+    if isinstance(closes, pd.DataFrame):
+        results = {name: pd.DataFrame(matrix, index=closes.index, columns=closes.columns)
+                   for name, matrix in results.items()}
+    return results
+
+
 def ROC(df):
     """
     Function to calculate rate of change
     param df: pandas dataframe which has the 'close' column
     returns: pandas dataframe
     """
-    window_len = 100  # default lookback period
-    df_closes = pd.DataFrame(df["close"], columns=["close"])
-    df_closes["percent_change"] = df_closes["close"].pct_change()
-    df_closes["percent_change"].iloc[0] = 0
-    df_closes["num_less_than_current"] = (
-        df_closes["percent_change"]
-        .rolling(window_len + 1, min_periods=1)
-        .apply(lambda x: (x[-1] > x[:-1]).sum(), raw=True)
-        .astype(int)
-    )
-    df_closes["roc"] = 100 * df_closes["num_less_than_current"] / window_len
-    df_closes.index = df["timestamp"]
-    return df_closes["roc"]
+    roc = roc_values(df["close"].to_numpy(dtype=float)[:, None])
+    return pd.Series(roc[:, 0], index=pd.Index(df["timestamp"]), name="roc")
+
+
+def roc_values(closes, window_len=100):
+    # Percent rank of the change against the changes of the previous window_len bars, for the columns of a matrix
+    values = np.asarray(closes, dtype=float)
+    before_first = np.logical_and.accumulate(np.isnan(values), axis=0)
+
+    changes = np.full(values.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes[1:] = values[1:] / values[:-1] - 1
+    first_bar = ~before_first
+    first_bar[1:] &= before_first[:-1]
+    changes[first_bar] = 0.0
+
+    # One comparison of the whole matrix per lag instead of a rolling apply per window
+    num_less_than_current = np.zeros(values.shape, dtype=np.int64)
+    for lag in range(1, window_len + 1):
+        num_less_than_current[lag:] += changes[lag:] > changes[:-lag]
+
+    roc = 100 * num_less_than_current / window_len
+    roc[before_first] = np.nan
+    return roc
 
 
 def streak(df):
@@ -337,45 +553,45 @@ def streak(df):
     param df: pandas dataframe which has the 'close' column
     returns: pandas dataframe
     """
-    df_closes = df["close"]
-
-    streak_val = 0
-    streak_arr = []
-    prev_value = None
-    i = 0
-
-    for idx, close in df_closes.items():
-        if i > 0:
-            if close > prev_value:
-                if streak_val <= 0:
-                    streak_val = 1
-                else:
-                    streak_val += 1
-            elif close < prev_value:
-                if streak_val >= 0:
-                    streak_val = -1
-                else:
-                    streak_val -= 1
-            elif close == prev_value:
-                streak_val = 0
-
-        streak_arr.append(streak_val)
-        prev_value = close
-        i += 1
-
-    return_df = pd.DataFrame(streak_arr, columns=["streak"])
+    streak_values_ = streak_values(df["close"].to_numpy(dtype=float)[:, None])
+    return_df = pd.DataFrame(np.nan_to_num(streak_values_[:, 0]).astype(int), columns=["streak"])
     return_df.index = df["timestamp"]
 
     return return_df
 
 
+def streak_values(closes):
+    # Signed length of the run of up (down) closes, 0 after an unchanged close, for the columns of a matrix.
+    # A missing close keeps the streak, and the run goes on over it.
+    values = np.asarray(closes, dtype=float)
+    rows, columns = values.shape
+    direction = np.full(values.shape, np.nan)
+    direction[1:] = np.sign(values[1:] - values[:-1])
+    has_direction = ~np.isnan(direction)
+
+    # Direction of the latest bar with one, carried over the bars without
+    latest = np.maximum.accumulate(np.where(has_direction, np.arange(rows)[:, None], -1), axis=0)
+    held_direction = direction[np.maximum(latest, 0), np.arange(columns)]
+    previous_direction = np.full(values.shape, np.nan)
+    previous_direction[1:] = np.where(latest[:-1] >= 0, held_direction[:-1], np.nan)
+    run_start = has_direction & (direction != previous_direction)
+
+    # Position of each bar in its run, counting only the bars with a direction
+    counted = np.cumsum(has_direction, axis=0)
+    run_first = np.maximum.accumulate(np.where(run_start, counted, 0), axis=0)
+    streaks = np.where(latest >= 0, held_direction * (counted - run_first + 1), 0.0)
+
+    streaks[np.logical_and.accumulate(np.isnan(values), axis=0)] = np.nan
+    return streaks
+
+
 def StochRSI(df, period=14, smoothK=3, smoothD=3):
     """
     Function to calculate Stochastic RSI
     param df: pandas dataframe which has the 'close' column
     returns: K and D values (pandas series)
     """
-    series = df['close']
+    series = df['close'].astype(float)  # float64 also from the compact (float32) prices
 
     delta = series.diff().dropna()
     ups = delta * 0
@@ -400,386 +616,333 @@ def StochRSI(df, period=14, smoothK=3, smoothD=3):
     return stochrsi_K, stochrsi_D
 
 
+def StochRSI_batch(closes, period=14, smoothK=3, smoothD=3):
+    """
+    Function to calculate Stochastic RSI for many stocks at once, column by column in one vectorised call.
+    Each column has the same values as StochRSI on the closes of the stock from its first available close
+    (without gaps after it), bars before it are NaN. Stocks with fewer than period + 1 closes are all NaN.
+    param closes: close prices matrix (dates in rows, stocks in columns) as DataFrame or numpy array
+    returns: K and D values of the same shape (and labels) as closes
+    """
+    matrix = pd.DataFrame(closes, dtype=float)
+    rows = len(matrix)
+    valid = matrix.notna().to_numpy()
+    starts = np.where(valid.any(axis=0), valid.argmax(axis=0), rows)
+
+    delta = matrix.diff().to_numpy()
+    ups = np.where(delta > 0, delta, 0.0)
+    downs = np.where(delta < 0, -delta, 0.0)
+
+    # First average at period closes after the first close, as the mean of the first period changes
+    seeds = starts + period
+    seeded = np.flatnonzero(seeds < rows)
+    changes = starts[seeded, None] + 1 + np.arange(period)
+    first_ups = np.mean(ups.T[seeded[:, None], changes], axis=1)
+    first_downs = np.mean(downs.T[seeded[:, None], changes], axis=1)
+
+    before_seed = np.arange(rows)[:, None] < seeds
+    ups[before_seed] = np.nan
+    downs[before_seed] = np.nan
+    ups[seeds[seeded], seeded] = first_ups
+    downs[seeds[seeded], seeded] = first_downs
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = ewm_batch(ups, period - 1) / ewm_batch(downs, period - 1)
+
+    rsi = 100 - 100 / (1 + rs)
+
+    # Calculate StochRSI
+    lowest = rolling_batch(rsi, period, "min")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stochrsi = (rsi - lowest) / (rolling_batch(rsi, period, "max") - lowest)
+    stochrsi_K = rolling_batch(stochrsi, smoothK, "mean")
+    stochrsi_D = rolling_batch(stochrsi_K, smoothD, "mean")
+
+    if isinstance(closes, pd.DataFrame):
+        return (pd.DataFrame(stochrsi_K, index=closes.index, columns=closes.columns),
+                pd.DataFrame(stochrsi_D, index=closes.index, columns=closes.columns))
+    return stochrsi_K, stochrsi_D
+
+
 def SAR(barsdata, iaf=0.02, maxaf=0.2):
     # Coincides with PSAR but not with Lucid SAR
-
-    length = len(barsdata)
-    high = list(barsdata['high'])
-    low = list(barsdata['low'])
-    close = list(barsdata['close'])
-    psar = close[0:len(close)]
-    psarbull = [None] * length
-    psarbear = [None] * length
-    bull = True
-    af = iaf
-    ep = low[0]
-    hp = high[0]
-    lp = low[0]
-
-    for i in range(2,length):
-        if bull:
-            psar[i] = psar[i - 1] + af * (hp - psar[i - 1])
-        else:
-            psar[i] = psar[i - 1] + af * (lp - psar[i - 1])
-
-        reverse = False
-
-        if bull:
-            if low[i] < psar[i]:
-                bull = False
-                reverse = True
-                psar[i] = hp
-                lp = low[i]
-                af = iaf
-        else:
-            if high[i] > psar[i]:
-                bull = True
-                reverse = True
-                psar[i] = lp
-                hp = high[i]
-                af = iaf
-
-        if not reverse:
-            if bull:
-                if high[i] > hp:
-                    hp = high[i]
-                    af = min(af + iaf, maxaf)
-                if low[i - 1] < psar[i]:
-                    psar[i] = low[i - 1]
-                if low[i - 2] < psar[i]:
-                    psar[i] = low[i - 2]
-            else:
-                if low[i] < lp:
-                    lp = low[i]
-                    af = min(af + iaf, maxaf)
-                if high[i - 1] > psar[i]:
-                    psar[i] = high[i - 1]
-                if high[i - 2] > psar[i]:
-                    psar[i] = high[i - 2]
-
-        if bull:
-            psarbull[i] = psar[i]
-            barsdata.loc[i, 'PSAR_direction'] = 1
-            barsdata.loc[i, 'PSAR_val'] = psar[i]
-            barsdata.loc[i, 'af'] = af
-        else:
-            psarbear[i] = psar[i]
-            barsdata.loc[i, 'PSAR_direction'] = -1
-            barsdata.loc[i, 'PSAR_val'] = psar[i]
-            barsdata.loc[i, 'af'] = af
+    # Adds the PSAR_direction (1 or -1), PSAR_val and af columns from the third bar
+    if len(barsdata) > 2:
+        values = psar_values(barsdata[['high']].to_numpy(dtype=float), barsdata[['low']].to_numpy(dtype=float),
+                             barsdata[['close']].to_numpy(dtype=float), np.zeros(1, dtype=np.int64), iaf, maxaf)
+        for column, matrix in values.items():
+            barsdata[column] = matrix[:, 0]
 
     return barsdata
 
 
+def SAR_batch(highs, lows, closes, iaf=0.02, maxaf=0.2):
+    """
+    Calculate the classic parabolic SAR for many stocks at once.
+    Each column gives the same values as the SAR columns on the bars of the stock from its first available bar,
+    the first two bars of a stock and the bars before are NaN.
+
+    Parameters:
+    highs, lows, closes (pd.DataFrame or np.ndarray): Price matrices, dates in rows and stocks in columns.
+    iaf (float, optional): Initial acceleration factor, also the increment. Defaults to 0.02.
+    maxaf (float, optional): Maximum acceleration factor. Defaults to 0.2.
+
+    Returns:
+    dict: PSAR_direction, PSAR_val and af matrices of the same shape (and labels) as closes.
+    """
+    high, low, close = (np.asarray(values, dtype=float) for values in (highs, lows, closes))
+    valid = ~np.isnan(high) & ~np.isnan(low) & ~np.isnan(close)
+    starts = np.where(valid.any(axis=0), valid.argmax(axis=0), len(close))
+
+    results = psar_values(high, low, close, starts, iaf, maxaf)
+    if isinstance(closes, pd.DataFrame):
+        results = {name: pd.DataFrame(matrix, index=closes.index, columns=closes.columns)
+                   for name, matrix in results.items()}
+    return results
+
+
+def psar_values(high, low, close, starts, iaf, maxaf):
+    size, columns = high.shape
+    direction = kernel_output((columns, size), np.float64, np.nan)
+    psar = kernel_output((columns, size), np.float64, np.nan)
+    af = kernel_output((columns, size), np.float64, np.nan)
+    # Kernel rows are the series, so each one is contiguous
+    psar_kernel(kernel_input(high.T), kernel_input(low.T), kernel_input(close.T), kernel_input(starts, np.int64),
+                iaf, maxaf, direction, psar, af)
+    return {
+        'PSAR_direction': np.asarray(direction, dtype=float).T,
+        'PSAR_val': np.asarray(psar, dtype=float).T,
+        'af': np.asarray(af, dtype=float).T,
+    }
+
+
 def CRSI(df):
     """
     Function to calculate connors rsi
     param df: pandas dataframe which has the 'close' column
     returns: pandas dataframe
     """
+    crsi = crsi_values(df["close"].to_numpy(dtype=float)[:, None])
+    return pd.DataFrame({"crsi": crsi[:, 0], "timestamp": df["timestamp"].to_numpy()})
 
-    # Calculate ROC
-    roc = ROC(df)
-    # print('-- roc\n', roc.tail(5)) # debug
-
-    # Get the streak values (UpDown)
-    UpDown = streak(df)
-    # print('-- updown\n', UpDown.tail(5)) # debug
-
-    # RSI2 of UpDown
-    UpDown_rsi = RSI(UpDown.reset_index(), length=2, colname="streak").set_index(
-        "timestamp"
-    )
-    # print('-- UD RSI\n', UpDown_rsi.tail(5)) # debug
 
-    # RSI3 of the close bars
-    rsi3 = RSI(df, length=3)
-    rsi3.index = df["timestamp"]
-    # print('-- rsi3\n', rsi3.tail(5)) # debug
+def CRSI_batch(closes):
+    """
+    Function to calculate connors rsi for many stocks at once, column by column in one vectorised call.
+    Each column has the same values as CRSI on the closes of the stock from its first available close,
+    bars before it are NaN.
+    param closes: close prices matrix (dates in rows, stocks in columns) as DataFrame or numpy array
+    returns: crsi values of the same shape (and labels) as closes
+    """
+    crsi = crsi_values(closes)
+    if isinstance(closes, pd.DataFrame):
+        return pd.DataFrame(crsi, index=closes.index, columns=closes.columns)
+    return crsi
 
-    # Final result
-    df_crsi = pd.concat([UpDown_rsi, roc], axis=1)
-    df_crsi["crsi"] = (rsi3["rsi3"] + df_crsi["rsi2"] + df_crsi["roc"]) / 3
-    # print('FINAL\n', df_crsi.tail(5)) # debug
 
-    return df_crsi.reset_index()[["crsi", "timestamp"]]
+def crsi_values(closes):
+    # Average of the RSI3 of the closes, the RSI2 of the streaks and the percent rank of the change
+    closes = np.asarray(closes, dtype=float)
+    rsi3 = RSI_batch(closes, length=3)
+    streak_rsi2 = RSI_batch(streak_values(closes), length=2)
+    roc = roc_values(closes)
+    return (rsi3 + streak_rsi2 + roc) / 3
 
 
 def td_indicators(df):
     """
     Function to calculate TD indicator (Tone Vays methodology)
     See http://www.mysmu.edu/faculty/christophert/QF206/Week_05.pdf
+    The bar comparisons are vectorised, the sequential state runs in a single loop kernel (compiled if numba is available)
     :param bars: pandas dataframe (ohlc)
     :return: pandas dataframe
     """
+    size = df["close"].size
+    if size < 6:
+        raise IndexError("TD indicators need at least 6 bars")
+    close = df["close"].to_numpy(dtype=float)
+
+    no_countdowns = np.zeros(0, dtype=np.int64)
+    values, _, _, _ = td_sequential_values(
+        df["open"].to_numpy(dtype=float), df["high"].to_numpy(dtype=float), df["low"].to_numpy(dtype=float), close,
+        6, td_start_state(close), no_countdowns, no_countdowns
+    )
+    columns = td_columns(values)
+    columns["td_direction"] = td_direction_categorical(columns["td_direction"])
+    return pd.DataFrame({"timestamp": df["timestamp"], **columns}, index=df.index)
+
+
+def td_start_state(close):
+    # TD state before the 7th bar, the direction is set by the 6th close
+    state = td_initial_state()
+    if close[5] > close[4]:
+        state[TD_DIRECTION_UP] = 1
+    elif close[5] < close[4]:
+        state[TD_DIRECTION_DOWN] = 1
+    return state
+
+
+def td_direction_batch(opens, highs, lows, closes):
+    """
+    Function to calculate the TD direction for many stocks at once.
+    Each column has the same values as the td_direction of td_indicators on the bars of the stock from its first
+    available bar (without gaps after it): 1 for green, -1 for red and 0 for none (also before the first bar
+    and for the stocks with fewer than 6 bars).
+    :param opens, highs, lows, closes: prices matrices (dates in rows, stocks in columns) as DataFrame or numpy array
+    :return: directions matrix of the same shape (and labels) as closes
+    """
+    open_, high, low, close = (np.asarray(values, dtype=float) for values in (opens, highs, lows, closes))
+    valid = ~np.isnan(close)
+    starts = np.where(valid.any(axis=0), valid.argmax(axis=0), len(close))
+
+    if NUMBA_AVAILABLE:
+        # The bar comparisons for all the stocks at once (NaN before the first bar as in the series of a stock),
+        # then the sequential state of each stock in one compiled call
+        def shifted(values, periods):
+            result = np.full(values.shape, np.nan)
+            result[periods:] = values[:len(values) - periods]
+            return result
+
+        shifted_1, shifted_4, shifted_5 = shifted(close, 1), shifted(close, 4), shifted(close, 5)
+        bear_flip = (shifted_1 >= shifted_5) & (close <= shifted_4)
+        bull_flip = (shifted_1 <= shifted_5) & (close >= shifted_4)
+        if_countdown_down = close <= shifted(low, 2)
+        if_countdown_up = close >= shifted(high, 2)
+
+        direction = np.zeros(close.shape[::-1], dtype=np.int64)
+        td_direction_rows_kernel(
+            *(np.ascontiguousarray(values.T) for values in (open_, high, close, bear_flip, bull_flip,
+                                                             if_countdown_up, if_countdown_down)),
+            starts.astype(np.int64), direction
+        )
+        directions = direction.T.astype(np.int8)
+    else:
+        directions = np.zeros(close.shape, dtype=np.int8)
+        no_countdowns = np.zeros(0, dtype=np.int64)
+        for column in np.flatnonzero(starts <= len(close) - 6):
+            start = starts[column]
+            column_close = close[start:, column]
+            values, _, _, _ = td_sequential_values(
+                open_[start:, column], high[start:, column], low[start:, column], column_close,
+                6, td_start_state(column_close), no_countdowns, no_countdowns
+            )
+            directions[start:, column] = values[1]
+
+    if isinstance(closes, pd.DataFrame):
+        return pd.DataFrame(directions, index=closes.index, columns=closes.columns)
+    return directions
+
+
+# td_direction is a categorical column: a one byte code per bar instead of a python string
+TD_DIRECTION_DTYPE = pd.CategoricalDtype(["red", "green"])
+
+
+def td_direction_categorical(td_direction):
+    """
+    Categorical td_direction column from the green/red/None values of td_columns
+    """
+    codes = np.where(td_direction == "green", 1, np.where(td_direction == "red", 0, -1))
+    return pd.Categorical.from_codes(codes, dtype=TD_DIRECTION_DTYPE)
+
 
-    # Preparation
-    bars = df.copy()
-    bearish_flip, bullish_flip = False, False
-    setup_up, setup_down = 0, 0
-    size = bars["close"].size
-    # print "TDLib: Bars df size:", size
-
-    # Calculated fields
-    bars.loc[:, "td_setup"] = 0  # additional column: td setup number
-    bars.loc[:, "td_direction"] = ""  # td setup direction
-    bars.loc[
-        :, "move_extreme"
-    ] = None  # for stopping when the setup extreme is not calculated rigth
-
-    # Changing the types to preserve memory space
-    bars["td_setup"] = pd.to_numeric(bars["td_setup"], errors="coerce")
-    bars["move_extreme"] = pd.to_numeric(bars["move_extreme"], errors="coerce")
-
-    # Initial direction and values by default
-    direction_up, direction_down = False, False
-    move_extreme = None
-    countdown_up_flag, countdown_down_flag = False, False
-    countdown_up_list = []
-    countdown_down_list = []
-
-    # Defining tdst values
-    tdst_pre = None
-    tdst_level = None
-
-    # Defining correct move_extreme for completed TD1
-    move_extreme_pre = None
-    move_direction_pre = None
-
-    if bars["close"].iloc[5] > bars["close"].iloc[4]:
-        direction_up = True
-    elif bars["close"].iloc[5] < bars["close"].iloc[4]:
-        direction_down = True
+def td_columns(values):
+    """
+    TD indicators columns from the td_sequential_values outputs
+    """
+    setup, direction, move_extremes, countdown_up, countdown_down, tdst = values
+    td_direction = np.full(len(direction), None, dtype=object)
+    td_direction[direction == 1] = "green"  # up
+    td_direction[direction == -1] = "red"  # down
+
+    # Returning only what we need, with the types changed to save memory
+    return {
+        "td_setup": np.asarray(setup, dtype="int8"),
+        "td_direction": td_direction,
+        "move_extreme": np.asarray(move_extremes, dtype=float),
+        "countdown_down": np.asarray(countdown_down, dtype="int8"),
+        "countdown_up": np.asarray(countdown_up, dtype="int8"),
+        "tdst": np.asarray(tdst, dtype="float32"),
+    }
+
+
+def td_sequential_values(open_, high, low, close, first, state, up_bases, down_bases):
+    """
+    TD sequential outputs for the bars from the first one, continuing from the state of the previous bar.
+    Bars before the first one are only the context for the bar comparisons (5 bars are enough).
+
+    :param state: TD state array (see kernels.td_initial_state), not modified
+    :param up_bases, down_bases: active countdown queues of the state
+    :return: (setup, direction, move_extremes, countdown_up, countdown_down, tdst) arrays for all the bars,
+        and the state, up_bases and down_bases after the last bar
+    """
+    size = len(close)
+
+    def shifted(values, periods):
+        result = np.full(size, np.nan)
+        result[periods:] = values[:size - periods]
+        return result
 
     # Shifting closes for further calculations
-    bars["shifted_1"] = bars["close"].shift(1)
-    bars["shifted_2"] = bars["close"].shift(2)
-    bars["shifted_4"] = bars["close"].shift(4)
-    bars["shifted_5"] = bars["close"].shift(5)
-
-    # Comparison operations, resulting in A (above) or B (below)
-    bars["bear_flip"] = bars.apply(
-        lambda x: True
-        if x["shifted_1"] >= x["shifted_5"] and x["close"] <= x["shifted_4"]
-        else False,
-        axis=1,
-    )
-    bars["bull_flip"] = bars.apply(
-        lambda x: True
-        if x["shifted_1"] <= x["shifted_5"] and x["close"] >= x["shifted_4"]
-        else False,
-        axis=1,
-    )
-    bars["bear_reset"] = bars.apply(
-        lambda x: True if x["close"] > x["shifted_4"] else False, axis=1
-    )
-    bars["bull_reset"] = bars.apply(
-        lambda x: True if x["close"] < x["shifted_4"] else False, axis=1
-    )
-    # For move_extremes
-    bars["shifted_1_low"] = bars["low"].shift(1)
-    bars["shifted_2_low"] = bars["low"].shift(2)
-    bars["shifted_1_high"] = bars["high"].shift(1)
-    bars["shifted_2_high"] = bars["high"].shift(2)
-    # Resulting move_extreme
-    bars["max_1_2"] = bars[["shifted_1_high", "shifted_2_high"]].max(axis=1)
-    bars["min_1_2"] = bars[["shifted_1_low", "shifted_2_low"]].min(axis=1)
+    shifted_1, shifted_4, shifted_5 = shifted(close, 1), shifted(close, 4), shifted(close, 5)
+    shifted_2_low, shifted_2_high = shifted(low, 2), shifted(high, 2)
+
+    # Comparisons with the missing (NaN) values are False
+    bear_flip = (shifted_1 >= shifted_5) & (close <= shifted_4)
+    bull_flip = (shifted_1 <= shifted_5) & (close >= shifted_4)
     # For countdowns
-    bars["if_countdown_down"] = bars.apply(
-        lambda x: True if x["close"] <= x["shifted_2_low"] else False, axis=1
+    if_countdown_down = close <= shifted_2_low
+    if_countdown_up = close >= shifted_2_high
+
+    setup = kernel_output(size, np.int64)
+    direction = kernel_output(size, np.int64)
+    move_extremes = kernel_output(size, np.float64, np.nan)
+    countdown_up = kernel_output(size, np.int64)
+    countdown_down = kernel_output(size, np.int64)
+    tdst = kernel_output(size, np.float64, np.nan)
+
+    # A countdown can start at most on every bar, so the queues can grow by the number of bars
+    state = kernel_input(np.array(state, dtype=float))
+    up_queue = kernel_input(np.concatenate([up_bases, np.zeros(size, dtype=np.int64)]), np.int64)
+    down_queue = kernel_input(np.concatenate([down_bases, np.zeros(size, dtype=np.int64)]), np.int64)
+    td_sequential_kernel(
+        kernel_input(open_), kernel_input(high), kernel_input(close),
+        kernel_input(bear_flip, bool), kernel_input(bull_flip, bool),
+        kernel_input(if_countdown_up, bool), kernel_input(if_countdown_down, bool),
+        first, state, setup, direction, move_extremes, countdown_up, countdown_down, tdst,
+        up_queue, down_queue
     )
-    bars["if_countdown_up"] = bars.apply(
-        lambda x: True if x["close"] >= x["shifted_2_high"] else False, axis=1
-    )
-
-    np_setup = np.zeros(shape=(size, 1), dtype=int)
-    np_direction = np.empty(shape=(size, 1), dtype=object)
-    np_move_extremes = np.empty(
-        shape=(size, 1)
-    )  # will have the 1s values per sandy's methodology
-    np_move_extremes.fill(np.nan)
-    # Countdown
-    np_countdown_up = np.zeros(shape=(size, 1), dtype=int)
-    np_countdown_down = np.zeros(shape=(size, 1), dtype=int)
-    # TDST
-    np_tdst = np.empty(shape=(size, 1), dtype=float)
-    np_tdst.fill(np.nan)
-
-    ## Looping through
-    i = 0
-    for bar_row in bars.itertuples():
-        if i > 5:  # need 6 candles to start
-            ## Price flip
-            bearish_flip, bullish_flip = False, False
-
-            if setup_up == 9:
-                setup_up = 0  # restart count
-            if setup_down == 9:
-                setup_down = 0  # restart count
-
-            # Flips - bearish
-            if bar_row.bear_flip:
-                bearish_flip = True
-                direction_down = True
-                bullish_flip = False
-                tdst_pre = bar_row.high  # high of the move
-
-            # Flips - bullish
-            if bar_row.bull_flip:
-                bullish_flip = True
-                direction_up = True
-                bearish_flip = False
-                tdst_pre = bar_row.high  # low of the move
-
-            if bearish_flip and direction_up:
-                direction_up = False
-                setup_down = 1
-            if bullish_flip and direction_down:
-                direction_down = False
-                setup_up = 1
-
-            ## TD Setup (sequential)
-            if direction_down and not bearish_flip:
-                setup_down += 1  # having it like this fixes the bug with TD1 appearing several times in a row
-
-            if direction_up and not bullish_flip:
-                setup_up += 1  # having it like this fixes the bug with TD1 appearing several times in a row
-
-            # Move extreme change calc: 1 -> 2 count it in, not just on flip
-            if direction_up and setup_up == 1:
-                move_extreme_pre = min(
-                    bar_row.open, bar_row.close
-                )  # lowest of the candle comparing open and close
-                move_direction_pre = "up"
-            if direction_down and setup_down == 1:
-                move_extreme_pre = max(bar_row.open, bar_row.close)
-                move_direction_pre = "down"
-
-            # Move extreme recalculation
-            if move_direction_pre == "up" and direction_up and setup_up == 2:
-                move_extreme = move_extreme_pre
-            if move_direction_pre == "down" and direction_down and setup_down == 2:
-                move_extreme = move_extreme_pre
-
-            # Filling the np arrays
-            if direction_down:
-                np_setup[i] = setup_down
-                np_direction[i] = "red"  # down
-            if direction_up:
-                np_setup[i] = setup_up
-                np_direction[i] = "green"  # up
-
-            # Common for any direction
-            np_move_extremes[i] = move_extreme
-
-            # Countdowns check
-            # Will need to store a list with counters
-            # If there is active countdown but we get a 9 in the same direction again - one more countdown is added
-            # If a 9 in different direction - the previous direction countdown should stop
-            if direction_up and setup_up == 9:
-                countdown_up_flag = True
-                countdown_down_flag = False  # also in this case delete countdowns
-                countdown_down_list = []
-                countdown_up_list.append(0)  # reserving place for counter increase
-                tdst_level = tdst_pre  # updating the TDST value
-            if direction_down and setup_down == 9:
-                countdown_down_flag = True
-                countdown_up_flag = False
-                countdown_up_list = []
-                countdown_down_list.append(0)  # reserving place for counter increase
-                tdst_level = tdst_pre  # updating the TDST value
-
-            # Writing TDST on every iteration
-            np_tdst[i] = tdst_level
-
-            """ TD seq buy: 
-            If bar 9 has a close less than or equal to the low of two bars earlier
-                then bar 9 becomes 1 countdown
-            If not met - then countdown 1 postponed until condition is met and continues until total of 13 closes
-            Each should be less or equal to the low 2 bars earlier
-            If one of elements in on 13, delete it.
-            This is a simplified approach as completion of 13 also requires comparison with 8th setup bar
-            """
-            if direction_up and countdown_up_flag and bar_row.if_countdown_up:
-                countdown_up_list = [x + 1 for x in countdown_up_list]
-                countdown_up_list = [x for x in countdown_up_list if x != 13]
-            if countdown_up_list != []:
-                np_countdown_up[i] = max(
-                    countdown_up_list
-                )  # this is enough for our purposes
-            if direction_down and countdown_down_flag and bar_row.if_countdown_down:
-                countdown_down_list = [x + 1 for x in countdown_down_list]
-                countdown_down_list = [x for x in countdown_down_list if x != 13]
-            if countdown_down_list != []:
-                np_countdown_down[i] = max(
-                    countdown_down_list
-                )  # this is enough for our purposes
-
-        # counter increase
-        i += 1
-
-    # Join np arrays with the dataframe
-    setup_df = pd.DataFrame(data=np_setup)
-    setup_df.index = bars.index.copy()
-    bars["td_setup"] = setup_df
-
-    setup_dir = pd.DataFrame(data=np_direction)
-    setup_dir.index = bars.index.copy()
-    bars["td_direction"] = setup_dir
-
-    move_extreme_df = pd.DataFrame(data=np_move_extremes)
-    move_extreme_df.index = bars.index.copy()
-    bars["move_extreme"] = move_extreme_df
-
-    np_countdown_up_df = pd.DataFrame(data=np_countdown_up)
-    np_countdown_up_df.index = bars.index.copy()
-    bars["countdown_up"] = np_countdown_up_df
-
-    np_countdown_down_df = pd.DataFrame(data=np_countdown_down)
-    np_countdown_down_df.index = bars.index.copy()
-    bars["countdown_down"] = np_countdown_down_df
-
-    # Adding tdst
-    np_tdst_df = pd.DataFrame(data=np_tdst)
-    np_tdst_df.index = bars.index.copy()
-    bars["tdst"] = np_tdst_df
-
-    # Change types to save memory
-    bars["countdown_up"] = bars.countdown_up.astype("int8")
-    bars["countdown_down"] = bars.countdown_down.astype("int8")
-    bars["td_setup"] = bars.td_setup.astype("int8")
-    bars["open"] = bars.open.astype("float32")
-    bars["high"] = bars.high.astype("float32")
-    bars["low"] = bars.low.astype("float32")
-    bars["close"] = bars.close.astype("float32")
-    # new
-    bars["tdst"] = bars.tdst.astype("float32")
-
-    bars["timestamp"] = df["timestamp"]
-
-    # Returning only what we need
-    return bars[
-        [
-            "timestamp",
-            "td_setup",
-            "td_direction",
-            "move_extreme",
-            "countdown_down",
-            "countdown_up",
-            "tdst",
-        ]
-    ]
 
+    state = np.asarray(state, dtype=float)
+    values = tuple(np.asarray(output) for output in (setup, direction, move_extremes, countdown_up, countdown_down, tdst))
+    up_bases = np.asarray(up_queue, dtype=np.int64)[:int(state[TD_UP_COUNT])]
+    down_bases = np.asarray(down_queue, dtype=np.int64)[:int(state[TD_DOWN_COUNT])]
+    return values, state, up_bases, down_bases
 
 __all__ = [
     "td_indicators",
+    "td_direction_batch",
+    "TD_DIRECTION_DTYPE",
+    "fisher_distance",
+    "fisher_distance_batch",
+    "coppock_curve",
+    "coppock_curve_batch",
+    "WMA",
+    "lucid_sar",
+    "lucid_sar_batch",
+    "SAR",
+    "SAR_batch",
     "ATR",
+    "ATR_batch",
     "wwma",
     "MA",
+    "MA_batch",
     "RSI",
+    "RSI_batch",
     "ROC",
     "streak",
     "CRSI",
+    "CRSI_batch",
     "StochRSI",
+    "StochRSI_batch",
     "combined_indicators",
 ]
@@ -4,11 +4,9 @@ warnings.filterwarnings("ignore")
 from collections import namedtuple
 from collections import defaultdict
 import peewee
-from tqdm import tqdm
 
-# For concurrent fetching of stock prices
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from libs.http_cache import set_offline_mode
+from libs.pricesync import sync_stock_prices
 
 from libs.helpers import (
     define_scanner_args,
@@ -22,7 +20,17 @@ from libs.helpers import (
     get_data_start_date,
     create_header
 )
-from libs.signal import bullish_mri_based, market_bearish, bullish_anx_based, earnings_gap_down, bearish_anx_based
+from libs.signal import (
+    bullish_mri_based,
+    market_bearish,
+    bullish_anx_based,
+    earnings_gap_down,
+    bearish_anx_based,
+    bullish_anx_rules,
+    bearish_anx_rules,
+    moving_average
+)
+from libs.feature_cache import feature_cache
 from libs.stocktools import (
     get_stock_data,
     ohlc_daily_to_weekly,
@@ -31,18 +39,21 @@ from libs.stocktools import (
     Market
 )
 from libs.db import (
-    bulk_add_stocks,
+    replace_stocks,
     create_stock_table,
-    delete_all_stocks,
     get_stocks,
     get_update_date,
-    delete_all_stock_prices,
-    create_stock_price_table,
-    bulk_add_stock_prices,
     get_stock_price_data,
-    initialize_price_database
+    initialize_price_database,
+    load_price_panel
 )
 from libs.techanalysis import td_indicators, MA, fisher_distance, coppock_curve
+from libs.indicator_state import load_indicator_state
+from libs.dtypes import dtype_parity_report
+from libs.screening import UniverseBars, screening_summary
+from libs.strategy_rules import method_strategies
+from libs.sweep import threshold_sweep, sweep_report
+from libs.exceptions_lib import StrategyRuleError
 import pandas as pd
 from time import time, sleep
 from datetime import datetime, timedelta
@@ -53,10 +64,10 @@ config = read_config()
 
 def rewrite_stocks(exchange, stocks):
     create_stock_table()
-    print(f"Deleting the existing stocks for {exchange}")
-    delete_all_stocks(exchange)
-    print(f"Writing info on {len(stocks)} stocks to the database")
-    bulk_add_stocks(stocks)
+    print(f"Replacing the existing stocks for {exchange}")
+    # Stocks are written as they are parsed from the response
+    added_number = replace_stocks(exchange, stocks)
+    print(f"Wrote info on {added_number} stocks to the database")
     print("Update finished")
 
 
@@ -100,15 +111,20 @@ def check_update_date(active_markets):
             )
 
 def last_volume_5D_MA(volume_daily):
-    volume_ma_20 = MA(volume_daily, 20, colname="volume")
+    volume_ma_20 = moving_average(volume_daily, 20, colname="volume")
     return volume_ma_20["ma20"].iloc[-1]
 
 
-def generate_indicators_daily_weekly(ohlc_daily):
+def generate_indicators_daily_weekly(ohlc_daily, indicator_store=None, stock_code=None):
     # Generates extra info from daily OHLC
+    # With the indicator state store, the values are advanced from the saved state of the stock by the new bars only
+    # and also include the EMAs, Fisher distance and (weekly) Lucid SAR used by the signals
     if len(ohlc_daily) < 8:
         print("Too recent asset, not enough daily data")
         return None, None
+    elif indicator_store is not None:
+        td_values = indicator_store.indicators(stock_code, "daily", ohlc_daily)
+        ohlc_with_indicators_daily = pd.concat([ohlc_daily, td_values], axis=1)
     else:
         td_values = td_indicators(ohlc_daily)
         ohlc_with_indicators_daily = pd.concat([ohlc_daily, td_values], axis=1)
@@ -117,6 +133,10 @@ def generate_indicators_daily_weekly(ohlc_daily):
     if len(ohlc_weekly) < 8:
         print("Too recent asset, not enough weekly data")
         return None, None
+    elif indicator_store is not None:
+        # The current week is not complete, so its bar is not saved in the state
+        td_values_weekly = indicator_store.indicators(stock_code, "weekly", ohlc_weekly, last_bar_final=False)
+        ohlc_with_indicators_weekly = pd.concat([ohlc_weekly, td_values_weekly], axis=1)
     else:
         td_values_weekly = td_indicators(ohlc_weekly)
         ohlc_with_indicators_weekly = pd.concat([ohlc_weekly, td_values_weekly], axis=1)
@@ -199,19 +219,76 @@ def process_market_data_at_date(market_ohlc_daily, market_volume_daily):
 def calculate_extra_metrics(ohlc_with_indicators_daily, ohlc_with_indicators_weekly):
         metric_values = dict()
 
-        metric_values['fisherDaily'] = fisher_distance(ohlc_with_indicators_daily).iloc[-1].values[0]
-        metric_values['fisherWeekly'] = fisher_distance(ohlc_with_indicators_weekly).iloc[-1].values[0]
-        metric_values['coppockDaily'] = coppock_curve(ohlc_with_indicators_daily).iloc[-1].values[0]
-        metric_values['coppockWeekly'] = coppock_curve(ohlc_with_indicators_weekly).iloc[-1].values[0]
+        for timeframe, ohlc in [("Daily", ohlc_with_indicators_daily), ("Weekly", ohlc_with_indicators_weekly)]:
+            metric_values[f'fisher{timeframe}'] = feature_cache.get(
+                ohlc, "fisher_distance", (), lambda: fisher_distance(ohlc)
+            ).iloc[-1].values[0]
+            metric_values[f'coppock{timeframe}'] = feature_cache.get(
+                ohlc, "coppock", (), lambda: coppock_curve(ohlc)
+            ).iloc[-1].values[0]
 
         return metric_values
 
 
-def scan_stock(stocks, market, method, direction, start_date):
-    # Scans the stocks using particular method and strategy
+def evaluate_signal(method, direction, ohlc_with_indicators_daily, volume_daily, ohlc_with_indicators_weekly, stock):
+    # Check for confirmation depending on the method
+    # Returns the confirmation and the note of the trigger
+    if method == 'mri':
+        # Raise NotImplemented because directional scan is not supported
+        raise NotImplementedError("Directional scan not supported for MRI method")
+        """
+        confirmation, _ = bullish_mri_based(
+            ohlc_with_indicators_daily,
+            volume_daily,
+            ohlc_with_indicators_weekly,
+            consider_volume_spike=True,
+            output=True,
+            stock_name=stock.name,
+        )
+        """
+    elif method == 'anx':
+        if direction == 'bull':
+            confirmation, numerical_score, trigger_note = bullish_anx_based(
+                ohlc_with_indicators_daily,
+                volume_daily,
+                ohlc_with_indicators_weekly,
+                output=arguments["verbose"],
+                stock_name=stock.name,
+            )
+        elif direction == 'bear':
+            confirmation, numerical_score, trigger_note = bearish_anx_based(
+                ohlc_with_indicators_daily,
+                volume_daily,
+                ohlc_with_indicators_weekly,
+                output=arguments["verbose"],
+                stock_name=stock.name,
+            )
+    elif method == 'earnings':
+        confirmation, _ = earnings_gap_down(
+            ohlc_with_indicators_daily,
+            volume_daily,
+            ohlc_with_indicators_weekly,
+            output=True,
+            stock_name=stock.name,
+        )
+        trigger_note = ''
+
+    return confirmation, trigger_note
+
+
+def scan_stock(stocks, market, method, directions, start_date, panel=None, indicator_store=None, screened=None):
+    # Scans the stocks using particular method and strategy, for all the directions in one pass:
+    # each stock is prepared once and its indicators are shared by the directions
+    # Prices come from a panel loaded for the whole universe at once (loaded here if not provided)
+    # Indicators are advanced from their saved state if the indicator state store is provided
+    # Only the stocks passing the screening of a direction (boolean series by stock code by direction,
+    # see libs.strategy_rules) are checked for it
+    # Returns the shortlists by direction
+    if panel is None:
+        panel = load_price_panel([stock.code for stock in stocks], start_date)
 
     stock_suffix = market.stock_suffix
-    shortlisted_stocks = []
+    shortlisted_stocks = {direction: [] for direction in directions}
     # Placeholder for shortlisted stocks and their attributes
     # Each stock will be a named tuple with the following definition:
     Stock = namedtuple('Stock', ['code', 'name', 'volume', 'note'])
@@ -220,96 +297,74 @@ def scan_stock(stocks, market, method, direction, start_date):
     for i, stock in enumerate(stocks):
         print(f"\n{stock.code} [{stock.name}] ({i + 1}/{len(stocks)})")
 
+        stock_directions = [
+            direction for direction in directions
+            if screened is None or direction not in screened or screened[direction].get(stock.code, False)
+        ]
+        if not stock_directions:
+            print(f"{stock.name} [x] not passing the screening")
+            continue
+
         # Obtain OHLC data for the stocks
-        # Get data from local database instead of API
-        ohlc_daily, volume_daily = get_stock_price_data(stock.code, start_date)
+        # Get data from the panel loaded from the local database instead of API
+        ohlc_daily, volume_daily = panel.get_stock_price_data(stock.code)
         if ohlc_daily is None:
             print("No data available for the asset")
             continue
 
         ohlc_daily, volume_daily = process_data_at_date(ohlc_daily, volume_daily)
 
+        # Indicators are computed once per scan and shared by the directions and the signal functions
+        feature_cache.tag_frame(ohlc_daily, stock.code, "daily")
+        feature_cache.tag_frame(volume_daily, stock.code, "daily")
         (
             ohlc_with_indicators_daily,
             ohlc_with_indicators_weekly,
-        ) = generate_indicators_daily_weekly(ohlc_daily)
+        ) = feature_cache.get(
+            ohlc_daily, "indicators", (), lambda: generate_indicators_daily_weekly(ohlc_daily, indicator_store, stock.code)
+        )
         if (
             ohlc_with_indicators_daily is None
             or ohlc_with_indicators_weekly is None
         ):
             continue
+        feature_cache.tag_frame(ohlc_with_indicators_daily, stock.code, "daily")
+        feature_cache.tag_frame(ohlc_with_indicators_weekly, stock.code, "weekly")
 
-        # Check for confirmation depending on the method
-        if method == 'mri':
-            # Raise NotImplemented because directional scan is not supported
-            raise NotImplementedError("Directional scan not supported for MRI method")
-            """
-            confirmation, _ = bullish_mri_based(
-                ohlc_with_indicators_daily,
-                volume_daily,
-                ohlc_with_indicators_weekly,
-                consider_volume_spike=True,
-                output=True,
-                stock_name=stock.name,
+        for direction in stock_directions:
+            confirmation, trigger_note = evaluate_signal(
+                method, direction, ohlc_with_indicators_daily, volume_daily, ohlc_with_indicators_weekly, stock
             )
-            """
-        elif method == 'anx':
-            if direction == 'bull':
-                confirmation, numerical_score, trigger_note = bullish_anx_based(
-                    ohlc_with_indicators_daily,
-                    volume_daily,
-                    ohlc_with_indicators_weekly,
-                    output=True,
-                    stock_name=stock.name,
-                )
-            elif direction == 'bear':
-                confirmation, numerical_score, trigger_note = bearish_anx_based(
-                    ohlc_with_indicators_daily,
-                    volume_daily,
-                    ohlc_with_indicators_weekly,
-                    output=True,
-                    stock_name=stock.name,
-                )
-        elif method == 'earnings':
-            confirmation, _ = earnings_gap_down(
-                ohlc_with_indicators_daily,
-                volume_daily,
-                ohlc_with_indicators_weekly,
-                output=True,
-                stock_name=stock.name,
-            )
-            trigger_note = ''
-
-
-        if confirmation:
-            print(f"{stock.name} [v] meeting shortlisting conditions")
-            volume_MA_5D = last_volume_5D_MA(volume_daily)
 
-            if volume_MA_5D > config["filters"]["minimum_volume_level"]:
-                print(
-                    f'\n{stock.name} [v] meeting minimum volume level conditions '
-                    f'({format_number(volume_MA_5D)} > {format_number(config["filters"]["minimum_volume_level"])})'
-                )
-                # Calculate extra metrics only for shortlisted stocks for a faster process
-                # metric_data = calculate_extra_metrics(ohlc_with_indicators_daily, ohlc_with_indicators_weekly)
-
-                # Append the shortlist with a stock and its characteristics
-                shortlisted_stocks.append(
-                    Stock(code=stock.code,
-                          name=stock.name,
-                          volume=volume_MA_5D,
-                          note=trigger_note
-                          )
-                )
+            if confirmation:
+                print(f"{stock.name} [v] meeting {direction} shortlisting conditions")
+                volume_MA_5D = last_volume_5D_MA(volume_daily)
+
+                if volume_MA_5D > config["filters"]["minimum_volume_level"]:
+                    print(
+                        f'\n{stock.name} [v] meeting minimum volume level conditions '
+                        f'({format_number(volume_MA_5D)} > {format_number(config["filters"]["minimum_volume_level"])})'
+                    )
+                    # Calculate extra metrics only for shortlisted stocks for a faster process
+                    # metric_data = calculate_extra_metrics(ohlc_with_indicators_daily, ohlc_with_indicators_weekly)
+
+                    # Append the shortlist with a stock and its characteristics
+                    shortlisted_stocks[direction].append(
+                        Stock(code=stock.code,
+                              name=stock.name,
+                              volume=volume_MA_5D,
+                              note=trigger_note
+                              )
+                    )
+
+                else:
+                    print(
+                        f'\n{stock.name} [x] not meeting minimum volume level conditions '
+                        f'({format_number(volume_MA_5D)} < {format_number(config["filters"]["minimum_volume_level"])})'
+                    )
 
             else:
-                print(
-                    f'\n{stock.name} [x] not meeting minimum volume level conditions '
-                    f'({format_number(volume_MA_5D)} < {format_number(config["filters"]["minimum_volume_level"])})'
-                )
-
-        else:
-            print(f"\n{stock.name} [x] not meeting shortlisting conditions")
+                print(f"{stock.name} [x] not meeting {direction} shortlisting conditions")
 
     return shortlisted_stocks
 
@@ -401,7 +456,7 @@ def scan_exchange_stocks(market, method, direction):
     start_date = get_data_start_date(arguments["date"])
     fetch_and_store_stock_data(stocks, start_date)
 
-    shortlist = scan_stock(stocks, market, method, direction, start_date)
+    shortlist = scan_stock(stocks, market, method, [direction], start_date)[direction]
 
     # Sort the list by volume in decreasing order
     sorted_stocks = sorted(shortlist, key=lambda stock: stock.volume, reverse=True)
@@ -418,8 +473,9 @@ def scan_stocks(active_markets):
         exit(0)
 
     # Initialize price database unless using existing data
+    # Stored prices are kept and synced incrementally unless a full refresh is requested
     if not arguments["use_existing_price_data"]:
-        initialize_price_database()
+        initialize_price_database(full_rebuild=arguments["full_price_refresh"])
 
     # First pass: get all stocks and fetch data
     start_date = get_data_start_date(arguments["date"])
@@ -458,13 +514,59 @@ def scan_stocks(active_markets):
         else:
             print("All stocks already processed, skipping data fetch")
 
-    # Second pass: run scans for each market using stored data
+    # Load the prices of all the scanned stocks with a single query
+    print("\nLoading stored prices...")
+    panel = load_price_panel(
+        [stock.code for stocks in all_market_stocks.values() for stock in stocks], start_date
+    )
+    print(f"Loaded prices for {len(panel)} stocks ({panel.nbytes / 2**20:.1f}MB)")
+
+    # Indicator state saved by the previous scan, not used when scanning at a past date
+    indicator_store = load_indicator_state() if arguments["date"] is None else None
+    feature_cache.clear()
+
+    # With screening, the strategy rules of the method (strategy_rules in the config) are evaluated
+    # for the whole universe at once and only the stocks meeting them are scanned one by one
+    # (for the output and the trigger notes)
+    screened = None
+    if arguments["screen"]:
+        try:
+            strategies = method_strategies(arguments["method"])
+        except StrategyRuleError as error:
+            print(f"Error: {error}")
+            exit(0)
+        screen_start = time()
+        bars, screening_cache = UniverseBars(panel, date=arguments["date"]), {}
+        screened = {}
+        for strategy in strategies:
+            masks = strategy.evaluate(bars, screening_cache)
+            # Several strategies of a direction all have to be met
+            screened[strategy.direction] = masks["signal"] & screened.get(strategy.direction, True)
+            print(f"{strategy.name}: {screening_summary(masks)}")
+        print(f"Screened in {time() - screen_start:.2f}s")
+
+    # Second pass: run scans for each market using stored data, all the directions in a single pass over the stocks
+    directions = config["strategy"][arguments["method"]]['directions']
     for market in active_markets:
         stocks = all_market_stocks[market.market_code]
-        for direction in config["strategy"][arguments["method"]]['directions']:
-            print(f"\nScanning {market.market_code} for {direction.upper()} signals...")
-            shortlists[market.market_code][direction] = scan_stock(stocks, market, arguments["method"], direction,
-                                                                   start_date)
+        print(f"\nScanning {market.market_code} for {', '.join(direction.upper() for direction in directions)} signals...")
+        for direction in directions:
+            if screened is not None and direction in screened:
+                passed = sum(bool(screened[direction].get(stock.code, False)) for stock in stocks)
+                print(f"{passed} of {len(stocks)} stocks passed the screening for {direction.upper()} signals")
+        shortlists[market.market_code].update(
+            scan_stock(stocks, market, arguments["method"], directions, start_date, panel, indicator_store, screened)
+        )
+
+    print()
+    if indicator_store is not None:
+        indicator_store.save()
+        print(indicator_store.summary())
+    print(feature_cache.summary())
+    feature_cache.clear()
+    for rules in (bullish_anx_rules, bearish_anx_rules):
+        if rules.evaluations:
+            print(rules.summary())
 
     # Report results
     print("\nFinished scanning")
@@ -481,111 +583,73 @@ def scan_stocks(active_markets):
             )
 
 
-def fetch_prices_for_stock(stock, market, start_date):
-    """
-    Fetch price data for a single stock.
+def stored_stock_codes(active_markets):
+    # Codes of the markets' stocks (or of the requested ones), limited to the requested number
+    codes = []
+    for market in active_markets:
+        if arguments["stocks"] is None:
+            stocks = get_stocks(exchange=market.market_code)
+        else:
+            stocks = get_stocks(codes=arguments["stocks"])
+        codes.extend(stock.code for stock in stocks)
 
-    Args:
-        stock: Stock object containing code and exchange info
-        market: Market object for the stock
-        start_date: Start date for price data
+    codes = list(dict.fromkeys(codes))
+    if arguments["num"] is not None:
+        codes = codes[: arguments["num"]]
+    return codes
 
-    Returns:
-        tuple: (stock_code, list of price dictionaries)
-    """
+
+def check_dtype_parity(active_markets):
+    # Parity check of the configured dtype policy on the stored prices of the markets' stocks
+    panel = load_price_panel(stored_stock_codes(active_markets), get_data_start_date(arguments["date"]), policy="full")
+    print(dtype_parity_report(panel, config["dtypes"]["policy"]))
+
+
+def sweep_thresholds(active_markets):
+    # Shortlists of the strategy rules of the method for every combination of the threshold_sweep config values,
+    # on the stored prices of the markets' stocks
+    if arguments["method"] is None or not config.get("threshold_sweep"):
+        print("Error: the sweep needs a method and the values to try in the threshold_sweep config section")
+        exit(0)
+
+    panel = load_price_panel(stored_stock_codes(active_markets), get_data_start_date(arguments["date"]))
+    sweep_start = time()
+    bars = UniverseBars(panel, date=arguments["date"])
     try:
-        stock_code = f"{stock.code}{market.stock_suffix}"
-        price_df, volume_df = get_stock_data(stock_code, start_date)
-
-        if price_df is not None:
-            prices_to_add = []
-            for idx, row in price_df.iterrows():
-                prices_to_add.append({
-                    'stock': stock.code,
-                    'date': row['timestamp'].to_pydatetime(),
-                    'open': float(row['open']),
-                    'high': float(row['high']),
-                    'low': float(row['low']),
-                    'close': float(row['close']),
-                    'volume': float(volume_df.iloc[idx]['volume'])
-                })
-            return stock.code, prices_to_add
-
-        return stock.code, []
-
-    except Exception as e:
-        print(f"Error fetching data for {stock_code}: {str(e)}")
-        return stock.code, []
-
-
-def fetch_and_store_stock_data(stocks, start_date, end_date=None, clear_existing=False, max_workers=5):
+        results = threshold_sweep(bars, arguments["method"], config["threshold_sweep"])
+    except StrategyRuleError as error:
+        print(f"Error: {error}")
+        exit(0)
+
+    print(sweep_report(results))
+    print(f"\nSwept {len(results)} combinations of the {arguments['method']} strategy rules "
+          f"for {len(bars)} stocks in {time() - sweep_start:.2f}s")
+
+
+def fetch_and_store_stock_data(stocks, start_date, end_date=None, clear_existing=False):
     """
-    Fetch stock data for all stocks and store in database using parallel processing.
+    Fetch stock data for all stocks and store in database using concurrent async requests.
+    Prices already in the database are synced incrementally: only the missing bars are fetched and upserted.
 
     Args:
         stocks: List of stock objects
         start_date: Start date for data fetch
         end_date: End date for data fetch (optional)
         clear_existing: Whether to clear existing price data before storing
-        max_workers: Maximum number of concurrent threads
     """
     if arguments["use_existing_price_data"]:
         print("Using existing price data from database...")
         return
 
-    print("Fetching and storing stock price data in concurrent batches...")
+    print("Fetching and storing stock price data concurrently...")
 
-    try:
-        create_stock_price_table()
-    except peewee.OperationalError:
-        print("Table already exists")
-        if clear_existing:
-            print("Clearing existing data...")
-            delete_all_stock_prices()
-
-    # Create a lock for thread-safe database operations
-    db_lock = Lock()
-
-    # Create a market lookup dictionary to avoid creating Market objects repeatedly
-    market_lookup = {stock.exchange: Market(stock.exchange) for stock in stocks}
-
-    def process_batch(batch):
-        """Process a batch of stocks and store their prices"""
-        all_prices = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Create futures for each stock in the batch
-            future_to_stock = {
-                executor.submit(
-                    fetch_prices_for_stock,
-                    stock,
-                    market_lookup[stock.exchange],
-                    start_date
-                ): stock for stock in batch
-            }
-
-            # Process completed futures
-            for future in as_completed(future_to_stock):
-                stock_code, prices = future.result()
-                if prices:
-                    all_prices.extend(prices)
-
-        # Store the batch of prices in the database
-        if all_prices:
-            with db_lock:
-                try:
-                    bulk_add_stock_prices(all_prices)
-                except Exception as e:
-                    print(f"Error storing prices: {str(e)}")
-
-    # Process stocks in batches to manage memory usage
-    batch_size = 100
-    total_batches = (len(stocks) + batch_size - 1) // batch_size
-
-    with tqdm(total=len(stocks), desc='Fetching data') as pbar:
-        for i in range(0, len(stocks), batch_size):
-            batch = stocks[i:i + batch_size]
-            process_batch(batch)
-            pbar.update(len(batch))
+    # When scanning as of a date, only the bars before the date are used
+    if arguments["date"] is None:
+        latest_bar_date = get_current_date()
+    else:
+        latest_bar_date = get_previous_workday_from_date(arguments["date"])
+
+    sync_stock_prices(stocks, start_date, latest_bar_date, clear_existing)
 
 
 if __name__ == "__main__":
@@ -594,6 +658,10 @@ if __name__ == "__main__":
 
     arguments = define_scanner_args()
 
+    if arguments["offline"]:
+        print("Offline mode: replaying the cached API responses")
+        set_offline_mode()
+
     # Define the dates
     reporting_date_start = get_data_start_date(arguments["date"])
 
@@ -614,6 +682,10 @@ if __name__ == "__main__":
     if arguments["scan"]:
         check_update_date(active_markets)
         scan_stocks(active_markets)
+    if arguments["check_dtypes"]:
+        check_dtype_parity(active_markets)
+    if arguments["sweep"]:
+        sweep_thresholds(active_markets)
 
     print()
     end_time = time()
@@ -9,8 +9,8 @@ import warnings
 warnings.filterwarnings("ignore")
 
 from statistics import mean
-from peewee import IntegrityError
 import statistics
+from collections import namedtuple
 from collections.abc import Mapping
 
 import libs.gsheetobj as gsheetsobj
@@ -31,9 +31,14 @@ from libs.read_settings import read_config
 config = read_config()
 
 from libs.simulation import Simulation
-from libs.db import check_earliest_price_date, delete_all_prices, bulk_add_prices, get_price_from_db
+from libs.db import get_price_from_db, preload_prices
+from libs.pricesync import sync_stock_prices
 from libs.helpers import (create_report, define_simulator_args, data_filter_by_dates,
-                          prepare_data, prepare_rnd_data, filter_dataframe, data_filter_from_date)
+                          prepare_data, prepare_rnd_data, filter_dataframe, data_filter_from_date,
+                          get_previous_workday, get_current_workday)
+
+# Stock of the trades sheet in the form expected by the price sync
+SheetStock = namedtuple("SheetStock", "code exchange")
 
 pd.set_option("display.max_columns", None)
 
@@ -565,72 +570,23 @@ def run_simulation(ws, results_dict, take_profit_variant, close_higher_percentag
     return results_dict, sim
 
 
-# Get and save stock prices if not available for running the simulation
+# Sync the stored prices of the simulated stocks, reusing the prices already fetched by the scanner
 def get_stock_prices(sheet_df, prices_start_date):
-    stock_names = [item.stock for key, item in sheet_df.iterrows()]
-    stock_markets = [item.market for key, item in sheet_df.iterrows()]
-
     if not arguments["forced_price_update"]:
         print(
             f"Skipping price updates in db, as there is no flag --forced_price_update")
-        return {}
+        return
 
-    # Convert prices_start_date to date if it's not already
-    if isinstance(prices_start_date, str):
-        prices_start_date = datetime.strptime(prices_start_date, '%Y-%m-%d').date()
-    elif isinstance(prices_start_date, datetime):
-        prices_start_date = prices_start_date.date()
-
-    # Check if the Price table exists and get the earliest date
-    earliest_date = check_earliest_price_date()
-
-    # Ensure earliest_date is also a date object for comparison
-    if earliest_date:
-        if isinstance(earliest_date, datetime):
-            earliest_date = earliest_date.date()
-        elif isinstance(earliest_date, str):
-            earliest_date = datetime.strptime(earliest_date, '%Y-%m-%d').date()
-        ate_difference = abs((earliest_date - prices_start_date).days)
-        # Can add logic here if need to manage update of prices
-
-    # If the dates don't match or the table was just created, proceed with updating
-    delete_all_prices()  # Clear existing data
-
-    stock_prices = {}
-    prices_to_add = []
-    added_records = set()  # To keep track of unique (stock, date) combinations
-
-    for i, stock in enumerate(stock_names):
-        market = Market(stock_markets[i])
-        print(f"Getting stock data for {stock}{market.stock_suffix}")
-        stock_df = get_stock_data(f"{stock}{market.stock_suffix}", prices_start_date)
-        stock_df = stock_df[0]  # this is the actual dataframe
-
-        stock_prices[stock] = stock_df.to_dict('records')
-
-        # Prepare data for bulk insert, avoiding duplicates
-        for _, row in stock_df.iterrows():
-            record_key = (stock, row['timestamp'])
-            if record_key not in added_records:
-                prices_to_add.append({
-                    'stock': stock,
-                    'date': row['timestamp'].to_pydatetime(),
-                    'open': row['open'],
-                    'high': row['high'],
-                    'low': row['low'],
-                    'close': row['close']
-                })
-                added_records.add(record_key)
-
-    # Bulk insert the new price data
-    if prices_to_add:
-        try:
-            bulk_add_prices(prices_to_add)
-        except IntegrityError as e:
-            print(f"Error inserting prices: {e}")
-            print("Some records may already exist in the database. Continuing with available data.")
-
-    return stock_prices
+    # Unique stocks of the sheet with their exchanges
+    stocks = [SheetStock(code, exchange) for code, exchange in
+              sheet_df[["stock", "market"]].drop_duplicates("stock").itertuples(index=False)]
+
+    if config["locality"]["shift_update_day"]:
+        latest_bar_date = get_previous_workday()
+    else:
+        latest_bar_date = get_current_workday()
+
+    sync_stock_prices(stocks, prices_start_date, latest_bar_date)
 
 
 #########################################
@@ -692,6 +648,9 @@ if __name__ == "__main__":
     # Get information on the price data if the date is new
     get_stock_prices(ws, prices_start_date)
 
+    # Keep the prices of the simulated stocks in memory, so that the day loop does not query the database
+    preload_prices(ws["stock"].unique().tolist(), prices_start_date)
+
     if arguments["sampling"]:
         # Run simulations with sampling
         results_dict, simulations, reference_dates = run_simulations_with_sampling(ws, start_date)
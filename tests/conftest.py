@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The libs read config.yaml from the working directory, so the tests run from the repository root
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root)
@@ -0,0 +1,272 @@
+"""
+Frozen copy of td_indicators as it was before the single-pass kernel (libs/techanalysis.py),
+kept as the reference of tests/test_td_parity.py. Do not change it with the library.
+"""
+import numpy as np
+import pandas as pd
+
+
+def td_indicators(df):
+    """
+    Function to calculate TD indicator (Tone Vays methodology)
+    See http://www.mysmu.edu/faculty/christophert/QF206/Week_05.pdf
+    :param bars: pandas dataframe (ohlc)
+    :return: pandas dataframe
+    """
+
+    # Preparation
+    bars = df.copy()
+    bearish_flip, bullish_flip = False, False
+    setup_up, setup_down = 0, 0
+    size = bars["close"].size
+    # print "TDLib: Bars df size:", size
+
+    # Calculated fields
+    bars.loc[:, "td_setup"] = 0  # additional column: td setup number
+    bars.loc[:, "td_direction"] = ""  # td setup direction
+    bars.loc[
+        :, "move_extreme"
+    ] = None  # for stopping when the setup extreme is not calculated rigth
+
+    # Changing the types to preserve memory space
+    bars["td_setup"] = pd.to_numeric(bars["td_setup"], errors="coerce")
+    bars["move_extreme"] = pd.to_numeric(bars["move_extreme"], errors="coerce")
+
+    # Initial direction and values by default
+    direction_up, direction_down = False, False
+    move_extreme = None
+    countdown_up_flag, countdown_down_flag = False, False
+    countdown_up_list = []
+    countdown_down_list = []
+
+    # Defining tdst values
+    tdst_pre = None
+    tdst_level = None
+
+    # Defining correct move_extreme for completed TD1
+    move_extreme_pre = None
+    move_direction_pre = None
+
+    if bars["close"].iloc[5] > bars["close"].iloc[4]:
+        direction_up = True
+    elif bars["close"].iloc[5] < bars["close"].iloc[4]:
+        direction_down = True
+
+    # Shifting closes for further calculations
+    bars["shifted_1"] = bars["close"].shift(1)
+    bars["shifted_2"] = bars["close"].shift(2)
+    bars["shifted_4"] = bars["close"].shift(4)
+    bars["shifted_5"] = bars["close"].shift(5)
+
+    # Comparison operations, resulting in A (above) or B (below)
+    bars["bear_flip"] = bars.apply(
+        lambda x: True
+        if x["shifted_1"] >= x["shifted_5"] and x["close"] <= x["shifted_4"]
+        else False,
+        axis=1,
+    )
+    bars["bull_flip"] = bars.apply(
+        lambda x: True
+        if x["shifted_1"] <= x["shifted_5"] and x["close"] >= x["shifted_4"]
+        else False,
+        axis=1,
+    )
+    bars["bear_reset"] = bars.apply(
+        lambda x: True if x["close"] > x["shifted_4"] else False, axis=1
+    )
+    bars["bull_reset"] = bars.apply(
+        lambda x: True if x["close"] < x["shifted_4"] else False, axis=1
+    )
+    # For move_extremes
+    bars["shifted_1_low"] = bars["low"].shift(1)
+    bars["shifted_2_low"] = bars["low"].shift(2)
+    bars["shifted_1_high"] = bars["high"].shift(1)
+    bars["shifted_2_high"] = bars["high"].shift(2)
+    # Resulting move_extreme
+    bars["max_1_2"] = bars[["shifted_1_high", "shifted_2_high"]].max(axis=1)
+    bars["min_1_2"] = bars[["shifted_1_low", "shifted_2_low"]].min(axis=1)
+    # For countdowns
+    bars["if_countdown_down"] = bars.apply(
+        lambda x: True if x["close"] <= x["shifted_2_low"] else False, axis=1
+    )
+    bars["if_countdown_up"] = bars.apply(
+        lambda x: True if x["close"] >= x["shifted_2_high"] else False, axis=1
+    )
+
+    np_setup = np.zeros(shape=(size, 1), dtype=int)
+    np_direction = np.empty(shape=(size, 1), dtype=object)
+    np_move_extremes = np.empty(
+        shape=(size, 1)
+    )  # will have the 1s values per sandy's methodology
+    np_move_extremes.fill(np.nan)
+    # Countdown
+    np_countdown_up = np.zeros(shape=(size, 1), dtype=int)
+    np_countdown_down = np.zeros(shape=(size, 1), dtype=int)
+    # TDST
+    np_tdst = np.empty(shape=(size, 1), dtype=float)
+    np_tdst.fill(np.nan)
+
+    ## Looping through
+    i = 0
+    for bar_row in bars.itertuples():
+        if i > 5:  # need 6 candles to start
+            ## Price flip
+            bearish_flip, bullish_flip = False, False
+
+            if setup_up == 9:
+                setup_up = 0  # restart count
+            if setup_down == 9:
+                setup_down = 0  # restart count
+
+            # Flips - bearish
+            if bar_row.bear_flip:
+                bearish_flip = True
+                direction_down = True
+                bullish_flip = False
+                tdst_pre = bar_row.high  # high of the move
+
+            # Flips - bullish
+            if bar_row.bull_flip:
+                bullish_flip = True
+                direction_up = True
+                bearish_flip = False
+                tdst_pre = bar_row.high  # low of the move
+
+            if bearish_flip and direction_up:
+                direction_up = False
+                setup_down = 1
+            if bullish_flip and direction_down:
+                direction_down = False
+                setup_up = 1
+
+            ## TD Setup (sequential)
+            if direction_down and not bearish_flip:
+                setup_down += 1  # having it like this fixes the bug with TD1 appearing several times in a row
+
+            if direction_up and not bullish_flip:
+                setup_up += 1  # having it like this fixes the bug with TD1 appearing several times in a row
+
+            # Move extreme change calc: 1 -> 2 count it in, not just on flip
+            if direction_up and setup_up == 1:
+                move_extreme_pre = min(
+                    bar_row.open, bar_row.close
+                )  # lowest of the candle comparing open and close
+                move_direction_pre = "up"
+            if direction_down and setup_down == 1:
+                move_extreme_pre = max(bar_row.open, bar_row.close)
+                move_direction_pre = "down"
+
+            # Move extreme recalculation
+            if move_direction_pre == "up" and direction_up and setup_up == 2:
+                move_extreme = move_extreme_pre
+            if move_direction_pre == "down" and direction_down and setup_down == 2:
+                move_extreme = move_extreme_pre
+
+            # Filling the np arrays
+            if direction_down:
+                np_setup[i] = setup_down
+                np_direction[i] = "red"  # down
+            if direction_up:
+                np_setup[i] = setup_up
+                np_direction[i] = "green"  # up
+
+            # Common for any direction
+            np_move_extremes[i] = move_extreme
+
+            # Countdowns check
+            # Will need to store a list with counters
+            # If there is active countdown but we get a 9 in the same direction again - one more countdown is added
+            # If a 9 in different direction - the previous direction countdown should stop
+            if direction_up and setup_up == 9:
+                countdown_up_flag = True
+                countdown_down_flag = False  # also in this case delete countdowns
+                countdown_down_list = []
+                countdown_up_list.append(0)  # reserving place for counter increase
+                tdst_level = tdst_pre  # updating the TDST value
+            if direction_down and setup_down == 9:
+                countdown_down_flag = True
+                countdown_up_flag = False
+                countdown_up_list = []
+                countdown_down_list.append(0)  # reserving place for counter increase
+                tdst_level = tdst_pre  # updating the TDST value
+
+            # Writing TDST on every iteration
+            np_tdst[i] = tdst_level
+
+            """ TD seq buy: 
+            If bar 9 has a close less than or equal to the low of two bars earlier
+                then bar 9 becomes 1 countdown
+            If not met - then countdown 1 postponed until condition is met and continues until total of 13 closes
+            Each should be less or equal to the low 2 bars earlier
+            If one of elements in on 13, delete it.
+            This is a simplified approach as completion of 13 also requires comparison with 8th setup bar
+            """
+            if direction_up and countdown_up_flag and bar_row.if_countdown_up:
+                countdown_up_list = [x + 1 for x in countdown_up_list]
+                countdown_up_list = [x for x in countdown_up_list if x != 13]
+            if countdown_up_list != []:
+                np_countdown_up[i] = max(
+                    countdown_up_list
+                )  # this is enough for our purposes
+            if direction_down and countdown_down_flag and bar_row.if_countdown_down:
+                countdown_down_list = [x + 1 for x in countdown_down_list]
+                countdown_down_list = [x for x in countdown_down_list if x != 13]
+            if countdown_down_list != []:
+                np_countdown_down[i] = max(
+                    countdown_down_list
+                )  # this is enough for our purposes
+
+        # counter increase
+        i += 1
+
+    # Join np arrays with the dataframe
+    setup_df = pd.DataFrame(data=np_setup)
+    setup_df.index = bars.index.copy()
+    bars["td_setup"] = setup_df
+
+    setup_dir = pd.DataFrame(data=np_direction)
+    setup_dir.index = bars.index.copy()
+    bars["td_direction"] = setup_dir
+
+    move_extreme_df = pd.DataFrame(data=np_move_extremes)
+    move_extreme_df.index = bars.index.copy()
+    bars["move_extreme"] = move_extreme_df
+
+    np_countdown_up_df = pd.DataFrame(data=np_countdown_up)
+    np_countdown_up_df.index = bars.index.copy()
+    bars["countdown_up"] = np_countdown_up_df
+
+    np_countdown_down_df = pd.DataFrame(data=np_countdown_down)
+    np_countdown_down_df.index = bars.index.copy()
+    bars["countdown_down"] = np_countdown_down_df
+
+    # Adding tdst
+    np_tdst_df = pd.DataFrame(data=np_tdst)
+    np_tdst_df.index = bars.index.copy()
+    bars["tdst"] = np_tdst_df
+
+    # Change types to save memory
+    bars["countdown_up"] = bars.countdown_up.astype("int8")
+    bars["countdown_down"] = bars.countdown_down.astype("int8")
+    bars["td_setup"] = bars.td_setup.astype("int8")
+    bars["open"] = bars.open.astype("float32")
+    bars["high"] = bars.high.astype("float32")
+    bars["low"] = bars.low.astype("float32")
+    bars["close"] = bars.close.astype("float32")
+    # new
+    bars["tdst"] = bars.tdst.astype("float32")
+
+    bars["timestamp"] = df["timestamp"]
+
+    # Returning only what we need
+    return bars[
+        [
+            "timestamp",
+            "td_setup",
+            "td_direction",
+            "move_extreme",
+            "countdown_down",
+            "countdown_up",
+            "tdst",
+        ]
+    ]
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from libs.fetcher import AsyncPriceFetcher
+from libs.http_cache import response_cache
+
+
+@pytest.fixture(autouse=True)
+def no_response_cache(monkeypatch):
+    # Every request reaches the stand-in server
+    monkeypatch.setattr(response_cache, "enabled", False)
+
+
+def fetch(responses, **fetcher_params):
+    """
+    Get a json from a local stand-in server answering the requests with the responses in turn (the last one repeats)
+
+    Returns:
+        tuple: (parsed json or None, list of the request times)
+    """
+    request_times = []
+
+    async def handler(request):
+        request_times.append(time.monotonic())
+        return responses[min(len(request_times), len(responses)) - 1]()
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/technical/{code}", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            params = dict(dict(api_key=None, backoff_base=0.01, backoff_max=0.05), **fetcher_params)
+            async with AsyncPriceFetcher(base_url=f"http://127.0.0.1:{port}", **params) as fetcher:
+                return await fetcher.get_json(f"{fetcher.base_url}/technical/AAPL", {"fmt": "json"})
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main()), request_times
+
+
+def test_ok_response_is_parsed():
+    data, request_times = fetch([lambda: web.json_response([{"close": 1.5}])])
+    assert data == [{"close": 1.5}]
+    assert len(request_times) == 1
+
+
+def test_not_found_is_not_retried():
+    data, request_times = fetch([lambda: web.Response(status=404)])
+    assert data is None
+    assert len(request_times) == 1
+
+
+def test_rate_limited_request_waits_for_retry_after():
+    # The backoff without Retry-After would be much longer than the test
+    data, request_times = fetch(
+        [lambda: web.Response(status=429, headers={"Retry-After": "0.3"}), lambda: web.json_response({"ok": True})],
+        backoff_base=60, backoff_max=60,
+    )
+    assert data == {"ok": True}
+    assert len(request_times) == 2
+    assert request_times[1] - request_times[0] >= 0.3
+
+
+def test_retries_stop_at_the_limit():
+    data, request_times = fetch([lambda: web.Response(status=503)], max_retries=3)
+    assert data is None
+    assert len(request_times) == 3
+
+
+def test_no_request_without_retries():
+    data, request_times = fetch([lambda: web.json_response([])], max_retries=0)
+    assert data is None
+    assert request_times == []
+
+
+def test_unexpected_status_is_not_retried():
+    data, request_times = fetch([lambda: web.Response(status=403)])
+    assert data is None
+    assert len(request_times) == 1
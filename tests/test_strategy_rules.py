@@ -0,0 +1,181 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import scanner
+from libs import signal
+from libs.feature_cache import feature_cache
+from libs.panel import PricePanel
+from libs.screening import UniverseBars
+from libs.strategy_rules import compile_strategy, config as rules_config
+
+STOCKS_NUMBER = 40
+DATES = [None, "2025-01-15"]
+POLICIES = ["full", "compact"]
+
+
+def make_prices(stocks_number, days_number, seed):
+    """
+    Random walk prices of the stocks, with short histories, gaps down on the last bar
+    and flat stretches (undefined StochRSI, equal closes for the TD count)
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end="2025-03-03", periods=days_number)
+    frames = []
+    for number in range(stocks_number):
+        close = 50 * np.exp(np.cumsum(rng.normal(0.001, 0.025, days_number)))
+        open_ = close * np.exp(rng.normal(0, 0.01, days_number))
+        high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.01, days_number)))
+        low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.01, days_number)))
+        volume = rng.uniform(1e5, 2e6, days_number)
+        start = int(rng.integers(days_number - 120, days_number - 5)) if number % 7 == 0 else 0
+        if number % 5 == 1:
+            open_[-1], high[-1], low[-1], close[-1] = (value[-1] * 0.88 for value in (open_, high, low, close))
+        if number % 11 == 2:
+            open_[-30:], high[-30:], low[-30:], close[-30:] = 20.0, 20.0, 20.0, 20.0
+        frames.append(pd.DataFrame({
+            "stock": f"S{number}", "date": dates[start:], "open": open_[start:], "high": high[start:],
+            "low": low[start:], "close": close[start:], "volume": volume[start:],
+        }))
+    prices = pd.concat(frames, ignore_index=True)
+    prices[["open", "high", "low", "close"]] = prices[["open", "high", "low", "close"]].round(2)
+    prices["volume"] = prices["volume"].round()
+    return prices
+
+
+@pytest.fixture(scope="module")
+def prices():
+    return make_prices(STOCKS_NUMBER, 300, seed=3)
+
+
+@pytest.fixture(scope="module")
+def universes(prices):
+    # Panel, universe bars and the per-stock frames of the scanner for each dtype policy and date
+    universes = {}
+    for policy in POLICIES:
+        panel = PricePanel.from_frame(prices, policy)
+        for date in DATES:
+            frames = {}
+            for code in panel.codes:
+                ohlc_daily, volume_daily = panel.get_stock_price_data(code)
+                if date is not None:
+                    ohlc_daily = ohlc_daily[ohlc_daily["timestamp"] < date]
+                    volume_daily = volume_daily[volume_daily["timestamp"] < date]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    daily, weekly = scanner.generate_indicators_daily_weekly(ohlc_daily)
+                frames[code] = (daily, volume_daily, weekly)
+            universes[(policy, date)] = (UniverseBars(panel, date=date), frames)
+    return universes
+
+
+@pytest.fixture
+def trigger_type(request, monkeypatch):
+    # The signal functions and the strategy rules read the trigger type from their own config
+    for settings in (signal.config, rules_config):
+        monkeypatch.setitem(settings["strategy"]["anx"], "trigger_type", request.param)
+    return request.param
+
+
+def mri_conditions(daily, volume_daily, weekly):
+    # Conditions of signal.bullish_mri_based under the names of the mri_bull strategy
+    ma_daily = {f"ma{length}": signal.moving_average(daily, length) for length in (10, 20, 30)}
+    ma_weekly = {f"ma{length}": signal.moving_average(weekly, length) for length in (10, 20, 30)}
+    return dict(
+        daily_td=daily["td_direction"].iloc[-1] == "green",
+        weekly_td=weekly["td_direction"].iloc[-1] == "green",
+        consensio=signal.ma_consensio(signal.slow_ma_inavailable(ma_daily["ma30"]), ma_daily, 3),
+        ma_rising=signal.ma_increasing(ma_daily, 3),
+        not_overextended=signal.weekly_not_overextended(weekly),
+        higher_close=daily["close"].iloc[-1] > daily["close"].iloc[-2],
+        volume_spike=signal.volume_spike(volume_daily),
+        upper=signal.recent_close_above_last(daily.copy()),
+        last_green=signal.last_is_green(daily),
+        weekly_close_above_ma=signal.weekly_close_above_ma(ma_weekly, weekly),
+        broad_range=signal.broad_range(weekly),
+        stoch_rsi_in_range=signal.stoch_rsi_in_range(daily),
+    )
+
+
+def assert_strategy_parity(strategy_name, universe, conditions, signal_function):
+    """
+    :param conditions: function of the per-stock frames returning the expected {condition: bool}
+    :param signal_function: signal function of libs/signal.py the strategy re-expresses
+    """
+    bars, frames = universe
+    feature_cache.clear()
+    masks = compile_strategy(strategy_name).evaluate(bars)
+
+    for code, (daily, volume_daily, weekly) in frames.items():
+        enough_bars = daily is not None
+        assert bool(masks["enough_bars"][code]) == enough_bars, code
+        if not enough_bars:
+            assert not masks["signal"][code], code
+            continue
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected_conditions = conditions(daily, volume_daily, weekly)
+            expected_signal = signal_function(daily, volume_daily, weekly, output=False)[0]
+        for condition, expected in expected_conditions.items():
+            assert bool(masks[condition][code]) == bool(expected), (code, condition)
+        assert bool(masks["signal"][code]) == bool(expected_signal), code
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("date", DATES)
+@pytest.mark.parametrize("trigger_type", ["ma_cross", "price_cross", "both"], indirect=True)
+def test_anx_bull_matches_signal(universes, policy, date, trigger_type):
+    assert_strategy_parity(
+        "anx_bull", universes[(policy, date)],
+        lambda daily, volume_daily, weekly: signal.bullish_anx_rules.evaluate(daily, weekly, verbose=True)[1],
+        signal.bullish_anx_based,
+    )
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("date", DATES)
+@pytest.mark.parametrize("trigger_type", ["ma_cross"], indirect=True)
+def test_anx_bear_matches_signal(universes, policy, date, trigger_type):
+    # The bearish signal only supports the ma_cross trigger
+    assert_strategy_parity(
+        "anx_bear", universes[(policy, date)],
+        lambda daily, volume_daily, weekly: signal.bearish_anx_rules.evaluate(daily, weekly, verbose=True)[1],
+        signal.bearish_anx_based,
+    )
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("date", DATES)
+def test_earnings_bull_matches_signal(universes, policy, date):
+    assert_strategy_parity(
+        "earnings_bull", universes[(policy, date)],
+        lambda daily, volume_daily, weekly: {
+            "gap_down": signal.earnings_gap_down(daily, volume_daily, weekly, output=False)[0]
+        },
+        signal.earnings_gap_down,
+    )
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("date", DATES)
+def test_mri_bull_matches_signal(universes, policy, date):
+    assert_strategy_parity("mri_bull", universes[(policy, date)], mri_conditions, signal.bullish_mri_based)
+
+
+def test_masks_take_both_outcomes(universes):
+    # The synthetic universe exercises both outcomes, so the parity is not only checked on constant masks
+    # (the conditions of the price trigger and the overextension pass for all the stocks with the default config)
+    bars, _ = universes[("full", None)]
+    varying = {
+        "anx_bull": ["enough_bars", "trigger", "bullish_sar", "ma50_rising"],
+        "anx_bear": ["trigger", "bearish_sar", "signal"],
+        "earnings_bull": ["gap_down", "signal"],
+        "mri_bull": ["daily_td", "weekly_td", "consensio", "ma_rising", "higher_close", "volume_spike", "upper",
+                     "last_green", "weekly_close_above_ma", "broad_range", "stoch_rsi_in_range"],
+    }
+    for strategy_name, conditions in varying.items():
+        masks = compile_strategy(strategy_name).evaluate(bars)
+        for condition in conditions:
+            assert 0 < masks[condition].sum() < len(bars), (strategy_name, condition)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from libs.stocktools import ohlc_daily_to_weekly
+from libs.techanalysis import td_indicators, td_direction_batch
+from td_baseline import td_indicators as baseline_td_indicators
+
+
+def make_bars(bars_number, decimals, seed):
+    # Random walk prices, rounding to few decimals gives many equal closes (flips and resets on ties)
+    rng = np.random.default_rng(seed)
+    close = np.round(50 * np.exp(np.cumsum(rng.normal(0, 0.02, bars_number))), decimals)
+    open_ = np.round(close * np.exp(rng.normal(0, 0.01, bars_number)), decimals)
+    high = np.maximum(open_, close) + np.round(np.abs(rng.normal(0, 0.3, bars_number)), decimals)
+    low = np.minimum(open_, close) - np.round(np.abs(rng.normal(0, 0.3, bars_number)), decimals)
+    return pd.DataFrame({
+        "timestamp": pd.bdate_range("2015-01-01", periods=bars_number),
+        "open": open_, "high": high, "low": low, "close": close,
+    })
+
+
+DAILY_CASES = [(bars_number, decimals) for bars_number in (6, 7, 20, 300, 1500) for decimals in (0, 1, 3)]
+WEEKLY_CASES = [(bars_number, decimals) for bars_number in (300, 1500) for decimals in (0, 1, 3)]
+
+
+def assert_td_parity(bars):
+    expected = baseline_td_indicators(bars)
+    result = td_indicators(bars)
+
+    assert list(result.columns) == list(expected.columns)
+    for column in ("td_setup", "move_extreme", "countdown_down", "countdown_up", "tdst"):
+        pd.testing.assert_series_equal(result[column], expected[column], check_names=True)
+    pd.testing.assert_series_equal(result["timestamp"], expected["timestamp"])
+
+    # td_direction is categorical now, with the same green/red labels and missing values before the first setup
+    def labels(td_direction):
+        return [label if isinstance(label, str) else None for label in td_direction.astype(object)]
+
+    assert labels(result["td_direction"]) == labels(expected["td_direction"])
+
+
+@pytest.mark.parametrize("bars_number, decimals", DAILY_CASES)
+def test_daily_td_indicators_match_baseline(bars_number, decimals):
+    assert_td_parity(make_bars(bars_number, decimals, seed=bars_number + decimals))
+
+
+@pytest.mark.parametrize("bars_number, decimals", WEEKLY_CASES)
+def test_weekly_td_indicators_match_baseline(bars_number, decimals):
+    daily = make_bars(bars_number, decimals, seed=bars_number * 10 + decimals)
+    assert_td_parity(ohlc_daily_to_weekly(daily.copy()))
+
+
+def test_flat_prices_match_baseline():
+    bars = make_bars(200, 2, seed=7)
+    bars.loc[50:120, ["open", "high", "low", "close"]] = 20.0
+    assert_td_parity(bars)
+
+
+def test_td_direction_batch_matches_td_indicators():
+    stocks = [make_bars(bars_number, decimals, seed=seed)
+              for seed, (bars_number, decimals) in enumerate([(300, 0), (250, 1), (120, 3), (5, 2), (300, 2)])]
+    depth = max(len(bars) for bars in stocks)
+
+    def matrix(field):
+        # Right aligned columns with NaN before the first bar of each stock
+        values = np.full((depth, len(stocks)), np.nan)
+        for column, bars in enumerate(stocks):
+            values[depth - len(bars):, column] = bars[field].to_numpy()
+        return values
+
+    directions = td_direction_batch(matrix("open"), matrix("high"), matrix("low"), matrix("close"))
+    for column, bars in enumerate(stocks):
+        if len(bars) < 6:
+            assert not directions[:, column].any()
+            continue
+        expected = td_indicators(bars)["td_direction"].map({"green": 1, "red": -1}).astype(float).fillna(0)
+        assert directions[depth - len(bars):, column].tolist() == expected.astype(int).tolist()